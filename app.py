@@ -1,4 +1,13 @@
+import sys
+
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    if "--reload" in sys.argv:
+        # Development: single process, restarted on code changes
+        uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+    else:
+        # Production: preloaded multi-process server configured in gunicorn.conf.py
+        from gunicorn.app.wsgiapp import run
+        sys.argv = ["gunicorn", "-c", "gunicorn.conf.py", "app.main:app"]
+        run()
@@ -1,11 +1,17 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 
-from app.api.routes import auth, api_keys, data, utils
+from app.api.routes import auth, api_keys, data, changes, audit, tenants, utils, admin
+from app.core.rate_limit import enforce_rate_limit
 
 api_router = APIRouter()
 
 # Include all route modules
 api_router.include_router(auth.router, tags=["authentication"])
-api_router.include_router(api_keys.router, tags=["api keys"])
-api_router.include_router(data.router, tags=["data"])
+# Tenant-facing routes are rate limited by the tenant's plan
+api_router.include_router(api_keys.router, tags=["api keys"], dependencies=[Depends(enforce_rate_limit)])
+api_router.include_router(data.router, tags=["data"], dependencies=[Depends(enforce_rate_limit)])
+api_router.include_router(changes.router, tags=["data"], dependencies=[Depends(enforce_rate_limit)])
+api_router.include_router(tenants.router, tags=["tenants"], dependencies=[Depends(enforce_rate_limit)])
+api_router.include_router(audit.router, tags=["audit"], dependencies=[Depends(enforce_rate_limit)])
 api_router.include_router(utils.router, tags=["utilities"])
+api_router.include_router(admin.router, tags=["admin"])
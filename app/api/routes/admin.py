@@ -0,0 +1,92 @@
+import json
+import uuid
+from typing import Optional
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import PROFILE_MAX_SECONDS, WORKLOAD_TOP_KEYS
+from app.core.audit import write_audit_log
+from app.core.profiling import capture_profile, ProfileBusyError
+from app.core.revocation import revocation_list
+from app.core.workload import workload_tracker
+from app.core.security import get_current_admin_user
+from app.db.redis import get_main_redis
+from app.tasks.tasks import huey, capture_worker_profile
+
+router = APIRouter(prefix="/admin")
+
+@router.post("/profile", response_class=PlainTextResponse)
+async def profile_api_process(
+    kind: str = Query("cpu", pattern="^(cpu|memory)$"),
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    admin=Depends(get_current_admin_user),
+):
+    # Profile the API process that serves this request; other requests keep being served meanwhile
+    try:
+        return await run_in_threadpool(capture_profile, kind, seconds)
+    except ProfileBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@router.post("/profile/worker")
+async def profile_worker(
+    kind: str = Query("cpu", pattern="^(cpu|memory)$"),
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    admin=Depends(get_current_admin_user),
+):
+    # Runs inside whichever Huey worker picks up the task
+    capture_id = uuid.uuid4().hex
+    capture_worker_profile(capture_id, kind, seconds)
+    return {"status": "profile capture scheduled", "capture_id": capture_id}
+
+@router.get("/profile/worker/{capture_id}", response_class=PlainTextResponse)
+async def get_worker_profile(capture_id: str, admin=Depends(get_current_admin_user)):
+    result = huey.get(f"profile:{capture_id}", peek=True)
+    if result is None:
+        return PlainTextResponse("Profile capture not finished yet", status_code=202)
+    return result
+
+@router.post("/users/{username}/disable")
+def disable_user(username: str, admin=Depends(get_current_admin_user)):
+    redis_client = get_main_redis()
+    users = json.loads(redis_client.get("fake_users_db") or "{}")
+    if username not in users:
+        raise HTTPException(status_code=404, detail="User not found")
+    users[username]["disabled"] = True
+    redis_client.set("fake_users_db", json.dumps(users))
+    
+    # Tokens already issued still claim the user is enabled, so revoke them all
+    revocation_list.revoke_user(username)
+    
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "disable_user",
+        "username": username,
+        "admin": admin.username,
+        "tenant_id": users[username].get("tenant_id"),
+    })
+    
+    return {"status": "success", "username": username}
+
+@router.post("/users/{username}/revoke-tokens")
+def revoke_user_tokens(username: str, admin=Depends(get_current_admin_user)):
+    revocation_list.revoke_user(username)
+    
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "revoke_user_tokens",
+        "username": username,
+        "admin": admin.username,
+    })
+    
+    return {"status": "success", "username": username}
+
+@router.get("/workload")
+def get_workload(
+    tenant_id: Optional[str] = None,
+    limit: int = Query(20, gt=0, le=WORKLOAD_TOP_KEYS),
+    admin=Depends(get_current_admin_user),
+):
+    # Hot keys and per-tenant load of the last complete window, merged across all pods
+    return workload_tracker.read_window(tenant_id=tenant_id, limit=limit)
@@ -2,15 +2,18 @@ import json
 import uuid
 from datetime import datetime, timezone
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import ORJSONResponse
 from typing import Annotated, List
 
+from app.core.audit import write_audit_log
 from app.core.security import get_current_active_user
+from app.core.serialization import ORJSONRoute
 from app.models.user import User
 from app.models.api_key import APIKey, APIKeyCreate
-from app.db.redis import main_redis, logs_redis, get_api_keys_for_tenant
+from app.db.redis import get_api_keys_for_tenant
 from app.db.redis_utils import create_redis_client
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute, default_response_class=ORJSONResponse)
 
 @router.get("/api-keys", response_model=List[APIKey])
 async def list_api_keys(current_user: Annotated[User, Depends(get_current_active_user)]):
@@ -41,18 +44,14 @@ async def create_api_key(key_data: APIKeyCreate, current_user: Annotated[User, D
     api_keys_data[key_id] = api_key
     redis_client.set("fake_api_keys_db", json.dumps(api_keys_data))
     
-    # Create a fresh Redis client for logs
-    logs_client = create_redis_client(db=1)
-    
     # Log the creation
-    logs_entry = json.dumps({
+    write_audit_log({
         "timestamp": datetime.now().isoformat(),
         "action": "create_api_key",
         "name": key_data.name,
         "tenant_id": current_user.tenant_id,
         "username": current_user.username,
     })
-    logs_client.lpush("logs:audit", logs_entry)
     
     # Return without tenant_id in the response
     return APIKey(**{k: v for k, v in api_key.items() if k != "tenant_id"})
@@ -0,0 +1,57 @@
+import time
+from datetime import datetime, timedelta, timezone
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+
+from app.core.audit_query import query_audit_log, decode_cursor, AuditQueryError, InvalidCursorError, NS
+from app.core.config import AUDIT_QUERY_MAX_RANGE_HOURS, AUDIT_QUERY_SPLIT_LIMIT
+from app.core.security import get_current_active_user
+from app.models.audit import AuditPage
+
+router = APIRouter()
+
+def _as_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Times given without an offset are taken as UTC"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+@router.get("/audit", response_model=AuditPage)
+def read_audit_log(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    action: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    user=Depends(get_current_active_user),
+):
+    # Later pages continue from the cursor; the range end is fixed by the first page
+    if cursor:
+        try:
+            after, skip, end_ns = decode_cursor(cursor)
+        except InvalidCursorError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        # Cursors are not signed, so hold them to the same bounds as a first page. No more
+        # entries than one Loki query returns can share a timestamp, which bounds skip.
+        if (skip < 0 or skip > AUDIT_QUERY_SPLIT_LIMIT or after >= end_ns or end_ns > time.time_ns()
+                or end_ns - after > AUDIT_QUERY_MAX_RANGE_HOURS * 3600 * NS):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    else:
+        end = _as_utc(end) or datetime.now(timezone.utc)
+        start = _as_utc(start) or end - timedelta(hours=1)
+        if start >= end:
+            raise HTTPException(status_code=400, detail="start must be before end")
+        if end - start > timedelta(hours=AUDIT_QUERY_MAX_RANGE_HOURS):
+            raise HTTPException(status_code=400, detail=f"Range exceeds {AUDIT_QUERY_MAX_RANGE_HOURS} hours")
+        # Nothing is logged after now, and the cursor's end must not lie in the future
+        end = min(end, datetime.now(timezone.utc))
+        if start >= end:
+            return {"entries": [], "next_cursor": None}
+        after, skip, end_ns = int(start.timestamp() * NS), 0, int(end.timestamp() * NS)
+    
+    try:
+        entries, next_cursor = query_audit_log(user.tenant_id, action, after, skip, end_ns, limit)
+    except AuditQueryError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    
+    return {"entries": entries, "next_cursor": next_cursor}
@@ -1,17 +1,29 @@
 import json
 from datetime import timedelta, datetime
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, Form, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
 from typing import Annotated
 
-from app.core.security import authenticate_user, create_access_token
+from app.core.refresh_tokens import (
+    issue_refresh_token, rotate_refresh_token, revoke_refresh_token, InvalidRefreshTokenError,
+    RefreshTokenReuseError,
+)
+from app.core.revocation import revocation_list
+from app.core.security import authenticate_user, create_access_token, decode_access_token, oauth2_scheme
+from app.core.audit import write_audit_log
 from app.core.config import ACCESS_TOKEN_EXPIRE_MINUTES
 from app.models.token import Token
-from app.db.redis import main_redis
+from app.db.redis import get_user, get_main_redis
 from app.db.redis_utils import create_redis_client
 
 router = APIRouter()
 
+def create_user_access_token(user) -> str:
+    return create_access_token(
+        data={"sub": user.username, "tenant_id": user.tenant_id, "disabled": bool(user.disabled)},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
+
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()]
@@ -22,19 +34,15 @@ async def login_for_access_token(
     # Attempt to authenticate the user
     user = authenticate_user(redis_client, form_data.username, form_data.password)
     
-    # Create a fresh Redis client for logs
-    logs_client = create_redis_client(db=1)
-    
     if not user:
         # Log failed login attempt
-        logs_entry = json.dumps({
+        write_audit_log({
             "timestamp": datetime.now().isoformat(),
             "action": "login_failed",
             "username": form_data.username,
             "tenant_id": "unknown",  # We don't know the tenant_id for failed logins
             "reason": "Incorrect username or password"
         })
-        logs_client.lpush("logs:audit", logs_entry)
         
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -42,21 +50,95 @@ async def login_for_access_token(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Generate access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username, "tenant_id": user.tenant_id}, 
-        expires_delta=access_token_expires
-    )
+    # Generate access token, and a refresh token to renew it without logging in again
+    access_token = create_user_access_token(user)
+    refresh_token = issue_refresh_token(user.username, user.tenant_id)
     
     # Log successful login
-    logs_entry = json.dumps({
+    write_audit_log({
         "timestamp": datetime.now().isoformat(),
         "action": "login_success",
         "username": user.username,
         "tenant_id": user.tenant_id,
         "token_expires_minutes": ACCESS_TOKEN_EXPIRE_MINUTES
     })
-    logs_client.lpush("logs:audit", logs_entry)
     
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@router.post("/token/refresh", response_model=Token)
+async def refresh_access_token(refresh_token: Annotated[str, Form()]):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    
+    # Rotate the refresh token; no password hashing is involved
+    try:
+        new_refresh_token, username, tenant_id, created_at = rotate_refresh_token(refresh_token)
+    except RefreshTokenReuseError as e:
+        # Log the reuse: the token may have been stolen, so its family was revoked
+        write_audit_log({
+            "timestamp": datetime.now().isoformat(),
+            "action": "refresh_token_reused",
+            "username": e.username,
+            "tenant_id": e.tenant_id,
+        })
+        raise credentials_exception
+    except InvalidRefreshTokenError:
+        raise credentials_exception
+    
+    # The user may have been disabled, or had their tokens revoked, since logging in
+    user = get_user(get_main_redis(), username)
+    if user is None or user.disabled or revocation_list.is_revoked({"sub": username, "iat": created_at}):
+        revoke_refresh_token(new_refresh_token)
+        raise credentials_exception
+    
+    # Log the refresh
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "token_refresh",
+        "username": username,
+        "tenant_id": tenant_id,
+        "token_expires_minutes": ACCESS_TOKEN_EXPIRE_MINUTES,
+    })
+    
+    return {"access_token": create_user_access_token(user), "token_type": "bearer", "refresh_token": new_refresh_token}
+
+@router.post("/token/revoke")
+async def revoke_token(refresh_token: Annotated[str, Form()]):
+    # Unknown or already revoked tokens are not an error (RFC 7009)
+    try:
+        owner = revoke_refresh_token(refresh_token)
+    except InvalidRefreshTokenError:
+        owner = None
+    
+    if owner is not None:
+        # Log the revocation
+        write_audit_log({
+            "timestamp": datetime.now().isoformat(),
+            "action": "revoke_refresh_token",
+            "username": owner[0],
+            "tenant_id": owner[1],
+        })
+    
+    return {"status": "success"}
+
+@router.post("/logout")
+async def logout(token: Annotated[str, Depends(oauth2_scheme)]):
+    claims = decode_access_token(token)
+    if "jti" not in claims:
+        raise HTTPException(status_code=400, detail="Token cannot be revoked individually")
+    
+    # Every pod rejects the token within one revocation sync interval
+    revocation_list.revoke_token(claims["jti"], claims["exp"])
+    
+    # Log the logout
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "logout",
+        "username": claims["sub"],
+        "tenant_id": claims.get("tenant_id"),
+    })
+    
+    return {"status": "success"}
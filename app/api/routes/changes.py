@@ -0,0 +1,29 @@
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import Optional
+
+from app.core.security import get_current_active_user
+from app.db.changes import iter_changes, parse_event_id
+
+router = APIRouter()
+
+@router.get("/changes")
+async def stream_changes(
+    key: Optional[str] = None,
+    prefix: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+    after: Optional[str] = Query(None, description="Resume after this event id (instead of the Last-Event-ID header)"),
+    user=Depends(get_current_active_user),
+):
+    # Server-sent events for the tenant's /data items, optionally only one key or a key prefix
+    resume_from = after or last_event_id
+    if resume_from is not None:
+        resume_from = parse_event_id(resume_from)
+        if resume_from is None:
+            raise HTTPException(status_code=400, detail="Invalid event id")
+    
+    return StreamingResponse(
+        iter_changes(user.tenant_id, key, prefix, resume_from),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -1,41 +1,63 @@
 import json
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import Dict, Any
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Dict, Any, List, Optional
 
+from app.core.audit import write_audit_log
+from app.core.config import BLOB_MAX_BYTES
 from app.core.security import get_current_active_user
-from app.models.data import KeyValueItem
-from app.db.redis import main_redis, logs_redis, get_namespaced_key
-from app.db.redis_utils import create_redis_client
-from app.tasks.tasks import audit_log_expiration
+from app.core.serialization import ORJSONRoute, raw_json_response
+from app.core.workload import record_access
+from app.models.data import KeyValueItem, IncrementRequest, AppendRequest, SetIfGreaterRequest, ItemPatch
+from app.db.redis import get_namespaced_key
+from app.db.changes import publish_change
+from app.db.blobs import store_blob, get_manifest, iter_blob, delete_blob, BlobTooLargeError, BlobConflictError
+from app.db.items import (
+    insert_item, read_item, replace_item, remove_item, parse_etags, etag_header, ItemNotFoundError,
+    PreconditionFailedError, InvalidItemError, ValueTypeError, modify_item_value, merge_patch_edits, patch_item,
+)
+from app.db.expirations import cancel_expiration
+from app.db.local_cache import invalidate_item, item_etag
+from app.tasks.tasks import schedule_expiration
 
-router = APIRouter()
+router = APIRouter(route_class=ORJSONRoute, default_response_class=ORJSONResponse)
+
+def _if_match(header: Optional[str]) -> Optional[List[str]]:
+    """ETags an If-Match header accepts; only strong ones can match, so a 412 if there are none"""
+    etags = parse_etags(header, weak=False)
+    if etags == []:
+        raise HTTPException(status_code=412, detail="Key was modified (ETag does not match)")
+    return etags
+
+def _not_found(if_match: Optional[str]) -> HTTPException:
+    # If-Match, even "*", requires a current value, so a missing key fails the precondition
+    if if_match is not None:
+        return HTTPException(status_code=412, detail="Key not found (If-Match requires an existing key)")
+    return HTTPException(status_code=404, detail="Key not found")
 
 @router.post("/data")
-def create_item(item: KeyValueItem, key: str, user=Depends(get_current_active_user)):
+def create_item(item: KeyValueItem, key: str, response: Response, user=Depends(get_current_active_user)):
     # Debug print
     print(f"Item model fields: {item.model_dump().keys()}")
     tenant_id = user.tenant_id
+    record_access(tenant_id, key)
     namespaced_key = get_namespaced_key(tenant_id, key)
     
-    if main_redis.exists(namespaced_key):
+    # Save the full data (value and metadata) as JSON, with its TTL, unless the key exists
+    data = item.model_dump_json()
+    if not insert_item(tenant_id, key, data, ttl=item.ttl):
         raise HTTPException(status_code=400, detail="Key already exists")
+    invalidate_item(namespaced_key)
+    publish_change(tenant_id, "create", key, item_etag(data))
     
-    # Create a fresh Redis client 
-    redis_client = create_redis_client()
-    
-    # Save the full data (value and metadata) as JSON
-    data = item.model_dump()
-    redis_client.set(namespaced_key, json.dumps(data))
-    
-    # Set TTL if provided
     if item.ttl:
-        redis_client.expire(namespaced_key, item.ttl)
         # Schedule audit log task for when the key expires
-        audit_log_expiration.schedule(args=(key, tenant_id), delay=item.ttl)
+        schedule_expiration(key, tenant_id, item.ttl)
     
     # Log the key creation
-    logs_entry = json.dumps({
+    write_audit_log({
         "timestamp": datetime.now().isoformat(),
         "action": "create_key",
         "key": key,
@@ -45,60 +67,72 @@ def create_item(item: KeyValueItem, key: str, user=Depends(get_current_active_us
         "tenant_id": tenant_id,
     })
     
-    # Create a fresh Redis client for logs
-    logs_client = create_redis_client(db=1)
-    logs_client.lpush("logs:audit", logs_entry)
-    
+    response.headers["ETag"] = etag_header(item_etag(data))
     return {"status": "success", "key": key}
 
 @router.get("/data/{key}")
-def get_item(key: str, user=Depends(get_current_active_user)):
+def get_item(key: str, if_none_match: Optional[str] = Header(None),
+             user=Depends(get_current_active_user)):
     tenant_id = user.tenant_id
-    namespaced_key = get_namespaced_key(tenant_id, key)
+    record_access(tenant_id, key)
     
-    data = main_redis.get(namespaced_key)
-    if not data:
+    entry = read_item(tenant_id, key)
+    if not entry:
         raise HTTPException(status_code=404, detail="Key not found")
+    data, etag, stored = entry
+    
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        if etags is None or etag in etags:
+            # The client's copy is current; log the read without the value
+            write_audit_log({
+                "timestamp": datetime.now().isoformat(),
+                "action": "get_key",
+                "key": key,
+                "not_modified": True,
+                "tenant_id": tenant_id,
+            })
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag_header(etag)})
     
     # Log the key retrieval
-    logs_entry = json.dumps({
+    write_audit_log({
         "timestamp": datetime.now().isoformat(),
         "action": "get_key",
         "key": key,
-        "value": json.loads(data)["value"],
-        "metadata": json.loads(data)["metadata"],
+        "value": data["value"],
+        "metadata": data["metadata"],
         "tenant_id": tenant_id,
     })
     
-    # Create a fresh Redis client for logs
-    logs_client = create_redis_client(db=1)
-    logs_client.lpush("logs:audit", logs_entry)
-    
-    return json.loads(data)
+    # Stored items are JSON already; send them without encoding them again
+    return raw_json_response(stored, headers={"ETag": etag_header(etag)})
 
 @router.put("/data/{key}")
-def update_item(key: str, item: KeyValueItem, user=Depends(get_current_active_user)):
+def update_item(key: str, item: KeyValueItem, response: Response, if_match: Optional[str] = Header(None),
+                user=Depends(get_current_active_user)):
     tenant_id = user.tenant_id
+    record_access(tenant_id, key)
     namespaced_key = get_namespaced_key(tenant_id, key)
     
-    if not main_redis.exists(namespaced_key):
-        raise HTTPException(status_code=404, detail="Key not found")
-    
-    # Create a fresh Redis client for write operations
-    redis_client = create_redis_client()
-    
-    # Save the full data (value and metadata) as JSON
-    data = item.model_dump()
-    redis_client.set(namespaced_key, json.dumps(data))
+    # Save the full data (value and metadata) as JSON, checking If-Match in the same step
+    data = item.model_dump_json()
+    try:
+        replace_item(tenant_id, key, data, ttl=item.ttl, if_match=_if_match(if_match))
+    except ItemNotFoundError:
+        raise _not_found(if_match)
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail="Key was modified (ETag does not match)")
+    invalidate_item(namespaced_key)
+    publish_change(tenant_id, "update", key, item_etag(data))
     
-    # Set or update TTL if provided
     if item.ttl:
-        redis_client.expire(namespaced_key, item.ttl)
-        # Schedule audit log task for when the key expires
-        audit_log_expiration.schedule(args=(key, tenant_id), delay=item.ttl)
+        # Schedule audit log task for when the key expires; it replaces any earlier one
+        schedule_expiration(key, tenant_id, item.ttl)
+    else:
+        cancel_expiration(tenant_id, key, "item")
     
     # Log the key update
-    logs_entry = json.dumps({
+    write_audit_log({
         "timestamp": datetime.now().isoformat(),
         "action": "update_key",
         "key": key,
@@ -108,31 +142,81 @@ def update_item(key: str, item: KeyValueItem, user=Depends(get_current_active_us
         "tenant_id": tenant_id,
     })
     
-    # Create a fresh Redis client for logs
-    logs_client = create_redis_client(db=1)
-    logs_client.lpush("logs:audit", logs_entry)
-    
+    response.headers["ETag"] = etag_header(item_etag(data))
     return {"status": "success", "key": key}
 
-@router.delete("/data/{key}")
-def delete_item(key: str, user=Depends(get_current_active_user)):
+@router.patch("/data/{key}")
+def patch_item_fields(key: str, patch: ItemPatch, response: Response, if_match: Optional[str] = Header(None),
+                      user=Depends(get_current_active_user)):
     tenant_id = user.tenant_id
-    namespaced_key = get_namespaced_key(tenant_id, key)
+    record_access(tenant_id, key)
+    fields = patch.model_fields_set
+    if not fields:
+        raise HTTPException(status_code=400, detail="Nothing to update (send metadata and/or ttl)")
     
-    if not main_redis.exists(namespaced_key):
-        raise HTTPException(status_code=404, detail="Key not found")
+    # Merge the metadata and set the TTL in one Lua script, leaving the stored value as it is
+    edits = []
+    ttl = None
+    if "metadata" in fields:
+        if patch.metadata is None:
+            edits += ["set", 1, "metadata", "null"]
+        else:
+            edits += merge_patch_edits(patch.metadata, ("metadata",))
+    if "ttl" in fields:
+        ttl = patch.ttl or 0
+        edits += ["set", 1, "ttl", json.dumps(patch.ttl)]
+    try:
+        etag, _ = patch_item(tenant_id, key, edits, ttl=ttl, if_match=_if_match(if_match))
+    except ItemNotFoundError:
+        raise _not_found(if_match)
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail="Key was modified (ETag does not match)")
+    except InvalidItemError:
+        raise HTTPException(status_code=409, detail="Stored item is not a JSON object")
+    invalidate_item(get_namespaced_key(tenant_id, key))
+    publish_change(tenant_id, "update", key, etag)
+    
+    if patch.ttl:
+        # The new TTL's task replaces any earlier one, whether it shortens or extends the TTL
+        schedule_expiration(key, tenant_id, patch.ttl)
+    elif "ttl" in fields:
+        cancel_expiration(tenant_id, key, "item")
     
-    # Get the data before deleting for logging
-    data = json.loads(main_redis.get(namespaced_key))
+    # Log the patch, not the whole item
+    entry = {
+        "timestamp": datetime.now().isoformat(),
+        "action": "patch_key",
+        "key": key,
+        "tenant_id": tenant_id,
+    }
+    if "metadata" in fields:
+        entry["metadata"] = patch.metadata
+    if "ttl" in fields:
+        entry["ttl"] = patch.ttl
+    write_audit_log(entry)
     
-    # Create a fresh Redis client for write operations
-    redis_client = create_redis_client()
+    response.headers["ETag"] = etag_header(etag)
+    return {"status": "success", "key": key}
+
+@router.delete("/data/{key}")
+def delete_item(key: str, if_match: Optional[str] = Header(None), user=Depends(get_current_active_user)):
+    tenant_id = user.tenant_id
+    record_access(tenant_id, key)
+    namespaced_key = get_namespaced_key(tenant_id, key)
     
-    # Delete the key
-    redis_client.delete(namespaced_key)
+    # Delete the key, checking If-Match in the same step; the old data is kept for logging
+    try:
+        data = json.loads(remove_item(tenant_id, key, if_match=_if_match(if_match)))
+    except ItemNotFoundError:
+        raise _not_found(if_match)
+    except PreconditionFailedError:
+        raise HTTPException(status_code=412, detail="Key was modified (ETag does not match)")
+    invalidate_item(namespaced_key)
+    cancel_expiration(tenant_id, key, "item")
+    publish_change(tenant_id, "delete", key)
     
     # Log the key deletion
-    logs_entry = json.dumps({
+    write_audit_log({
         "timestamp": datetime.now().isoformat(),
         "action": "delete_key",
         "key": key,
@@ -141,8 +225,186 @@ def delete_item(key: str, user=Depends(get_current_active_user)):
         "tenant_id": tenant_id,
     })
     
-    # Create a fresh Redis client for logs
-    logs_client = create_redis_client(db=1)
-    logs_client.lpush("logs:audit", logs_entry)
+    return {"status": "success", "key": key}
+
+# Atomic operations on an item's value: one Lua script each, so concurrent changes are
+# never lost and the item keeps its TTL, instead of a GET and a PUT from the client.
+
+VALUE_TYPE_ERRORS = {
+    "not_number": "Value is not a number",
+    "not_array": "Value is not an array",
+    "no_value": "Item has no value",
+    "overflow": "Result is out of range",
+}
+
+def _modify_value(tenant_id: str, key: str, op: str, operand: str, count: int = 1):
+    try:
+        value, etag, extra = modify_item_value(tenant_id, key, op, operand, count)
+    except ItemNotFoundError:
+        raise HTTPException(status_code=404, detail="Key not found")
+    except ValueTypeError as e:
+        raise HTTPException(status_code=409, detail=VALUE_TYPE_ERRORS.get(e.reason, e.reason))
+    invalidate_item(get_namespaced_key(tenant_id, key))
+    return value, etag, extra
+
+@router.post("/data/{key}/incr")
+def increment_item(key: str, body: IncrementRequest, response: Response, user=Depends(get_current_active_user)):
+    # Add to a numeric value (a negative amount decrements it)
+    tenant_id = user.tenant_id
+    record_access(tenant_id, key)
+    value, etag, _ = _modify_value(tenant_id, key, "incr", json.dumps(body.by))
+    value = json.loads(value)
+    publish_change(tenant_id, "update", key, etag)
+    
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "increment_key",
+        "key": key,
+        "by": body.by,
+        "value": value,
+        "tenant_id": tenant_id,
+    })
+    
+    response.headers["ETag"] = etag_header(etag)
+    return {"status": "success", "key": key, "value": value}
+
+@router.post("/data/{key}/append")
+def append_item(key: str, body: AppendRequest, response: Response, user=Depends(get_current_active_user)):
+    # Append elements to an array value
+    tenant_id = user.tenant_id
+    record_access(tenant_id, key)
+    elements = json.dumps(body.values, separators=(",", ":"))[1:-1]
+    _, etag, length = _modify_value(tenant_id, key, "append", elements, len(body.values))
+    publish_change(tenant_id, "update", key, etag)
+    
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "append_key",
+        "key": key,
+        "value": body.values,
+        "length": length,
+        "tenant_id": tenant_id,
+    })
+    
+    response.headers["ETag"] = etag_header(etag)
+    return {"status": "success", "key": key, "length": length}
+
+@router.post("/data/{key}/max")
+def set_item_if_greater(key: str, body: SetIfGreaterRequest, response: Response,
+                        user=Depends(get_current_active_user)):
+    # Set a numeric value to the given one if that is greater (a high-water mark)
+    tenant_id = user.tenant_id
+    record_access(tenant_id, key)
+    value, etag, updated = _modify_value(tenant_id, key, "max", json.dumps(body.value))
+    value = json.loads(value)
+    if updated:
+        publish_change(tenant_id, "update", key, etag)
+    
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "set_if_greater_key",
+        "key": key,
+        "value": value,
+        "updated": bool(updated),
+        "tenant_id": tenant_id,
+    })
+    
+    response.headers["ETag"] = etag_header(etag)
+    return {"status": "success", "key": key, "value": value, "updated": bool(updated)}
+
+# Streaming path for large values: the body is stored chunk by chunk as it arrives
+# and downloads are streamed back, so memory use does not grow with the value size.
+# Audit entries record the size and digest instead of the value.
+
+@router.put("/data/{key}/stream")
+async def upload_stream(key: str, request: Request, ttl: Optional[int] = Query(None, gt=0),
+                        user=Depends(get_current_active_user)):
+    tenant_id = user.tenant_id
+    record_access(tenant_id, key)
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > BLOB_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Value exceeds {BLOB_MAX_BYTES} bytes")
+    
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    try:
+        manifest = await store_blob(tenant_id, key, request.stream(), content_type, ttl)
+    except BlobTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BlobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if ttl:
+        # Schedule audit log task for when the value expires; it replaces any earlier one
+        await run_in_threadpool(schedule_expiration, key, tenant_id, ttl, "blob")
+    else:
+        await run_in_threadpool(cancel_expiration, tenant_id, key, "blob")
+    
+    # Log the upload
+    await run_in_threadpool(write_audit_log, {
+        "timestamp": datetime.now().isoformat(),
+        "action": "upload_stream",
+        "key": key,
+        "size": manifest["size"],
+        "sha256": manifest["sha256"],
+        "content_type": content_type,
+        "ttl": ttl,
+        "tenant_id": tenant_id,
+    })
+    
+    return {"status": "success", "key": key, "size": manifest["size"], "sha256": manifest["sha256"]}
+
+@router.get("/data/{key}/stream")
+def download_stream(key: str, if_none_match: Optional[str] = Header(None), user=Depends(get_current_active_user)):
+    tenant_id = user.tenant_id
+    record_access(tenant_id, key)
+    
+    manifest = get_manifest(tenant_id, key)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    etag = etag_header(manifest["sha256"])
+    if if_none_match is not None:
+        etags = parse_etags(if_none_match)
+        if etags is None or manifest["sha256"] in etags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    
+    # Log the download
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "download_stream",
+        "key": key,
+        "size": manifest["size"],
+        "sha256": manifest["sha256"],
+        "tenant_id": tenant_id,
+    })
+    
+    return StreamingResponse(
+        iter_blob(tenant_id, manifest),
+        media_type=manifest["content_type"],
+        headers={"Content-Length": str(manifest["size"]), "ETag": etag},
+    )
+
+@router.delete("/data/{key}/stream")
+def delete_stream(key: str, user=Depends(get_current_active_user)):
+    tenant_id = user.tenant_id
+    record_access(tenant_id, key)
+    
+    try:
+        manifest = delete_blob(tenant_id, key)
+    except BlobConflictError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Key not found")
+    cancel_expiration(tenant_id, key, "blob")
+    
+    # Log the deletion
+    write_audit_log({
+        "timestamp": datetime.now().isoformat(),
+        "action": "delete_stream",
+        "key": key,
+        "size": manifest["size"],
+        "sha256": manifest["sha256"],
+        "tenant_id": tenant_id,
+    })
     
     return {"status": "success", "key": key}
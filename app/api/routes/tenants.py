@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from app.core.security import get_current_active_user
+from app.db.blobs import count_blobs
+from app.db.transfer import export_items, import_items, ImportLineError
+
+router = APIRouter(prefix="/tenants/me")
+
+@router.get("/export")
+def export_tenant_data(skip_blobs: bool = False, user=Depends(get_current_active_user)):
+    # Streamed values are not exported; rather than leave them out silently, the
+    # client has to acknowledge that the export is incomplete
+    blobs = count_blobs(user.tenant_id)
+    if blobs and not skip_blobs:
+        raise HTTPException(
+            status_code=409,
+            detail=f"{blobs} value(s) stored through /data/{{key}}/stream cannot be exported; "
+                   f"pass skip_blobs=true to export the other items without them",
+        )
+    # Streamed page by page; see app/db/transfer.py for the line format
+    return StreamingResponse(
+        export_items(user.tenant_id, skipped_blobs=blobs),
+        media_type="application/x-ndjson",
+        headers={
+            "Content-Disposition": f'attachment; filename="{user.tenant_id}-export.ndjson"',
+            "X-Skipped-Blobs": str(blobs),
+        },
+    )
+
+@router.post("/import")
+async def import_tenant_data(
+    request: Request,
+    import_id: str = Query(..., pattern="^[A-Za-z0-9_-]{1,64}$"),
+    user=Depends(get_current_active_user),
+):
+    # Chosen by the client: send the same file with the same import_id to resume after any failure
+    try:
+        result = await import_items(user.tenant_id, request.stream(), import_id)
+    except ImportLineError as e:
+        raise HTTPException(status_code=400, detail=f"{str(e)} (import_id {import_id})")
+    return {"status": "success", **result}
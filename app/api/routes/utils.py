@@ -1,13 +1,51 @@
-from fastapi import APIRouter
-from app.db.redis import logs_redis
+import os
+import redis
+from fastapi import APIRouter, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from prometheus_client import generate_latest, CONTENT_TYPE_LATEST, CollectorRegistry, multiprocess
+from app.core.config import REDIS_CLUSTER_NODES
+from app.db.redis import get_main_redis, get_logs_redis, init_redis_db, reset_redis_clients
 from app.tasks.tasks import offload_audit_logs_to_loki
 
 router = APIRouter()
 
 @router.get("/health")
 async def health_check():
+    # Liveness: the process is up and serving, dependencies are not checked
     return {"status": "healthy"}
 
+def _check_dependencies(request: Request):
+    get_main_redis().ping()
+    if not REDIS_CLUSTER_NODES and get_main_redis().role()[0] != "master":
+        # Demoted by a failover: reads still work but every write fails
+        raise redis.exceptions.ReadOnlyError("Connected Redis instance is no longer the master")
+    get_logs_redis().ping()
+    if not getattr(request.app.state, "redis_initialized", False):
+        init_redis_db()
+        request.app.state.redis_initialized = True
+
+@router.get("/ready")
+async def readiness_check(request: Request):
+    # Readiness: only take traffic once Redis is reachable and initialized
+    try:
+        await run_in_threadpool(_check_dependencies, request)
+    except redis.exceptions.RedisError as e:
+        # Re-probe for the writable instance on the next check
+        reset_redis_clients()
+        return JSONResponse(status_code=503, content={"status": "not ready", "reason": str(e)})
+    return {"status": "ready"}
+
+@router.get("/metrics")
+async def metrics():
+    # Prometheus scrape endpoint
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Several worker processes: aggregate the values every worker has written
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return Response(content=generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
 @router.post("/trigger-log-offload")
 async def trigger_log_offload():
     # Manually trigger the log offloading task
@@ -0,0 +1,240 @@
+"""
+Adaptive admission control for the API process.
+
+At most `limit` requests run at once. The limit follows AIMD on latency: it grows
+by about one per window of successful requests while the limit is actually in
+use, and is cut by ADMISSION_DECREASE_FACTOR when a request fails with a 5xx or
+its route's recent latency exceeds ADMISSION_LATENCY_TOLERANCE times the route's
+baseline. As in Gradient2, both are moving averages of the route's latency: a
+short one over the last few dozen requests and a long one over the last few
+thousand, so a route that mixes fast paths (cache hits, 304s, 404s) with Redis
+round trips is compared with its usual mix rather than with its fastest request.
+
+Requests over the limit wait in a priority queue (readiness and login ahead of
+API keys, ahead of bulk /data traffic); when the queue is full or a request has
+waited too long it is shed with 503 and Retry-After instead of piling up behind
+the thread pool.
+
+All state is only touched from the event loop, so no locking is needed.
+"""
+import asyncio
+import heapq
+import itertools
+import time
+
+from app.core.config import (
+    ADMISSION_INITIAL_LIMIT,
+    ADMISSION_MIN_LIMIT,
+    ADMISSION_MAX_LIMIT,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT_SECONDS,
+    ADMISSION_LATENCY_TOLERANCE,
+    ADMISSION_RETRY_AFTER_SECONDS,
+)
+from app.core.metrics import ADMISSION_LIMIT, ADMISSION_INFLIGHT, ADMISSION_QUEUED, ADMISSION_SHED
+
+ADMISSION_DECREASE_FACTOR = 0.9
+# Weights of a new latency sample in a route's recent (short) and baseline (long) averages.
+# The long average also follows overload, but slowly enough that it is detected first.
+SHORT_LATENCY_WEIGHT = 0.05
+LONG_LATENCY_WEIGHT = 0.001
+
+# Never queued or shed: liveness must keep answering and metrics must stay scrapeable
+EXEMPT_PATHS = {"/health", "/metrics"}
+# Long-lived streams hold their slot only until the response starts
+STREAMING_PATHS = {"/changes"}
+PRIORITY_NAMES = ["critical", "normal", "bulk"]
+
+
+def request_priority(path: str) -> int:
+    """Lower is served first"""
+    if path in ("/ready", "/token"):
+        return 0
+    if path.startswith("/data") or path.startswith("/tenants"):
+        return 2
+    return 1
+
+
+class AdaptiveLimiter:
+    def __init__(self, initial: int, minimum: int, maximum: int, queue_size: int,
+                 queue_timeout: float, tolerance: float):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.tolerance = tolerance
+        self.inflight = 0
+        self._waiters = []  # heap of (priority, seq, future)
+        self._queued = 0
+        self._seq = itertools.count()
+        self._latencies = {}  # route -> [short average, long average]
+        self._last_decrease = 0.0
+        ADMISSION_LIMIT.set(self.limit)
+
+    async def acquire(self, priority: int) -> bool:
+        """Wait for a slot; False means the request was shed"""
+        if self.inflight < int(self.limit) and not self._queued:
+            self._admit()
+            return True
+
+        if self._queued >= self.queue_size and not self._evict_lower_than(priority):
+            ADMISSION_SHED.labels(priority=PRIORITY_NAMES[priority], reason="queue_full").inc()
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._set_queued(self._queued + 1)
+        try:
+            admitted = await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon()
+            ADMISSION_SHED.labels(priority=PRIORITY_NAMES[priority], reason="timeout").inc()
+            return False
+        except asyncio.CancelledError:
+            # The client went away while waiting; pass on a slot handed over meanwhile
+            if future.done() and not future.cancelled() and future.result():
+                self.inflight -= 1
+                self._wake()
+            elif not future.done() or future.cancelled():
+                self._abandon()
+            raise
+        if not admitted:
+            ADMISSION_SHED.labels(priority=PRIORITY_NAMES[priority], reason="evicted").inc()
+        return admitted
+
+    def release(self, route: str, latency: float, failed: bool):
+        self._observe(route, latency, failed)
+        self.inflight -= 1
+        self._wake()
+        ADMISSION_INFLIGHT.set(self.inflight)
+
+    def _admit(self):
+        self.inflight += 1
+        ADMISSION_INFLIGHT.set(self.inflight)
+
+    def _wake(self):
+        # Hand free slots to the highest priority waiters still waiting
+        while self._waiters and self.inflight < int(self.limit):
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                # Abandoned; its count was already dropped
+                continue
+            self._set_queued(self._queued - 1)
+            self._admit()
+            future.set_result(True)
+
+    def _evict_lower_than(self, priority: int) -> bool:
+        """Shed the lowest priority, most recent waiter if it ranks below `priority`"""
+        live = [entry for entry in self._waiters if not entry[2].done()]
+        if not live:
+            return False
+        worst = max(live, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= priority:
+            return False
+        self._waiters.remove(worst)
+        heapq.heapify(self._waiters)
+        self._set_queued(self._queued - 1)
+        worst[2].set_result(False)
+        return True
+
+    def _abandon(self):
+        """A waiter gave up; its entry stays in the heap, skipped once popped"""
+        self._set_queued(self._queued - 1)
+        # Drop abandoned entries once they outnumber live ones, so a burst of
+        # timeouts does not leave the heap (and eviction scans) growing
+        if len(self._waiters) > 2 * self._queued + 16:
+            self._waiters = [entry for entry in self._waiters if not entry[2].done()]
+            heapq.heapify(self._waiters)
+
+    def _set_queued(self, queued: int):
+        self._queued = queued
+        ADMISSION_QUEUED.set(queued)
+
+    def _observe(self, route: str, latency: float, failed: bool):
+        averages = self._latencies.get(route)
+        if averages is None:
+            averages = self._latencies[route] = [latency, latency]
+        else:
+            averages[0] += (latency - averages[0]) * SHORT_LATENCY_WEIGHT
+            averages[1] += (latency - averages[1]) * LONG_LATENCY_WEIGHT
+        recent, baseline = averages
+
+        now = time.monotonic()
+        if failed or recent > baseline * self.tolerance:
+            # Cut at most once per round trip so one burst of slow requests counts once
+            if now - self._last_decrease > recent:
+                self.limit = max(self.minimum, self.limit * ADMISSION_DECREASE_FACTOR)
+                self._last_decrease = now
+        elif self.inflight >= int(self.limit):
+            # Only grow while the limit is the bottleneck
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        ADMISSION_LIMIT.set(self.limit)
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that admits, queues or sheds each HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+        self.limiter = AdaptiveLimiter(
+            ADMISSION_INITIAL_LIMIT,
+            ADMISSION_MIN_LIMIT,
+            ADMISSION_MAX_LIMIT,
+            ADMISSION_QUEUE_SIZE,
+            ADMISSION_QUEUE_TIMEOUT_SECONDS,
+            ADMISSION_LATENCY_TOLERANCE,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.limiter.acquire(request_priority(scope["path"])):
+            await self._shed(send)
+            return
+
+        status_code = 500
+        started = time.perf_counter()
+        released = False
+
+        def release():
+            nonlocal released
+            if released:
+                return
+            released = True
+            # Routing fills in the matched route, so latency is tracked per path template
+            route = scope.get("route")
+            self.limiter.release(
+                getattr(route, "path", scope["path"]),
+                time.perf_counter() - started,
+                status_code >= 500,
+            )
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if scope["path"] in STREAMING_PATHS:
+                    release()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release()
+
+    async def _shed(self, send):
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"retry-after", str(ADMISSION_RETRY_AFTER_SECONDS).encode()),
+            ],
+        })
+        await send({
+            "type": "http.response.body",
+            "body": b'{"detail":"Server overloaded, retry later"}',
+        })
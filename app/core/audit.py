@@ -0,0 +1,238 @@
+"""
+Audit logging, with one policy deciding how much of each entry is kept.
+
+AUDIT_POLICY (JSON) holds rules per action, optionally overridden per tenant:
+
+    {"default": {...}, "actions": {"get_key": {...}},
+     "tenants": {"tenant1": {"default": {...}, "actions": {"get_key": {...}}}}}
+
+Rules are merged from the general to the specific (global default, global action,
+tenant default, tenant action). A rule may set:
+
+    sample_rate      fraction of entries written (default 1); sampled entries record the rate
+    rollup           count entries instead of writing them; every AUDIT_ROLLUP_SECONDS one
+                     "audit_rollup" entry per tenant and action is written with the counts
+    values           "full" (default), "digest" to replace value and metadata with their
+                     size and SHA-256, or "omit" to drop them
+    max_field_chars  cut longer fields to this many characters (0, the default, keeps them whole)
+
+Routes always pass the complete entry; write_audit_log applies the policy, so the
+routes never need to know it. Bytes not written because of the policy are
+counted in audit_bytes_saved_total. Entries that cannot reach Redis go to the
+local spool (see audit_spool).
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import redis
+
+from app.core.audit_spool import audit_spool
+from app.core.config import AUDIT_LOG_KEY, AUDIT_POLICY, AUDIT_ROLLUP_SECONDS
+from app.core.metrics import AUDIT_ENTRIES, AUDIT_BYTES_WRITTEN, AUDIT_BYTES_SAVED
+from app.core.tracing import span
+from app.db.redis import get_logs_redis
+
+DEFAULT_RULE = {"sample_rate": 1.0, "rollup": False, "values": "full", "max_field_chars": 0}
+VALUE_MODES = ("full", "digest", "omit")
+# Fields holding tenant data; everything else in an entry is bookkeeping
+VALUE_FIELDS = ("value", "metadata")
+# Needed to find and order entries, so never truncated
+KEPT_FIELDS = {"timestamp", "action", "tenant_id", "key"}
+# Keys counted individually in a rollup; the rest are only counted in total
+ROLLUP_MAX_KEYS = 100
+
+
+def _validate_policy(policy: dict):
+    rules = [policy.get("default") or {}, *(policy.get("actions") or {}).values()]
+    for tenant_policy in (policy.get("tenants") or {}).values():
+        rules += [tenant_policy.get("default") or {}, *(tenant_policy.get("actions") or {}).values()]
+    for rule in rules:
+        unknown = set(rule) - set(DEFAULT_RULE)
+        if unknown:
+            raise ValueError(f"Unknown audit policy settings: {', '.join(sorted(unknown))}")
+        if rule.get("values", "full") not in VALUE_MODES:
+            raise ValueError(f"Audit policy 'values' must be one of {', '.join(VALUE_MODES)}")
+
+
+_validate_policy(AUDIT_POLICY)
+
+
+def get_policy(tenant_id: Optional[str], action: Optional[str]) -> dict:
+    """The rule that applies to one tenant's entries for one action"""
+    tenant_policy = (AUDIT_POLICY.get("tenants") or {}).get(tenant_id) or {}
+    policy = dict(DEFAULT_RULE)
+    for rule in (
+        AUDIT_POLICY.get("default"),
+        (AUDIT_POLICY.get("actions") or {}).get(action),
+        tenant_policy.get("default"),
+        (tenant_policy.get("actions") or {}).get(action),
+    ):
+        if rule:
+            policy.update(rule)
+    return policy
+
+
+def _encoded(value) -> bytes:
+    return (value if isinstance(value, str) else json.dumps(value, sort_keys=True)).encode()
+
+
+def apply_policy(entry: dict, policy: dict) -> dict:
+    """Return the entry as it should be written: values digested or dropped, long fields cut"""
+    entry = dict(entry)
+    max_chars = policy["max_field_chars"]
+    if max_chars:
+        truncated = []
+        for field, value in entry.items():
+            if field in KEPT_FIELDS or value is None or isinstance(value, (bool, int, float)):
+                continue
+            if field in VALUE_FIELDS and policy["values"] != "full":
+                # Digested whole below
+                continue
+            text = value if isinstance(value, str) else json.dumps(value)
+            if len(text) > max_chars:
+                entry[field] = text[:max_chars]
+                truncated.append(field)
+        if truncated:
+            entry["truncated"] = truncated
+
+    if policy["values"] != "full":
+        for field in VALUE_FIELDS:
+            if field not in entry:
+                continue
+            value = entry.pop(field)
+            if policy["values"] == "digest" and value is not None:
+                encoded = _encoded(value)
+                entry[f"{field}_size"] = len(encoded)
+                entry[f"{field}_sha256"] = hashlib.sha256(encoded).hexdigest()
+
+    if policy["sample_rate"] < 1:
+        # Lets counts be scaled back up when querying
+        entry["sample_rate"] = policy["sample_rate"]
+    return entry
+
+
+def _push(logs_entry: str):
+    if audit_spool.enabled:
+        audit_spool.ensure_started()
+        if not audit_spool.redis_available():
+            audit_spool.append(logs_entry)
+            return
+    try:
+        # The shared client: a fresh one would probe for the master on every entry,
+        # which is slowest exactly when Redis is failing over
+        get_logs_redis().lpush(AUDIT_LOG_KEY, logs_entry)
+    except (redis.exceptions.RedisError, OSError) as e:
+        if not audit_spool.enabled:
+            raise
+        # Keep the entry on disk until the replay thread gets it into Redis
+        print(f"Audit log Redis unavailable, spooling to disk: {str(e)}")
+        audit_spool.mark_redis_down()
+        audit_spool.append(logs_entry)
+
+
+class AuditRollups:
+    """Per-process counts of rolled up entries, flushed as one entry per tenant and action"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._counts = {}  # (tenant_id, action) -> rollup being built
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add(self, entry: dict, size: int):
+        self.ensure_started()
+        group = (entry.get("tenant_id"), entry.get("action"))
+        with self._lock:
+            rollup = self._counts.get(group)
+            if rollup is None:
+                rollup = self._counts[group] = {
+                    "first_timestamp": entry.get("timestamp"),
+                    "count": 0,
+                    "bytes": 0,
+                    "keys": {},
+                    "other_keys": 0,
+                }
+            rollup["count"] += 1
+            rollup["bytes"] += size
+            rollup["last_timestamp"] = entry.get("timestamp")
+            key = entry.get("key")
+            if key is not None:
+                if key in rollup["keys"] or len(rollup["keys"]) < ROLLUP_MAX_KEYS:
+                    rollup["keys"][key] = rollup["keys"].get(key, 0) + 1
+                else:
+                    rollup["other_keys"] += 1
+
+    def flush(self):
+        """Write one entry per tenant and action counted since the last flush"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        for (tenant_id, action), rollup in counts.items():
+            logs_entry = json.dumps({
+                "timestamp": rollup["last_timestamp"],
+                "action": "audit_rollup",
+                "rolled_up_action": action,
+                "tenant_id": tenant_id,
+                "first_timestamp": rollup["first_timestamp"],
+                "count": rollup["count"],
+                "keys": rollup["keys"],
+                "other_keys": rollup["other_keys"],
+            })
+            _push(logs_entry)
+            AUDIT_BYTES_WRITTEN.labels(action="audit_rollup").inc(len(logs_entry))
+            AUDIT_BYTES_SAVED.labels(action=action).inc(max(0, rollup["bytes"] - len(logs_entry)))
+
+    def ensure_started(self):
+        """Start the flush thread (again after a fork, dropping counts copied from the parent)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._counts = {}
+            threading.Thread(target=self._run, name="audit-rollups", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Failed to write audit rollups: {str(e)}")
+
+
+audit_rollups = AuditRollups(AUDIT_ROLLUP_SECONDS)
+
+
+def write_audit_log(entry: dict):
+    """Queue an audit entry in the logs database for offloading to Loki, as the audit policy allows"""
+    action = entry.get("action")
+    with span("audit.write", action=action):
+        policy = get_policy(entry.get("tenant_id"), action)
+        if policy == DEFAULT_RULE:
+            logs_entry = json.dumps(entry)
+            _push(logs_entry)
+            AUDIT_ENTRIES.labels(action=action, outcome="written").inc()
+            AUDIT_BYTES_WRITTEN.labels(action=action).inc(len(logs_entry))
+            return
+
+        full_size = len(json.dumps(entry))
+        if policy["rollup"]:
+            audit_rollups.add(entry, full_size)
+            AUDIT_ENTRIES.labels(action=action, outcome="rolled_up").inc()
+            return
+        if policy["sample_rate"] < 1 and random.random() >= policy["sample_rate"]:
+            AUDIT_ENTRIES.labels(action=action, outcome="sampled_out").inc()
+            AUDIT_BYTES_SAVED.labels(action=action).inc(full_size)
+            return
+
+        logs_entry = json.dumps(apply_policy(entry, policy))
+        _push(logs_entry)
+        AUDIT_ENTRIES.labels(action=action, outcome="written").inc()
+        AUDIT_BYTES_WRITTEN.labels(action=action).inc(len(logs_entry))
+        AUDIT_BYTES_SAVED.labels(action=action).inc(max(0, full_size - len(logs_entry)))
@@ -0,0 +1,71 @@
+"""
+Compressed blocks of audit entries in the logs queue.
+
+Queued audit entries are small JSON objects that repeat the same field and action
+names, so whenever many of them are queued at once (entries requeued after a
+failed Loki push, spooled entries replayed after a Redis outage) they are packed
+into a single list element: up to AUDIT_BLOCK_ENTRIES entries, one JSON line
+each, compressed with zlib against a preset dictionary of those common strings.
+A backlog built up during a Loki outage then takes a fraction of the memory on
+the master and on every replica. Entries written by requests stay plain JSON.
+
+A block is BLOCK_MAGIC, one byte naming the dictionary it was compressed with,
+then the zlib stream. JSON never starts with a NUL byte, so blocks and plain
+entries share the queue and decode_queue_element reads either. Dictionaries are
+only ever added, never changed, so blocks queued by an older version still decode.
+"""
+import json
+import zlib
+from typing import Iterable, List, Union
+
+from app.core.config import AUDIT_BLOCK_ENTRIES
+
+BLOCK_MAGIC = b"\x00AB"
+
+# zlib gives the end of a preset dictionary the shortest distances, so the most
+# common strings come last
+_DICTIONARY_V1 = b"".join([
+    b'"reason": "Incorrect username or password"',
+    b'"token_expires_minutes": 30',
+    b'"action": "revoke_user_tokens", "action": "disable_user", "admin": "admin", ',
+    b'"action": "create_api_key", "name": "API Key ',
+    b'"action": "upload_stream", "action": "download_stream", "action": "delete_stream", ',
+    b'"size": , "sha256": "", "content_type": "application/octet-stream", ',
+    b'"action": "audit_rollup", "rolled_up_action": "get_key", "first_timestamp": "", "count": ',
+    b'"keys": {}, "other_keys": 0, "sample_rate": 0.1, "truncated": ["value"], ',
+    b'"value_size": , "value_sha256": "", "metadata_size": , "metadata_sha256": "", ',
+    b'"action": "login_success", "action": "login_failed", "action": "logout", "username": "user',
+    b'"action": "key_expiration", "not_modified": true, ',
+    b'"action": "delete_key", "action": "update_key", "action": "create_key", ',
+    b'"ttl": null, "ttl": 3600, "metadata": {}, "metadata": null, "value": "',
+    b'"tenant_id": "unknown"}\n',
+    b'{"timestamp": "2025-01-01T00:00:00.000000", "action": "get_key", "key": "',
+    b'", "tenant_id": "tenant1"}\n{"timestamp": "2026-',
+])
+DICTIONARIES = {1: _DICTIONARY_V1}
+CURRENT_DICTIONARY = 1
+
+
+def encode_block(lines: List[Union[str, bytes]]) -> bytes:
+    """Compress JSON-encoded entries into one block"""
+    payload = b"\n".join(line.encode() if isinstance(line, str) else line for line in lines)
+    compressor = zlib.compressobj(level=6, zdict=DICTIONARIES[CURRENT_DICTIONARY])
+    return BLOCK_MAGIC + bytes([CURRENT_DICTIONARY]) + compressor.compress(payload) + compressor.flush()
+
+
+def encode_blocks(lines: Iterable[Union[str, bytes]]) -> List[bytes]:
+    """Pack JSON-encoded entries into blocks of at most AUDIT_BLOCK_ENTRIES"""
+    lines = list(lines)
+    return [encode_block(lines[i:i + AUDIT_BLOCK_ENTRIES]) for i in range(0, len(lines), AUDIT_BLOCK_ENTRIES)]
+
+
+def decode_queue_element(data: Union[str, bytes]) -> List[dict]:
+    """Entries held by one element of the logs queue, a plain entry or a block"""
+    if isinstance(data, str):
+        data = data.encode()
+    if not data.startswith(BLOCK_MAGIC):
+        return [json.loads(data)]
+    dictionary = DICTIONARIES[data[len(BLOCK_MAGIC)]]
+    decompressor = zlib.decompressobj(zdict=dictionary)
+    payload = decompressor.decompress(data[len(BLOCK_MAGIC) + 1:]) + decompressor.flush()
+    return [json.loads(line) for line in payload.split(b"\n") if line]
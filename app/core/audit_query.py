@@ -0,0 +1,243 @@
+"""
+Reading a tenant's audit log: offloaded entries from Loki, recent ones from the Redis queue.
+
+A query covers [after, end) in nanoseconds. The range is cut into splits aligned
+to AUDIT_QUERY_SPLIT_SECONDS, which are fetched from Loki AUDIT_QUERY_PARALLELISM
+at a time, in order, until enough entries for the page are found. A split
+holding more than AUDIT_QUERY_SPLIT_LIMIT entries is halved until every part
+fits one Loki query, so a fetched split is always complete: pages are sliced
+from it, and once no more entries can arrive for a split it is cached in Redis
+and not fetched again. That is when it ended AUDIT_QUERY_CLOSED_AFTER_SECONDS in
+the past and nothing older than its end is still on the way to Loki: entries
+re-queued while Loki was down, or replayed from the audit spool, keep their
+original timestamps. So a split is only cached if the logs queue holds no
+matching entry older than its end and no offload run or spool replay was in
+progress or started while the query ran (AUDIT_OFFLOADING_KEY and
+AUDIT_QUEUE_EPOCH_KEY, read before fetching and checked again afterwards).
+
+Entries still waiting in the logs queue are merged in by timestamp. Pages are
+resumed with a cursor holding the last timestamp returned, how many entries at
+that timestamp were already returned, and the end of the range, which is fixed
+by the first page so later pages do not shift as new entries arrive.
+"""
+import base64
+import heapq
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import requests
+
+from app.core.audit_blocks import encode_block, decode_queue_element
+from app.core.config import (
+    AUDIT_LOG_KEY,
+    AUDIT_OFFLOADING_KEY,
+    AUDIT_QUEUE_EPOCH_KEY,
+    LOKI_QUERY_URL,
+    AUDIT_QUERY_SPLIT_SECONDS,
+    AUDIT_QUERY_SPLIT_LIMIT,
+    AUDIT_QUERY_PARALLELISM,
+    AUDIT_QUERY_CLOSED_AFTER_SECONDS,
+    AUDIT_QUERY_CACHE_SECONDS,
+    AUDIT_QUERY_QUEUE_SCAN_LIMIT,
+)
+from app.core.metrics import AUDIT_QUERY_SPLITS
+from app.core.tracing import span
+from app.db.redis import get_redis_client
+from app.tasks.tasks import to_loki_timestamp
+
+NS = 1_000_000_000
+# Splits are not halved below this, however many entries they hold
+MIN_SPLIT_NS = NS
+
+_executor = ThreadPoolExecutor(max_workers=AUDIT_QUERY_PARALLELISM, thread_name_prefix="audit-query")
+
+
+class AuditQueryError(Exception):
+    """Raised when the audit log store cannot be queried"""
+
+
+class InvalidCursorError(Exception):
+    """Raised when a pagination cursor cannot be decoded"""
+
+
+def encode_cursor(after: int, skip: int, end: int) -> str:
+    raw = json.dumps({"after": after, "skip": skip, "end": end}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, int, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+        return int(position["after"]), int(position["skip"]), int(position["end"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError(str(e))
+
+
+def _stream_selector(tenant_id: str, action: Optional[str]) -> str:
+    selector = f'job="audit_logs", tenant_id={json.dumps(tenant_id)}'
+    if action:
+        selector += f", action={json.dumps(action)}"
+    return "{" + selector + "}"
+
+
+def _query_loki(tenant_id: str, action: Optional[str], start: int, end: int) -> List[list]:
+    """[timestamp, entry] pairs in [start, end), ordered, at most AUDIT_QUERY_SPLIT_LIMIT of them"""
+    try:
+        response = requests.get(
+            LOKI_QUERY_URL,
+            params={
+                "query": _stream_selector(tenant_id, action),
+                "start": start,
+                "end": end,
+                "limit": AUDIT_QUERY_SPLIT_LIMIT,
+                "direction": "forward",
+            },
+            headers={"X-Scope-OrgID": tenant_id},
+            timeout=10,
+        )
+    except requests.RequestException as e:
+        raise AuditQueryError(f"Loki query failed: {str(e)}")
+    if response.status_code != 200:
+        raise AuditQueryError(f"Loki query failed: {response.status_code} - {response.text[:200]}")
+
+    # One list per stream (per action label); each is ordered, so merge them
+    streams = []
+    for stream in response.json().get("data", {}).get("result", []):
+        values = []
+        for timestamp, line in stream.get("values", []):
+            timestamp = int(timestamp)
+            if start <= timestamp < end:
+                values.append([timestamp, json.loads(line)])
+        streams.append(values)
+    return list(heapq.merge(*streams, key=lambda pair: pair[0]))
+
+
+def _offload_state(client) -> Tuple[bool, int]:
+    """Whether an offload run has entries out of the queue, and the queue epoch"""
+    offloading, epoch = client.mget(AUDIT_OFFLOADING_KEY, AUDIT_QUEUE_EPOCH_KEY)
+    return offloading is not None, int(epoch or 0)
+
+
+def _fetch_split(tenant_id: str, action: Optional[str], start: int, end: int, closed_before: int,
+                 to_cache: list) -> List[list]:
+    """
+    All entries of one split, halving it until each part fits one Loki query.
+
+    Fetched splits ending before closed_before are added to to_cache; the caller
+    caches them once it knows nothing older is still on the way to Loki.
+    """
+    closed = end <= closed_before
+    cache_key = f"audit_query:{{{tenant_id}}}:{action or '*'}:{start}:{end}"
+    if closed:
+        cached = get_redis_client(db=1, decode_responses=False).get(cache_key)
+        if cached is not None:
+            AUDIT_QUERY_SPLITS.labels(result="cached").inc()
+            return decode_queue_element(cached)
+
+    with span("audit_query.loki", start=start, end=end):
+        entries = _query_loki(tenant_id, action, start, end)
+    AUDIT_QUERY_SPLITS.labels(result="fetched").inc()
+    if len(entries) >= AUDIT_QUERY_SPLIT_LIMIT and end - start > MIN_SPLIT_NS:
+        middle = start + (end - start) // 2
+        entries = (_fetch_split(tenant_id, action, start, middle, closed_before, to_cache)
+                   + _fetch_split(tenant_id, action, middle, end, closed_before, to_cache))
+
+    if closed:
+        to_cache.append((cache_key, end, entries))
+    return entries
+
+
+def _queued_entries(tenant_id: str, action: Optional[str], start: int,
+                    end: int) -> Tuple[List[list], Optional[float]]:
+    """
+    Entries of the tenant still waiting in the logs queue, in [start, end), ordered,
+    and the timestamp of the oldest matching entry anywhere in the queue (infinity if
+    there is none, None if the queue is too long to scan completely)
+    """
+    client = get_redis_client(db=1, decode_responses=False)
+    entries = []
+    oldest = float("inf")
+    complete = False
+    now_ns = time.time_ns()
+    for offset in range(0, AUDIT_QUERY_QUEUE_SCAN_LIMIT, 1000):
+        elements = client.lrange(AUDIT_LOG_KEY, offset, min(offset + 1000, AUDIT_QUERY_QUEUE_SCAN_LIMIT) - 1)
+        for element in elements:
+            try:
+                logs = decode_queue_element(element)
+            except ValueError:
+                continue
+            for log in logs:
+                if log.get("tenant_id") != tenant_id or (action and log.get("action") != action):
+                    continue
+                # Stamped the same way the offloader stamps entries pushed to Loki
+                timestamp = to_loki_timestamp(log.get("timestamp", now_ns), now_ns)
+                oldest = min(oldest, timestamp)
+                if start <= timestamp < end:
+                    entries.append([timestamp, log])
+        if len(elements) < 1000:
+            complete = True
+            break
+    entries.sort(key=lambda pair: pair[0])
+    return entries, oldest if complete else None
+
+
+def _cache_closed_splits(client, to_cache: list, oldest_queued: Optional[float], state: Tuple[bool, int]):
+    """Cache fetched splits for which no more entries can arrive"""
+    offloading, _ = state
+    if not to_cache or oldest_queued is None or offloading or _offload_state(client) != state:
+        return
+    pipe = client.pipeline(transaction=False)
+    for cache_key, end, entries in to_cache:
+        if end <= oldest_queued:
+            pipe.set(cache_key, encode_block([json.dumps(pair) for pair in entries]), ex=AUDIT_QUERY_CACHE_SECONDS)
+    pipe.execute()
+
+
+def query_audit_log(tenant_id: str, action: Optional[str], after: int, skip: int, end: int,
+                    limit: int) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of a tenant's audit entries in [after, end), oldest first.
+
+    `skip` entries stamped exactly `after` were returned on earlier pages.
+    Returns the entries (each with its nanosecond "ts") and the cursor of the
+    next page, None when the range is exhausted.
+    """
+    needed = skip + limit
+    split_ns = AUDIT_QUERY_SPLIT_SECONDS * NS
+    first = after - after % split_ns
+    splits = [(s, min(s + split_ns, end)) for s in range(first, end, split_ns)]
+
+    client = get_redis_client(db=1, decode_responses=False)
+    state = _offload_state(client)
+    closed_before = int((time.time() - AUDIT_QUERY_CLOSED_AFTER_SECONDS) * NS)
+    to_cache = []
+
+    loki_entries = []
+    fetched_until = first
+    for i in range(0, len(splits), AUDIT_QUERY_PARALLELISM):
+        wave = splits[i:i + AUDIT_QUERY_PARALLELISM]
+        futures = [_executor.submit(_fetch_split, tenant_id, action, s, e, closed_before, to_cache)
+                   for s, e in wave]
+        for future in futures:
+            loki_entries += [pair for pair in future.result() if pair[0] >= after]
+        fetched_until = wave[-1][1]
+        if len(loki_entries) >= needed:
+            break
+
+    # Loki entries are only complete up to the last split fetched
+    queued, oldest_queued = _queued_entries(tenant_id, action, after, fetched_until)
+    _cache_closed_splits(client, to_cache, oldest_queued, state)
+    merged = list(heapq.merge(loki_entries, queued, key=lambda pair: pair[0]))
+
+    page = merged[skip:needed]
+    if not page:
+        return [], None
+    last = page[-1][0]
+    at_last = sum(1 for timestamp, _ in page if timestamp == last)
+    next_skip = skip + at_last if last == after else at_last
+    exhausted = len(merged) <= needed and fetched_until >= end
+    next_cursor = None if exhausted else encode_cursor(last, next_skip, end)
+    return [dict(entry, ts=timestamp) for timestamp, entry in page], next_cursor
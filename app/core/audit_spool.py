@@ -0,0 +1,263 @@
+"""
+Local disk spool for audit entries while the logs Redis is unavailable.
+
+Entries that cannot be pushed to Redis are appended, one JSON line each, to
+segment files in AUDIT_SPOOL_DIR. Each process writes its own segment and holds
+an exclusive flock on it while it is open, starting a new one every
+AUDIT_SPOOL_SEGMENT_BYTES. The whole spool is capped at AUDIT_SPOOL_MAX_BYTES;
+beyond that entries are dropped (and counted) rather than filling the disk.
+
+A background thread in every process replays segments once Redis answers again.
+It takes the flock of a segment before replaying it, so a segment still being
+written, or being replayed by another process, is skipped, and segments left by
+a process that died are picked up by the others. Segments are replayed oldest
+entries first, in batches pushed as compressed blocks (see audit_blocks), so the
+offloader, which pops the oldest end of the queue, gets them in order. After
+each batch the offset reached is recorded in a ".pos" file next to the segment,
+so an entry is pushed at most once even if Redis fails again halfway through.
+
+AUDIT_SPOOL_FSYNC controls durability of spooled entries: "always" fsyncs every
+entry, "interval" at most every AUDIT_SPOOL_FSYNC_SECONDS, "never" leaves it to
+the OS.
+"""
+import fcntl
+import glob
+import os
+import threading
+import time
+import uuid
+
+from app.core.audit_blocks import encode_blocks
+from app.core.config import (
+    AUDIT_LOG_KEY,
+    AUDIT_QUEUE_EPOCH_KEY,
+    AUDIT_SPOOL_DIR,
+    AUDIT_SPOOL_MAX_BYTES,
+    AUDIT_SPOOL_SEGMENT_BYTES,
+    AUDIT_SPOOL_FSYNC,
+    AUDIT_SPOOL_FSYNC_SECONDS,
+    AUDIT_SPOOL_REPLAY_SECONDS,
+)
+from app.core.metrics import AUDIT_SPOOL_BYTES, AUDIT_SPOOL_SEGMENTS, AUDIT_SPOOL_ENTRIES, AUDIT_SPOOL_REPLAYED
+from app.db.redis_utils import create_redis_client
+
+FSYNC_POLICIES = ("always", "interval", "never")
+# Entries read from a segment per LPUSH (of compressed blocks) while replaying
+REPLAY_BATCH_SIZE = 1024
+# Suffix of the file holding how far a segment has been replayed
+PROGRESS_SUFFIX = ".pos"
+
+if AUDIT_SPOOL_FSYNC not in FSYNC_POLICIES:
+    raise ValueError(f"AUDIT_SPOOL_FSYNC must be one of {', '.join(FSYNC_POLICIES)}")
+
+
+def _read_progress(progress_path: str) -> int:
+    try:
+        with open(progress_path) as f:
+            return int(f.read() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_progress(progress_path: str, offset: int):
+    # Replaced atomically, so a crash leaves either the old offset or the new one
+    tmp_path = progress_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(str(offset))
+    os.replace(tmp_path, progress_path)
+
+
+def _remove(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class AuditSpool:
+    def __init__(self, directory: str, max_bytes: int, segment_bytes: int, fsync: str,
+                 fsync_seconds: float, replay_seconds: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_seconds = fsync_seconds
+        self.replay_seconds = replay_seconds
+        self._fd = None  # segment this process is appending to, flocked while open
+        self._segment_size = 0
+        self._spooled_bytes = 0  # all segments at the last scan, plus this process's appends since
+        self._synced_at = 0.0
+        self._redis_down_until = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def redis_available(self) -> bool:
+        """False for a while after a push failed, so requests do not all wait on Redis timeouts"""
+        return time.monotonic() >= self._redis_down_until
+
+    def mark_redis_down(self):
+        self._redis_down_until = time.monotonic() + self.replay_seconds
+
+    def append(self, logs_entry: str) -> bool:
+        """Spool one entry; False if the spool is full and the entry was dropped"""
+        self.ensure_started()
+        line = logs_entry.encode() + b"\n"
+        with self._lock:
+            if self._spooled_bytes + len(line) > self.max_bytes:
+                AUDIT_SPOOL_ENTRIES.labels(result="dropped").inc()
+                return False
+            if self._fd is None or self._segment_size + len(line) > self.segment_bytes:
+                self._open_segment()
+            os.write(self._fd, line)
+            self._segment_size += len(line)
+            self._spooled_bytes += len(line)
+            now = time.monotonic()
+            if self.fsync == "always" or (self.fsync == "interval" and now - self._synced_at >= self.fsync_seconds):
+                os.fsync(self._fd)
+                self._synced_at = now
+        AUDIT_SPOOL_ENTRIES.labels(result="spooled").inc()
+        return True
+
+    def _open_segment(self):
+        self._close_segment()
+        os.makedirs(self.directory, exist_ok=True)
+        # Named by creation time so segments are replayed roughly in order
+        name = f"{time.time_ns()}-{os.getpid()}-{uuid.uuid4().hex[:8]}.seg"
+        fd = os.open(os.path.join(self.directory, name), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        self._fd = fd
+        self._segment_size = 0
+
+    def _close_segment(self):
+        if self._fd is None:
+            return
+        if self.fsync != "never":
+            os.fsync(self._fd)
+        # Closing releases the flock, which makes the segment replayable
+        os.close(self._fd)
+        self._fd = None
+
+    def replay(self) -> int:
+        """Push all replayable segments to Redis; returns the number of entries pushed"""
+        segments = self._segments()
+        if not segments:
+            self._update_depth()
+            return 0
+
+        client = create_redis_client(db=1)
+        # Only hand over this process's open segment once Redis is known to be back
+        client.ping()
+        with self._lock:
+            self._close_segment()
+        self._redis_down_until = 0.0
+
+        replayed = 0
+        for path in self._segments():
+            replayed += self._replay_segment(client, path)
+        self._update_depth()
+        if replayed:
+            print(f"Replayed {replayed} spooled audit entries to Redis")
+        return replayed
+
+    def _replay_segment(self, client, path: str) -> int:
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return 0
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Still being written, or replayed by another process
+                return 0
+            if os.fstat(fd).st_nlink == 0:
+                # Replayed and removed by another process since it was listed
+                return 0
+
+            data = b""
+            while True:
+                chunk = os.read(fd, 1024 * 1024)
+                if not chunk:
+                    break
+                data += chunk
+            # A line cut short by a crash while appending cannot be parsed; drop it
+            end = data.rfind(b"\n") + 1
+            progress_path = path + PROGRESS_SUFFIX
+            start = _read_progress(progress_path)
+
+            # Replayed entries are older than what is in Loki; tell audit queries the queue changed
+            if start < end:
+                client.incr(AUDIT_QUEUE_EPOCH_KEY)
+            replayed = 0
+            while start < end:
+                stop = start
+                for _ in range(REPLAY_BATCH_SIZE):
+                    stop = data.index(b"\n", stop) + 1
+                    if stop >= end:
+                        break
+                batch = data[start:stop - 1].split(b"\n")
+                # LPUSHed oldest first, so the oldest entry ends up nearest the end the offloader pops
+                client.lpush(AUDIT_LOG_KEY, *encode_blocks(batch))
+                # Record what was pushed right away, so a failure later does not push it twice
+                _write_progress(progress_path, stop)
+                replayed += len(batch)
+                AUDIT_SPOOL_REPLAYED.inc(len(batch))
+                start = stop
+            os.unlink(path)
+            _remove(progress_path)
+            return replayed
+        finally:
+            os.close(fd)
+
+    def _segments(self) -> list:
+        # Progress files of segments removed by a replay that crashed right after are dropped
+        for progress_path in glob.glob(os.path.join(self.directory, "*.seg" + PROGRESS_SUFFIX)):
+            if not os.path.exists(progress_path[:-len(PROGRESS_SUFFIX)]):
+                _remove(progress_path)
+        return sorted(glob.glob(os.path.join(self.directory, "*.seg")))
+
+    def _update_depth(self):
+        total = 0
+        segments = self._segments()
+        for path in segments:
+            try:
+                total += os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+        self._spooled_bytes = total
+        AUDIT_SPOOL_BYTES.set(total)
+        AUDIT_SPOOL_SEGMENTS.set(len(segments))
+
+    def ensure_started(self):
+        """Start the replay thread (again after a fork, leaving the parent's segment to the parent)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._fd = None
+            threading.Thread(target=self._run, name="audit-spool-replay", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                self.replay()
+            except Exception as e:
+                self.mark_redis_down()
+                print(f"Audit spool replay failed, retrying in {self.replay_seconds}s: {str(e)}")
+            time.sleep(self.replay_seconds)
+
+
+audit_spool = AuditSpool(
+    AUDIT_SPOOL_DIR,
+    AUDIT_SPOOL_MAX_BYTES,
+    AUDIT_SPOOL_SEGMENT_BYTES,
+    AUDIT_SPOOL_FSYNC,
+    AUDIT_SPOOL_FSYNC_SECONDS,
+    AUDIT_SPOOL_REPLAY_SECONDS,
+)
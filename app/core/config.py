@@ -1,3 +1,4 @@
+import json
 import os
 from dotenv import load_dotenv
 
@@ -7,13 +8,156 @@ load_dotenv()
 # Security configuration
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Refresh tokens renew access tokens without a password login until this long after it
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv('REFRESH_TOKEN_EXPIRE_DAYS', 7))
 SECRET_KEY = os.getenv("SECRET_KEY")
 
 # Redis configuration
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
+# Comma-separated host[:port] instances probed in order for the writable master (the
+# StatefulSet pods by default); REDIS_HOST is tried after them
+REDIS_NODES = [n.strip() for n in os.getenv(
+    'REDIS_NODES', 'redis-0.redis-headless,redis-1.redis-headless,redis-2.redis-headless').split(',') if n.strip()]
+# Comma-separated host:port seed nodes. When set, clients connect to a Redis Cluster
+# instead of probing the master-replica pods, and logical databases are replaced by
+# key prefixes (Redis Cluster only has db 0).
+REDIS_CLUSTER_NODES = [n.strip() for n in os.getenv('REDIS_CLUSTER_NODES', '').split(',') if n.strip()]
+# Huey needs a standalone Redis; in cluster mode point it at a separate instance
+HUEY_REDIS_HOST = os.getenv('HUEY_REDIS_HOST', REDIS_HOST)
+HUEY_REDIS_PORT = int(os.getenv('HUEY_REDIS_PORT', REDIS_PORT))
+
+# Audit log queue. The hash tag keeps the queue and its companion keys in one cluster slot.
+AUDIT_LOG_KEY = 'logs:{audit}'
+# Set while an offload run has entries out of the queue, and bumped whenever entries leave the
+# queue for Loki or re-enter it late (spool replay), so audit queries know when a range is final
+AUDIT_OFFLOADING_KEY = 'logs:{audit}:offloading'
+AUDIT_QUEUE_EPOCH_KEY = 'logs:{audit}:epoch'
+# What is kept of each audit entry, per action and optionally per tenant (see app/core/audit.py), e.g.
+# {"actions": {"get_key": {"sample_rate": 0.1, "values": "digest"}}, "tenants": {"tenant2": {"actions": {"get_key": {"rollup": true}}}}}
+AUDIT_POLICY = json.loads(os.getenv('AUDIT_POLICY', '{}'))
+# How often counts of rolled up entries are written as one entry per tenant and action
+AUDIT_ROLLUP_SECONDS = float(os.getenv('AUDIT_ROLLUP_SECONDS', 60))
+# Audit entries are spooled to local disk while the logs Redis is unavailable and replayed
+# once it is back (see app/core/audit_spool.py); an empty AUDIT_SPOOL_DIR disables the spool
+AUDIT_SPOOL_DIR = os.getenv('AUDIT_SPOOL_DIR', '/tmp/audit-spool')
+AUDIT_SPOOL_MAX_BYTES = int(os.getenv('AUDIT_SPOOL_MAX_BYTES', 256 * 1024 * 1024))
+AUDIT_SPOOL_SEGMENT_BYTES = int(os.getenv('AUDIT_SPOOL_SEGMENT_BYTES', 4 * 1024 * 1024))
+# "always", "interval" (at most every AUDIT_SPOOL_FSYNC_SECONDS) or "never"
+AUDIT_SPOOL_FSYNC = os.getenv('AUDIT_SPOOL_FSYNC', 'interval')
+AUDIT_SPOOL_FSYNC_SECONDS = float(os.getenv('AUDIT_SPOOL_FSYNC_SECONDS', 1))
+AUDIT_SPOOL_REPLAY_SECONDS = float(os.getenv('AUDIT_SPOOL_REPLAY_SECONDS', 5))
+# Entries per compressed block when many entries are queued at once (see app/core/audit_blocks.py)
+AUDIT_BLOCK_ENTRIES = int(os.getenv('AUDIT_BLOCK_ENTRIES', 256))
 
 # Loki configuration
 LOKI_HOST = os.getenv('LOKI_HOST', 'loki-gateway')
 LOKI_PORT = os.getenv('LOKI_PORT', '80')
 LOKI_URL = f'http://{LOKI_HOST}:{LOKI_PORT}/loki/api/v1/push'
+LOKI_QUERY_URL = f'http://{LOKI_HOST}:{LOKI_PORT}/loki/api/v1/query_range'
+# Audit entries per Loki push adapt between LOKI_BATCH_MIN and LOKI_BATCH_MAX (see
+# app/core/loki_push.py): halved on a rejected push, grown by LOKI_BATCH_GROWTH after an
+# accepted one. A push gives up after LOKI_PUSH_MAX_FAILURES failed requests.
+LOKI_BATCH_INITIAL = int(os.getenv('LOKI_BATCH_INITIAL', 1000))
+LOKI_BATCH_MIN = int(os.getenv('LOKI_BATCH_MIN', 10))
+LOKI_BATCH_MAX = int(os.getenv('LOKI_BATCH_MAX', 5000))
+LOKI_BATCH_GROWTH = int(os.getenv('LOKI_BATCH_GROWTH', 100))
+LOKI_PUSH_MAX_FAILURES = int(os.getenv('LOKI_PUSH_MAX_FAILURES', 32))
+
+# GET /audit: long ranges are split into aligned sub-ranges queried in parallel (see app/core/audit_query.py)
+AUDIT_QUERY_SPLIT_SECONDS = int(os.getenv('AUDIT_QUERY_SPLIT_SECONDS', 3600))
+AUDIT_QUERY_PARALLELISM = int(os.getenv('AUDIT_QUERY_PARALLELISM', 4))
+# Entries per Loki query; splits holding more are halved
+AUDIT_QUERY_SPLIT_LIMIT = int(os.getenv('AUDIT_QUERY_SPLIT_LIMIT', 5000))
+# Splits ending longer ago than this are cached, once nothing older is left in the logs queue
+AUDIT_QUERY_CLOSED_AFTER_SECONDS = int(os.getenv('AUDIT_QUERY_CLOSED_AFTER_SECONDS', 900))
+AUDIT_QUERY_CACHE_SECONDS = int(os.getenv('AUDIT_QUERY_CACHE_SECONDS', 3600))
+AUDIT_QUERY_MAX_RANGE_HOURS = int(os.getenv('AUDIT_QUERY_MAX_RANGE_HOURS', 24 * 31))
+# Queue elements scanned for entries not offloaded to Loki yet
+AUDIT_QUERY_QUEUE_SCAN_LIMIT = int(os.getenv('AUDIT_QUERY_QUEUE_SCAN_LIMIT', 10000))
+
+# Rate limiting configuration
+# Token bucket per tenant, sized by the tenant's plan in fake_tenants_db.
+# "rate" is tokens refilled per second, "burst" is the bucket capacity.
+# The optional "user_rate"/"user_burst" add a second bucket per authenticated user.
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_DEFAULT_PLAN = os.getenv('RATE_LIMIT_DEFAULT_PLAN', 'basic')
+RATE_LIMIT_PLANS = json.loads(os.getenv('RATE_LIMIT_PLANS', json.dumps({
+    "basic": {"rate": 20, "burst": 40, "user_rate": 10, "user_burst": 20},
+    "premium": {"rate": 200, "burst": 400, "user_rate": 100, "user_burst": 200},
+})))
+RATE_LIMIT_PER_USER = os.getenv('RATE_LIMIT_PER_USER', 'false').lower() == 'true'
+TENANT_PLAN_CACHE_SECONDS = int(os.getenv('TENANT_PLAN_CACHE_SECONDS', 60))
+
+# L1 cache for GET /data/{key}, kept coherent with Redis client tracking (Redis 6+)
+LOCAL_CACHE_ENABLED = os.getenv('LOCAL_CACHE_ENABLED', 'false').lower() == 'true'
+LOCAL_CACHE_MAX_BYTES = int(os.getenv('LOCAL_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+LOCAL_CACHE_MAX_VALUE_BYTES = int(os.getenv('LOCAL_CACHE_MAX_VALUE_BYTES', 256 * 1024))
+# Upper bound on how long an entry is served, even for keys without a TTL
+LOCAL_CACHE_MAX_AGE_SECONDS = float(os.getenv('LOCAL_CACHE_MAX_AGE_SECONDS', 300))
+
+# Tracing: fraction of requests/tasks traced, and where finished spans are exported
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+TRACE_EXPORT_PATH = os.getenv('TRACE_EXPORT_PATH')
+TRACE_COLLECTOR_URL = os.getenv('TRACE_COLLECTOR_URL')
+
+# Admin-only endpoints (profiling) are limited to these usernames
+ADMIN_USERS = [u.strip() for u in os.getenv('ADMIN_USERS', 'admin').split(',') if u.strip()]
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', 60))
+
+# Large values streamed through /data/{key}/stream, stored as fixed-size chunk keys
+BLOB_CHUNK_BYTES = int(os.getenv('BLOB_CHUNK_BYTES', 256 * 1024))
+BLOB_MAX_BYTES = int(os.getenv('BLOB_MAX_BYTES', 512 * 1024 * 1024))
+# Chunks of an unfinished upload expire on their own after this long
+BLOB_UPLOAD_TIMEOUT_SECONDS = int(os.getenv('BLOB_UPLOAD_TIMEOUT_SECONDS', 3600))
+# Chunks of a replaced or deleted value are kept this long for downloads in flight
+BLOB_REPLACED_GRACE_SECONDS = int(os.getenv('BLOB_REPLACED_GRACE_SECONDS', 60))
+
+# Storage layout of /data items: 'strings' (a key per item) or 'buckets' (small items as
+# fields of ITEM_BUCKETS hashes per tenant, TTLs as hash field expiry on Redis 7.4+).
+# Keep ITEM_BUCKET_MAX_VALUE_BYTES <= hash-max-listpack-value so buckets stay compact.
+ITEM_STORAGE_LAYOUT = os.getenv('ITEM_STORAGE_LAYOUT', 'strings')
+ITEM_BUCKETS = int(os.getenv('ITEM_BUCKETS', 4096))
+ITEM_BUCKET_MAX_VALUE_BYTES = int(os.getenv('ITEM_BUCKET_MAX_VALUE_BYTES', 64))
+
+# Tenant export/import: keys per pipelined round trip, and how long an import can be resumed
+TRANSFER_BATCH_SIZE = int(os.getenv('TRANSFER_BATCH_SIZE', 500))
+IMPORT_CHECKPOINT_SECONDS = int(os.getenv('IMPORT_CHECKPOINT_SECONDS', 24 * 3600))
+
+# Change feed (GET /changes): events kept per tenant stream, events buffered per
+# subscriber before it has to catch up from Redis, keepalive interval for idle streams
+CHANGE_FEED_MAXLEN = int(os.getenv('CHANGE_FEED_MAXLEN', 10000))
+CHANGE_FEED_QUEUE_SIZE = int(os.getenv('CHANGE_FEED_QUEUE_SIZE', 256))
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv('CHANGE_FEED_HEARTBEAT_SECONDS', 15))
+# How long a key's expiration marker outlives its TTL, for expiration tasks that run late
+# (see app/db/expirations.py)
+EXPIRATION_MARKER_GRACE_SECONDS = int(os.getenv('EXPIRATION_MARKER_GRACE_SECONDS', 86400))
+
+# Adaptive admission control: concurrency limit tuned from observed latency (AIMD)
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'true').lower() == 'true'
+ADMISSION_INITIAL_LIMIT = int(os.getenv('ADMISSION_INITIAL_LIMIT', 20))
+ADMISSION_MIN_LIMIT = int(os.getenv('ADMISSION_MIN_LIMIT', 4))
+ADMISSION_MAX_LIMIT = int(os.getenv('ADMISSION_MAX_LIMIT', 200))
+# Requests waiting for a slot beyond this are shed, lowest priority first
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 100))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.getenv('ADMISSION_QUEUE_TIMEOUT_SECONDS', 2))
+# A route whose recent average latency exceeds this multiple of its long-term average is congested
+ADMISSION_LATENCY_TOLERANCE = float(os.getenv('ADMISSION_LATENCY_TOLERANCE', 2.0))
+ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv('ADMISSION_RETRY_AFTER_SECONDS', 1))
+
+# Stateless auth: trust the token's claims instead of loading the user on every request.
+# Revocations are synced into every process at least this often; if a process has not
+# synced for 3 intervals it falls back to loading the user from Redis.
+STATELESS_AUTH_ENABLED = os.getenv('STATELESS_AUTH_ENABLED', 'false').lower() == 'true'
+REVOCATION_SYNC_SECONDS = float(os.getenv('REVOCATION_SYNC_SECONDS', 5))
+
+# Workload analytics: hot keys and per-tenant load from /data requests, counted per process
+# in fixed-size sketches and merged across pods in Redis once per window
+WORKLOAD_ENABLED = os.getenv('WORKLOAD_ENABLED', 'true').lower() == 'true'
+WORKLOAD_WINDOW_SECONDS = int(os.getenv('WORKLOAD_WINDOW_SECONDS', 60))
+# Count-min sketch size (4-byte counters); estimates are off by at most ~2.7/width of the window's requests
+WORKLOAD_SKETCH_WIDTH = int(os.getenv('WORKLOAD_SKETCH_WIDTH', 2048))
+WORKLOAD_SKETCH_DEPTH = int(os.getenv('WORKLOAD_SKETCH_DEPTH', 4))
+WORKLOAD_TOP_KEYS = int(os.getenv('WORKLOAD_TOP_KEYS', 100))
+# Tenants beyond this many in one window are counted together as "_other"
+WORKLOAD_MAX_TENANTS = int(os.getenv('WORKLOAD_MAX_TENANTS', 1000))
@@ -0,0 +1,148 @@
+"""
+Pushing audit entries to Loki in batches that adapt to what Loki accepts.
+
+Loki's distributors reject pushes ("at least 2 live replicas required") while
+ingesters restart, and large pushes are the first to fail. A rejected batch is
+split in halves, recursively, so whatever Loki accepts is delivered and only the
+entries it still rejects are left over. Every entry is accounted for: push_entries
+returns exactly the undelivered ones, which the caller retries or re-queues.
+
+The batch size adapts (AIMD): it is halved on every rejected push and grows by
+LOKI_BATCH_GROWTH entries after every accepted one, between LOKI_BATCH_MIN and
+LOKI_BATCH_MAX. It belongs to the worker process, so it carries over between
+offload runs. Connection errors and timeouts are not split, since smaller requests
+will not reach an unreachable Loki, and a push gives up after LOKI_PUSH_MAX_FAILURES
+failed requests, so an outage costs a bounded number of requests.
+
+A 4xx other than 429 means Loki will never accept the request as sent (a malformed
+or too old entry, say). Such a batch is still split to isolate the offending
+entries, but it does not shrink the batch size, and a single entry rejected this
+way is dropped, logged and counted instead of being retried forever.
+"""
+import threading
+from typing import Callable, List, Tuple
+
+import requests
+
+from app.core.config import (
+    LOKI_URL,
+    LOKI_BATCH_INITIAL,
+    LOKI_BATCH_MIN,
+    LOKI_BATCH_MAX,
+    LOKI_BATCH_GROWTH,
+    LOKI_PUSH_MAX_FAILURES,
+)
+from app.core.metrics import LOKI_PUSH_REQUESTS, LOKI_BATCH_SIZE, LOKI_DROPPED_ENTRIES
+from app.core.tracing import span
+
+ACCEPTED = "accepted"
+REJECTED = "rejected"
+# Rejected for good: retrying the same entries will not help
+INVALID = "invalid"
+UNREACHABLE = "unreachable"
+
+
+class AdaptiveBatchSize:
+    """Entries per push: additive increase after accepted pushes, halved after rejected ones"""
+
+    def __init__(self, initial: int, minimum: int, maximum: int, growth: int):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.growth = growth
+        self._size = max(minimum, min(maximum, initial))
+        self._lock = threading.Lock()
+        LOKI_BATCH_SIZE.set(self._size)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def on_accepted(self):
+        with self._lock:
+            self._size = min(self.maximum, self._size + self.growth)
+            LOKI_BATCH_SIZE.set(self._size)
+
+    def on_rejected(self):
+        with self._lock:
+            self._size = max(self.minimum, self._size // 2)
+            LOKI_BATCH_SIZE.set(self._size)
+
+
+batch_size = AdaptiveBatchSize(LOKI_BATCH_INITIAL, LOKI_BATCH_MIN, LOKI_BATCH_MAX, LOKI_BATCH_GROWTH)
+
+
+def _post(tenant_id: str, payload: dict, entries: int) -> str:
+    try:
+        with span("offload.loki_push", tenant_id=tenant_id, entries=entries):
+            response = requests.post(
+                LOKI_URL,
+                json=payload,
+                headers={
+                    "Content-Type": "application/json",
+                    "X-Scope-OrgID": tenant_id,
+                },
+                timeout=10,
+            )
+    except requests.RequestException as e:
+        print(f"Error pushing {entries} logs for tenant {tenant_id} to Loki: {str(e)}")
+        return UNREACHABLE
+    if 200 <= response.status_code < 300:
+        return ACCEPTED
+    print(f"Loki rejected {entries} logs for tenant {tenant_id}. Status code: {response.status_code}, "
+          f"Response: {response.text[:200]}")
+    if 400 <= response.status_code < 500 and response.status_code != 429:
+        return INVALID
+    return REJECTED
+
+
+def push_entries(tenant_id: str, entries: list, build_payload: Callable[[list], dict],
+                 sizes: AdaptiveBatchSize = batch_size) -> Tuple[int, List]:
+    """
+    Push one tenant's entries to Loki, splitting rejected batches.
+
+    build_payload turns a list of entries into a push payload. Returns the number of
+    entries delivered and the entries that were not, in their original order, leaving
+    out entries Loki rejected for good.
+    """
+    delivered = 0
+    undelivered = []
+    failures = 0
+    position = 0
+    # Halves of rejected batches still to send, the next one last
+    split = []
+    while split or position < len(entries):
+        if split:
+            batch = split.pop()
+        else:
+            batch = entries[position:position + sizes.size]
+            position += len(batch)
+
+        outcome = _post(tenant_id, build_payload(batch), len(batch))
+        LOKI_PUSH_REQUESTS.labels(result=outcome).inc()
+        if outcome == ACCEPTED:
+            delivered += len(batch)
+            sizes.on_accepted()
+            continue
+
+        failures += 1
+        if outcome == REJECTED:
+            sizes.on_rejected()
+        if outcome == UNREACHABLE or failures >= LOKI_PUSH_MAX_FAILURES:
+            # Give up on this run: everything not delivered yet is left for a retry
+            undelivered.extend(batch)
+            for rest in reversed(split):
+                undelivered.extend(rest)
+            undelivered.extend(entries[position:])
+            print(f"Stopped pushing logs for tenant {tenant_id} to Loki after {failures} failed requests; "
+                  f"{len(undelivered)} left over")
+            break
+        if len(batch) > 1:
+            half = len(batch) // 2
+            split.append(batch[half:])
+            split.append(batch[:half])
+        elif outcome == INVALID:
+            LOKI_DROPPED_ENTRIES.inc()
+            print(f"Dropped an audit log for tenant {tenant_id} that Loki will not accept: {str(batch[0])[:200]}")
+        else:
+            undelivered.append(batch[0])
+    return delivered, undelivered
@@ -0,0 +1,121 @@
+from prometheus_client import Counter, Gauge
+
+# Startup
+STARTUP_SECONDS = Gauge("app_startup_seconds", "Time spent starting the API process", ["phase"])
+
+# Rate limiting
+RATE_LIMIT_THROTTLED = Counter(
+    "rate_limit_throttled_total",
+    "Requests rejected by the per-tenant rate limiter",
+    ["tenant_id", "scope", "source"],
+)
+RATE_LIMIT_ERRORS = Counter(
+    "rate_limit_errors_total",
+    "Rate limit checks that failed open because Redis was unavailable",
+)
+
+# L1 cache for GET /data/{key}
+LOCAL_CACHE_REQUESTS = Counter(
+    "local_cache_requests_total",
+    "L1 cache lookups by tenant and result (hit/miss)",
+    ["tenant_id", "result"],
+)
+LOCAL_CACHE_INVALIDATIONS = Counter(
+    "local_cache_invalidations_total",
+    "Keys invalidated by Redis client tracking push messages",
+)
+LOCAL_CACHE_BYTES = Gauge("local_cache_bytes", "Approximate memory held by the L1 cache", multiprocess_mode="livesum")
+LOCAL_CACHE_ENTRIES = Gauge("local_cache_entries", "Entries held by the L1 cache", multiprocess_mode="livesum")
+
+# Adaptive admission control (per worker process; summed over live workers in multi-process mode)
+ADMISSION_LIMIT = Gauge("admission_concurrency_limit", "Current adaptive concurrency limit",
+                        multiprocess_mode="livesum")
+ADMISSION_INFLIGHT = Gauge("admission_inflight_requests", "Requests currently admitted",
+                           multiprocess_mode="livesum")
+ADMISSION_QUEUED = Gauge("admission_queued_requests", "Requests waiting for a concurrency slot",
+                         multiprocess_mode="livesum")
+ADMISSION_SHED = Counter(
+    "admission_shed_total",
+    "Requests rejected with 503 by admission control",
+    ["priority", "reason"],
+)
+
+# Token revocation
+REVOCATION_ENTRIES = Gauge(
+    "auth_revocation_entries",
+    "Revoked tokens and users held in memory",
+    ["kind"],
+    multiprocess_mode="max",
+)
+REVOCATION_SYNC_ERRORS = Counter("auth_revocation_sync_errors_total", "Failed revocation list syncs")
+AUTH_REQUESTS = Counter("auth_requests_total", "Authenticated requests by how the user was resolved", ["path"])
+REFRESH_TOKENS = Counter("auth_refresh_tokens_total", "Refresh tokens issued, rotated, rejected or revoked", ["result"])
+
+# Audit policy
+AUDIT_ENTRIES = Counter(
+    "audit_entries_total",
+    "Audit entries by action and what the audit policy did with them (written/sampled_out/rolled_up)",
+    ["action", "outcome"],
+)
+AUDIT_BYTES_WRITTEN = Counter("audit_bytes_written_total", "Audit log bytes queued for Loki", ["action"])
+AUDIT_BYTES_SAVED = Counter(
+    "audit_bytes_saved_total",
+    "Audit log bytes not written because of the audit policy",
+    ["action"],
+)
+
+# Audit spool (shared directory, so every process reports the same depth)
+AUDIT_SPOOL_BYTES = Gauge("audit_spool_bytes", "Bytes of audit entries waiting in the local spool",
+                          multiprocess_mode="max")
+AUDIT_SPOOL_SEGMENTS = Gauge("audit_spool_segments", "Segment files in the local audit spool",
+                             multiprocess_mode="max")
+AUDIT_SPOOL_ENTRIES = Counter(
+    "audit_spool_entries_total",
+    "Audit entries written to the local spool while Redis was unavailable (spooled/dropped when full)",
+    ["result"],
+)
+AUDIT_SPOOL_REPLAYED = Counter("audit_spool_replayed_total", "Spooled audit entries pushed back to Redis")
+
+# Loki pushes (batch size per worker process; the largest is reported)
+LOKI_PUSH_REQUESTS = Counter(
+    "loki_push_requests_total",
+    "Pushes to Loki by result (accepted/rejected/invalid/unreachable)",
+    ["result"],
+)
+LOKI_PUSH_ENTRIES = Counter(
+    "loki_push_entries_total",
+    "Audit entries delivered to Loki, or re-queued because Loki did not accept them",
+    ["result"],
+)
+LOKI_DROPPED_ENTRIES = Counter(
+    "loki_push_dropped_entries_total",
+    "Audit entries dropped because Loki rejected them on their own with a 4xx other than 429",
+)
+LOKI_BATCH_SIZE = Gauge("loki_batch_size", "Current adaptive Loki push batch size", multiprocess_mode="max")
+
+# Audit log queries
+AUDIT_QUERY_SPLITS = Counter(
+    "audit_query_splits_total",
+    "Time splits of audit log queries, by whether they were fetched from Loki or served from the cache",
+    ["result"],
+)
+
+# Change feed
+CHANGE_FEED_SUBSCRIBERS = Gauge("change_feed_subscribers", "Open change feed connections",
+                                multiprocess_mode="livesum")
+CHANGE_FEED_EVENTS = Counter(
+    "change_feed_events_total",
+    "Change events published, delivered to subscribers, or not queued because a subscriber lagged",
+    ["result"],
+)
+
+# Workload analytics (merged across pods for the last complete window, so every process reports the same)
+WORKLOAD_TENANT_REQUESTS = Gauge("workload_tenant_requests", "Data requests per tenant in the last window",
+                                 ["tenant_id"], multiprocess_mode="max")
+WORKLOAD_TENANT_KEYS = Gauge("workload_tenant_distinct_keys",
+                             "Estimated distinct keys a tenant touched in the last window",
+                             ["tenant_id"], multiprocess_mode="max")
+WORKLOAD_HOT_KEY_SHARE = Gauge("workload_hot_key_share",
+                               "Share of a tenant's requests in the last window that went to its hottest key",
+                               ["tenant_id"], multiprocess_mode="max")
+WORKLOAD_FLUSH_ERRORS = Counter("workload_flush_errors_total", "Workload analytics windows that failed to flush")
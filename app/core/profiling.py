@@ -0,0 +1,90 @@
+"""
+On-demand profiling of a running process, for use from admin endpoints and Huey tasks.
+
+Both captures run for a bounded window (capped at PROFILE_MAX_SECONDS) and only
+one capture per process is allowed at a time:
+
+- CPU: samples the stacks of every thread at a fixed interval and returns them
+  in folded format ("frame;frame;frame count"), ready for flamegraph.pl/speedscope.
+- Memory: diffs two tracemalloc snapshots taken at the start and end of the window
+  and returns the allocation sites that grew the most.
+"""
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from app.core.config import PROFILE_MAX_SECONDS
+
+_capture_lock = threading.Lock()
+
+
+class ProfileBusyError(Exception):
+    """Raised when a capture is already running in this process"""
+
+
+def _bounded(seconds: float) -> float:
+    return max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+
+
+def _folded_stack(frame) -> str:
+    frames = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+def capture_cpu_profile(seconds: float, interval: float = 0.005) -> str:
+    """Sample all thread stacks for `seconds` and return them as folded stacks"""
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfileBusyError("A profile capture is already running")
+    try:
+        samples = Counter()
+        me = threading.get_ident()
+        deadline = time.monotonic() + _bounded(seconds)
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != me:
+                    samples[_folded_stack(frame)] += 1
+            time.sleep(interval)
+    finally:
+        _capture_lock.release()
+    return "\n".join(f"{stack} {count}" for stack, count in samples.most_common())
+
+
+def capture_memory_diff(seconds: float, top: int = 25) -> str:
+    """Trace allocations for `seconds` and return the top growing allocation sites"""
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfileBusyError("A profile capture is already running")
+    started_tracing = False
+    try:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(25)
+            started_tracing = True
+        before = tracemalloc.take_snapshot()
+        time.sleep(_bounded(seconds))
+        after = tracemalloc.take_snapshot()
+    finally:
+        # Tracing slows every allocation down, so it is only left on if it was on before
+        if started_tracing:
+            tracemalloc.stop()
+        _capture_lock.release()
+
+    stats = after.compare_to(before, "traceback")[:top]
+    lines = []
+    for stat in stats:
+        lines.append(f"{stat.size_diff / 1024:+.1f} KiB ({stat.count_diff:+d} blocks), "
+                     f"{stat.size / 1024:.1f} KiB total")
+        lines.extend(f"    {line}" for line in stat.traceback.format())
+    return "\n".join(lines)
+
+
+def capture_profile(kind: str, seconds: float) -> str:
+    if kind == "cpu":
+        return capture_cpu_profile(seconds)
+    if kind == "memory":
+        return capture_memory_diff(seconds)
+    raise ValueError(f"Unknown profile kind: {kind}")
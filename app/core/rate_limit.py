@@ -0,0 +1,183 @@
+import json
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import redis
+from fastapi import Depends, HTTPException, status
+
+from app.core.config import (
+    RATE_LIMIT_ENABLED,
+    RATE_LIMIT_DEFAULT_PLAN,
+    RATE_LIMIT_PLANS,
+    RATE_LIMIT_PER_USER,
+    TENANT_PLAN_CACHE_SECONDS,
+)
+from app.core.metrics import RATE_LIMIT_THROTTLED, RATE_LIMIT_ERRORS
+from app.core.security import get_current_active_user
+from app.db.redis import get_main_redis
+
+# Token bucket check for one or more buckets in a single round trip.
+# KEYS: bucket hashes. ARGV: per bucket (rate per second, burst), then the cost.
+# Tokens are only taken when every bucket can pay, so a request rejected by the
+# user bucket does not drain the tenant bucket. Uses the server clock so pods
+# with skewed clocks share the same view of each bucket.
+# Returns {allowed, retry_after_ms, index of the limiting bucket (1-based, 0 if none)}.
+TOKEN_BUCKET_LUA = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local cost = tonumber(ARGV[#ARGV])
+local tokens = {}
+local wait_ms = 0
+local limiting = 0
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local available = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if available == nil or ts == nil then
+        available = burst
+        ts = now
+    end
+    available = math.min(burst, available + math.max(0, now - ts) * rate / 1000)
+    tokens[i] = available
+    if available < cost then
+        local needed = math.ceil((cost - available) * 1000 / rate)
+        if needed > wait_ms then
+            wait_ms = needed
+            limiting = i
+        end
+    end
+end
+
+local allowed = 0
+if wait_ms == 0 then
+    allowed = 1
+end
+
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local remaining = tokens[i]
+    if allowed == 1 then
+        remaining = remaining - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(remaining), 'ts', now)
+    -- Idle buckets expire once they would be full again
+    redis.call('PEXPIRE', key, math.ceil(burst * 1000 / rate) + 1000)
+end
+
+return {allowed, wait_ms, limiting}
+"""
+
+# Local pre-check: buckets known to be empty until the given monotonic time.
+# A request for a blocked bucket is rejected without a Redis round trip.
+_blocked_until: Dict[str, float] = {}
+_blocked_lock = threading.Lock()
+_MAX_BLOCKED_ENTRIES = 10000
+
+_tenant_plans: Dict[str, str] = {}
+_tenant_plans_loaded_at = 0.0
+_token_bucket_script = None
+
+
+def _get_token_bucket_script():
+    global _token_bucket_script
+    if _token_bucket_script is None:
+        _token_bucket_script = get_main_redis().register_script(TOKEN_BUCKET_LUA)
+    return _token_bucket_script
+
+
+def get_tenant_plan(tenant_id: str) -> str:
+    """Return the tenant's plan, refreshing the local copy of fake_tenants_db periodically"""
+    global _tenant_plans, _tenant_plans_loaded_at
+    now = time.monotonic()
+    if now - _tenant_plans_loaded_at > TENANT_PLAN_CACHE_SECONDS:
+        try:
+            tenants_data = get_main_redis().get("fake_tenants_db")
+            tenants = json.loads(tenants_data) if tenants_data else {}
+            _tenant_plans = {tid: t.get("plan", RATE_LIMIT_DEFAULT_PLAN) for tid, t in tenants.items()}
+        except redis.exceptions.RedisError as e:
+            # Fail open like the bucket check: keep the plans we have and try again next interval
+            RATE_LIMIT_ERRORS.inc()
+            print(f"Failed to refresh tenant plans, keeping the previous ones: {str(e)}")
+        _tenant_plans_loaded_at = now
+    return _tenant_plans.get(tenant_id, RATE_LIMIT_DEFAULT_PLAN)
+
+
+def get_buckets(tenant_id: str, username: str) -> List[Tuple[str, str, float, float]]:
+    """Return (scope, Redis key, rate, burst) for every bucket that applies to the request"""
+    plan = RATE_LIMIT_PLANS.get(get_tenant_plan(tenant_id)) or RATE_LIMIT_PLANS[RATE_LIMIT_DEFAULT_PLAN]
+    # Hash-tag the tenant so all of a tenant's buckets live in the same slot
+    buckets = [("tenant", f"ratelimit:{{{tenant_id}}}:tenant", plan["rate"], plan["burst"])]
+    if RATE_LIMIT_PER_USER and "user_rate" in plan:
+        buckets.append(("user", f"ratelimit:{{{tenant_id}}}:user:{username}", plan["user_rate"], plan["user_burst"]))
+    return buckets
+
+
+def _local_retry_after(buckets) -> Optional[Tuple[str, float]]:
+    """Return (scope, seconds) for the longest local block among the buckets, if any"""
+    now = time.monotonic()
+    blocked = None
+    with _blocked_lock:
+        for scope, key, _, _ in buckets:
+            wait = _blocked_until.get(key, 0) - now
+            if wait > 0 and (blocked is None or wait > blocked[1]):
+                blocked = (scope, wait)
+    return blocked
+
+
+def _block_locally(bucket_key: str, retry_after: float):
+    now = time.monotonic()
+    with _blocked_lock:
+        if len(_blocked_until) >= _MAX_BLOCKED_ENTRIES:
+            for key in [k for k, until in _blocked_until.items() if until <= now]:
+                del _blocked_until[key]
+        _blocked_until[bucket_key] = now + retry_after
+
+
+def _throttled(tenant_id: str, scope: str, source: str, retry_after: float):
+    RATE_LIMIT_THROTTLED.labels(tenant_id=tenant_id, scope=scope, source=source).inc()
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Rate limit exceeded",
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def check_rate_limit(tenant_id: str, username: str, cost: int = 1):
+    """Take `cost` tokens from the tenant's buckets or raise a 429 HTTPException"""
+    buckets = get_buckets(tenant_id, username)
+    keys = [key for _, key, _, _ in buckets]
+
+    blocked = _local_retry_after(buckets)
+    if blocked is not None:
+        _throttled(tenant_id, blocked[0], "local", blocked[1])
+
+    args = []
+    for _, _, rate, burst in buckets:
+        args.extend([rate, burst])
+    args.append(cost)
+
+    try:
+        allowed, wait_ms, limiting = _get_token_bucket_script()(keys=keys, args=args, client=get_main_redis())
+    except redis.exceptions.RedisError as e:
+        # Fail open: a Redis outage should not take the whole API down with it
+        RATE_LIMIT_ERRORS.inc()
+        print(f"Rate limit check failed for tenant {tenant_id}, allowing request: {str(e)}")
+        return
+
+    if not allowed:
+        scope, key, _, _ = buckets[int(limiting) - 1]
+        retry_after = int(wait_ms) / 1000
+        _block_locally(key, retry_after)
+        _throttled(tenant_id, scope, "redis", retry_after)
+
+
+def enforce_rate_limit(current_user=Depends(get_current_active_user)):
+    """Router dependency applying the per-tenant (and optional per-user) rate limit"""
+    if RATE_LIMIT_ENABLED:
+        check_rate_limit(current_user.tenant_id, current_user.username)
@@ -0,0 +1,130 @@
+"""
+Refresh tokens, so clients renew access tokens without a password login and its bcrypt hash.
+
+A refresh token is "<family>.<secret>". Each login starts a new family, stored as
+
+    auth:refresh:<family>   hash: username, tenant_id, created_at, generation,
+                            secret (SHA-256 of the current secret)
+
+which expires REFRESH_TOKEN_EXPIRE_DAYS after the login; refreshing does not
+extend it, so a password login is still needed that often.
+
+Every refresh rotates the secret in one Lua script. Presenting any other secret
+of the family means a rotated-out token was used again (it was copied, or a
+client retried a refresh whose response it lost), so the whole family is deleted
+and whoever holds it must log in again. Revoking a family is a single DEL.
+"""
+import hashlib
+import re
+import secrets
+import time
+from typing import Optional, Tuple
+
+from app.core.config import REFRESH_TOKEN_EXPIRE_DAYS
+from app.core.metrics import REFRESH_TOKENS
+from app.db.redis import get_main_redis
+
+FAMILY_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+# Rotate the secret of a family. KEYS: family. ARGV: SHA-256 of the presented secret, of the new one.
+# Returns {1, username, tenant_id, created_at} when rotated, {0} if the family does not exist,
+# {-1, username, tenant_id} if the secret is not the current one (the family is deleted).
+ROTATE_REFRESH_TOKEN_LUA = """
+local family = redis.call('HMGET', KEYS[1], 'secret', 'username', 'tenant_id', 'created_at')
+if not family[1] then
+    return {0}
+end
+if family[1] ~= ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    return {-1, family[2], family[3]}
+end
+redis.call('HSET', KEYS[1], 'secret', ARGV[2])
+redis.call('HINCRBY', KEYS[1], 'generation', 1)
+return {1, family[2], family[3], family[4]}
+"""
+
+_rotate_script = None
+
+
+class InvalidRefreshTokenError(Exception):
+    """Raised for a refresh token that is malformed, expired or revoked"""
+
+
+class RefreshTokenReuseError(Exception):
+    """Raised when a rotated-out refresh token is presented; its family has been revoked"""
+
+    def __init__(self, username: str, tenant_id: str):
+        super().__init__(f"Refresh token reused for {username}")
+        self.username = username
+        self.tenant_id = tenant_id
+
+
+def _family_key(family: str) -> str:
+    return f"auth:refresh:{family}"
+
+
+def _digest(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()
+
+
+def _split(token: str) -> Tuple[str, str]:
+    family, _, secret = token.partition(".")
+    if not FAMILY_PATTERN.match(family) or not secret:
+        REFRESH_TOKENS.labels(result="invalid").inc()
+        raise InvalidRefreshTokenError("Malformed refresh token")
+    return family, secret
+
+
+def issue_refresh_token(username: str, tenant_id: str) -> str:
+    """Start a new family for a login and return its first refresh token"""
+    family = secrets.token_hex(16)
+    secret = secrets.token_urlsafe(32)
+    client = get_main_redis()
+    pipe = client.pipeline(transaction=False)
+    pipe.hset(_family_key(family), mapping={
+        "username": username,
+        "tenant_id": tenant_id,
+        "created_at": time.time(),
+        "generation": 0,
+        "secret": _digest(secret),
+    })
+    pipe.expire(_family_key(family), REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+    pipe.execute()
+    REFRESH_TOKENS.labels(result="issued").inc()
+    return f"{family}.{secret}"
+
+
+def rotate_refresh_token(token: str) -> Tuple[str, str, str, float]:
+    """
+    Exchange a refresh token for the next one in its family.
+
+    Returns (new token, username, tenant_id, family created_at).
+    """
+    global _rotate_script
+    family, secret = _split(token)
+    if _rotate_script is None:
+        _rotate_script = get_main_redis().register_script(ROTATE_REFRESH_TOKEN_LUA)
+    new_secret = secrets.token_urlsafe(32)
+    result = _rotate_script(keys=[_family_key(family)], args=[_digest(secret), _digest(new_secret)],
+                            client=get_main_redis())
+    if result[0] == 0:
+        REFRESH_TOKENS.labels(result="invalid").inc()
+        raise InvalidRefreshTokenError("Refresh token expired or revoked")
+    if result[0] == -1:
+        REFRESH_TOKENS.labels(result="reused").inc()
+        raise RefreshTokenReuseError(result[1], result[2])
+    REFRESH_TOKENS.labels(result="rotated").inc()
+    return f"{family}.{new_secret}", result[1], result[2], float(result[3])
+
+
+def revoke_refresh_token(token: str) -> Optional[Tuple[str, str]]:
+    """Revoke the family of a refresh token; returns its (username, tenant_id), None if it was already gone"""
+    family, _ = _split(token)
+    pipe = get_main_redis().pipeline(transaction=False)
+    pipe.hmget(_family_key(family), "username", "tenant_id")
+    pipe.delete(_family_key(family))
+    owner, revoked = pipe.execute()
+    if not revoked:
+        return None
+    REFRESH_TOKENS.labels(result="revoked").inc()
+    return owner[0], owner[1]
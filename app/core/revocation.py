@@ -0,0 +1,120 @@
+"""
+Revoked tokens and users, shared across pods through Redis and mirrored in memory.
+
+Redis holds only revocations that can still matter:
+
+    auth:revoked_tokens   sorted set, jti scored by the token's expiry
+    auth:revoked_users    hash, username -> time before which their tokens are invalid
+
+A background thread in every process reloads both every REVOCATION_SYNC_SECONDS
+(dropping entries whose tokens have expired anyway), so checking a token is a
+dictionary lookup and a revocation reaches every pod within one sync interval.
+While the local copy is stale (see is_fresh) tokens are checked against Redis directly.
+"""
+import os
+import threading
+import time
+from typing import Optional
+
+
+from app.core.config import REVOCATION_SYNC_SECONDS, ACCESS_TOKEN_EXPIRE_MINUTES, REFRESH_TOKEN_EXPIRE_DAYS
+from app.core.metrics import REVOCATION_ENTRIES, REVOCATION_SYNC_ERRORS
+from app.db.redis import get_main_redis
+
+REVOKED_TOKENS_KEY = "auth:revoked_tokens"
+REVOKED_USERS_KEY = "auth:revoked_users"
+# Beyond this many missed syncs the local copy is no longer trusted on its own
+STALE_AFTER_SYNCS = 3
+
+
+class RevocationList:
+    def __init__(self, sync_seconds: float):
+        self.sync_seconds = sync_seconds
+        self._tokens = {}  # jti -> expiry (epoch seconds)
+        self._users = {}  # username -> revoked at (epoch seconds)
+        self._synced_at = 0.0
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self) -> bool:
+        """True while the local copy is at most a few sync intervals old"""
+        self.ensure_started()
+        return time.monotonic() - self._synced_at < self.sync_seconds * STALE_AFTER_SYNCS
+
+    def is_revoked(self, claims: dict) -> bool:
+        jti = claims.get("jti")
+        if not self.is_fresh():
+            # The mirror may be missing recent revocations, so ask Redis; if that fails
+            # too, the error rejects the request rather than letting the token through
+            return self._is_revoked_in_redis(jti, claims)
+        if jti is not None and jti in self._tokens:
+            return True
+        revoked_at = self._users.get(claims.get("sub"))
+        # Tokens without an issue time predate revocation support and are treated as old.
+        # Both times are fractional seconds (see create_access_token), so order is exact.
+        return revoked_at is not None and claims.get("iat", 0) <= revoked_at
+
+    def _is_revoked_in_redis(self, jti: Optional[str], claims: dict) -> bool:
+        client = get_main_redis()
+        if jti is not None and client.zscore(REVOKED_TOKENS_KEY, jti) is not None:
+            return True
+        revoked_at = client.hget(REVOKED_USERS_KEY, claims.get("sub"))
+        return revoked_at is not None and claims.get("iat", 0) <= float(revoked_at)
+
+    def revoke_token(self, jti: str, expires_at: float):
+        get_main_redis().zadd(REVOKED_TOKENS_KEY, {jti: expires_at})
+        self._tokens[jti] = expires_at
+
+    def revoke_user(self, username: str, revoked_at: Optional[float] = None):
+        """Invalidate every token issued to username up to now"""
+        revoked_at = revoked_at or time.time()
+        get_main_redis().hset(REVOKED_USERS_KEY, username, revoked_at)
+        self._users[username] = revoked_at
+
+    def sync(self):
+        """Reload revocations from Redis, pruning ones whose tokens have all expired"""
+        now = time.time()
+        client = get_main_redis()
+        client.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", now)
+        tokens = dict(client.zrangebyscore(REVOKED_TOKENS_KEY, now, "+inf", withscores=True))
+
+        users = {}
+        # Refresh token families are checked against user revocations too, and live longer
+        oldest_valid = now - max(ACCESS_TOKEN_EXPIRE_MINUTES * 60, REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+        for username, revoked_at in client.hgetall(REVOKED_USERS_KEY).items():
+            revoked_at = float(revoked_at)
+            if revoked_at < oldest_valid:
+                # Every token issued before the revocation has expired by now
+                client.hdel(REVOKED_USERS_KEY, username)
+            else:
+                users[username] = revoked_at
+
+        self._tokens = tokens
+        self._users = users
+        self._synced_at = time.monotonic()
+        REVOCATION_ENTRIES.labels(kind="token").set(len(tokens))
+        REVOCATION_ENTRIES.labels(kind="user").set(len(users))
+
+    def ensure_started(self):
+        """Start the sync thread (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._synced_at = 0.0
+            threading.Thread(target=self._run, name="revocation-sync", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                # Keep the thread alive: a process that stops syncing would fall back to Redis for good
+                REVOCATION_SYNC_ERRORS.inc()
+                print(f"Failed to sync token revocations: {str(e)}")
+            time.sleep(self.sync_seconds)
+
+
+revocation_list = RevocationList(REVOCATION_SYNC_SECONDS)
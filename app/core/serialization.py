@@ -0,0 +1,56 @@
+"""
+Fast JSON for the hot routes.
+
+Request bodies are parsed with orjson instead of the json module, and responses
+rendered with ORJSONResponse, on routers that set route_class=ORJSONRoute and
+default_response_class=ORJSONResponse. Neither changes the OpenAPI schema:
+bodies are still validated by the same pydantic models. orjson reads integers
+beyond 64 bits as floats, so bodies with a run of 19 or more digits (which may
+be such an integer) are parsed with the json module instead, keeping them
+exact. Items read from Redis are already JSON, so GET /data/{key} sends the
+stored bytes with raw_json_response and skips re-encoding altogether.
+"""
+import json
+import re
+from typing import Callable, Dict, Optional, Union
+
+import orjson
+from fastapi import Request, Response
+from fastapi.routing import APIRoute
+
+
+# The shortest integers orjson may round: 2^63 has 19 digits
+_LONG_DIGITS = re.compile(rb"[0-9]{19}")
+
+
+def loads(body: bytes):
+    """Parse a request body, with orjson unless it may hold integers orjson would round"""
+    if _LONG_DIGITS.search(body):
+        return json.loads(body)
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so FastAPI still answers 422
+    return orjson.loads(body)
+
+
+class ORJSONRequest(Request):
+    async def json(self):
+        if not hasattr(self, "_json"):
+            self._json = loads(await self.body())
+        return self._json
+
+
+class ORJSONRoute(APIRoute):
+    """Route that parses JSON bodies with orjson"""
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            return await handler(ORJSONRequest(request.scope, request.receive))
+
+        return route_handler
+
+
+def raw_json_response(data: Union[str, bytes],
+                      headers: Optional[Dict[str, str]] = None) -> Response:
+    """A response whose body is already-encoded JSON, sent as is"""
+    return Response(content=data, media_type="application/json", headers=headers)
@@ -0,0 +1,171 @@
+"""
+Lightweight span instrumentation for the API and the Huey worker.
+
+A root trace is started per HTTP request (or background task) and sampled with
+probability TRACE_SAMPLE_RATE. Inside a sampled trace, `span(name)` records the
+duration of a stage; outside one it costs a single context variable lookup.
+Finished traces are exported off the request path by a background thread, as
+JSON lines to TRACE_EXPORT_PATH and/or batched POSTs to TRACE_COLLECTOR_URL.
+"""
+import contextvars
+import functools
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Optional
+
+import requests
+
+from app.core.config import TRACE_SAMPLE_RATE, TRACE_EXPORT_PATH, TRACE_COLLECTOR_URL
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+_current_span_id = contextvars.ContextVar("current_span_id", default=None)
+
+EXPORT_QUEUE_SIZE = 10000
+EXPORT_BATCH_SIZE = 100
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.spans = []
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Start a root trace (sampled) and record its root span"""
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        yield None
+        return
+
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _current_trace.reset(token)
+        _exporter.submit(trace)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage of the current trace; a no-op when the request is not sampled"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    record = {
+        "trace_id": trace.trace_id,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": _current_span_id.get(),
+        "name": name,
+        "start_ns": time.time_ns(),
+        "attributes": attributes,
+    }
+    token = _current_span_id.set(record["span_id"])
+    started = time.perf_counter_ns()
+    try:
+        yield record
+    except BaseException as e:
+        record["error"] = type(e).__name__
+        raise
+    finally:
+        record["duration_us"] = (time.perf_counter_ns() - started) / 1000
+        _current_span_id.reset(token)
+        trace.spans.append(record)
+
+
+class _Exporter:
+    """Background exporter; drops traces rather than blocking when it falls behind"""
+
+    def __init__(self):
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, trace: Trace):
+        if not TRACE_EXPORT_PATH and not TRACE_COLLECTOR_URL:
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            pass
+
+    def _ensure_started(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=EXPORT_QUEUE_SIZE)
+            threading.Thread(target=self._run, name="trace-exporter", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            spans = [s for trace in batch for s in trace.spans]
+            try:
+                self._export(spans)
+            except Exception as e:
+                print(f"Failed to export {len(spans)} spans: {str(e)}")
+
+    def _export(self, spans):
+        if TRACE_EXPORT_PATH:
+            with open(TRACE_EXPORT_PATH, "a") as f:
+                f.writelines(json.dumps(s) + "\n" for s in spans)
+        if TRACE_COLLECTOR_URL:
+            requests.post(TRACE_COLLECTOR_URL, json={"spans": spans}, timeout=5)
+
+
+_exporter = _Exporter()
+
+
+class TracingMiddleware:
+    """ASGI middleware that opens a sampled root trace per HTTP request"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with start_trace("http.request", method=scope["method"], path=scope["path"]) as root:
+            if root is None:
+                await self.app(scope, receive, send)
+                return
+
+            async def send_wrapper(message):
+                if message["type"] == "http.response.start":
+                    root["attributes"]["status_code"] = message["status"]
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+def traced_task(name: Optional[str] = None):
+    """Decorator opening a root trace around a background task"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_trace(name or f"task.{func.__name__}"):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
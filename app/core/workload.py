@@ -0,0 +1,310 @@
+"""
+Hot-key and per-tenant workload analytics in fixed memory.
+
+Every /data request is counted in the serving process by three sketches, whose
+size does not depend on how many keys there are:
+
+    count-min sketch   WORKLOAD_SKETCH_DEPTH rows of WORKLOAD_SKETCH_WIDTH counters,
+                       estimating requests per (tenant, key) (never underestimating)
+    top keys           the WORKLOAD_TOP_KEYS (tenant, key) pairs with the highest estimates
+    per tenant         a request count and a HyperLogLog of the keys touched; tenants
+                       beyond WORKLOAD_MAX_TENANTS are counted together as "_other"
+
+Windows are aligned to the clock, so every process closes the same windows. At
+the end of each WORKLOAD_WINDOW_SECONDS a background thread starts new sketches
+and writes the finished ones as fields of one Redis hash per window:
+
+    workload:window:{end}   field "{process}|cms", "{process}|top", "{process}|hll|{tenant}"
+
+The sketches merge exactly: counters add up and HyperLogLog registers take the
+maximum, so reading a window merges every process's fields into one view of the
+whole deployment. The merged view is what GET /admin/workload returns and what
+the workload_* metrics report.
+"""
+import hashlib
+import math
+import os
+import socket
+import threading
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import orjson
+
+from app.core.config import (
+    WORKLOAD_ENABLED,
+    WORKLOAD_WINDOW_SECONDS,
+    WORKLOAD_SKETCH_WIDTH,
+    WORKLOAD_SKETCH_DEPTH,
+    WORKLOAD_TOP_KEYS,
+    WORKLOAD_MAX_TENANTS,
+)
+from app.core.metrics import (
+    WORKLOAD_TENANT_REQUESTS,
+    WORKLOAD_TENANT_KEYS,
+    WORKLOAD_HOT_KEY_SHARE,
+    WORKLOAD_FLUSH_ERRORS,
+)
+from app.db.redis import get_binary_redis
+
+WINDOW_KEY_PREFIX = "workload:window:"
+OTHER_TENANTS = "_other"
+# 2^10 one-byte registers per tenant: about 3% standard error
+HLL_PRECISION = 10
+HLL_REGISTERS = 1 << HLL_PRECISION
+# Other processes write their window shortly after the boundary; reads wait this long for them
+MERGE_DELAY_SECONDS = min(5.0, WORKLOAD_WINDOW_SECONDS / 4)
+
+
+def _hash(tenant_id: str, key: str) -> int:
+    # Stable across processes (unlike hash()), so sketches from different pods line up
+    digest = hashlib.blake2b(f"{tenant_id}\0{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+def hll_estimate(registers) -> int:
+    """Cardinality estimate of a HyperLogLog, with the small-range correction"""
+    m = len(registers)
+    zeros = 0
+    total = 0.0
+    for rank in registers:
+        total += 2.0 ** -rank
+        if rank == 0:
+            zeros += 1
+    estimate = 0.7213 / (1 + 1.079 / m) * m * m / total
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return round(estimate)
+
+
+class WorkloadSketch:
+    """One window of request counts; updates are made under the caller's lock"""
+
+    def __init__(self, width: int, depth: int, top_keys: int, max_tenants: int):
+        self.width = width
+        self.depth = depth
+        self.top_keys = top_keys
+        self.max_tenants = max_tenants
+        self.counters = array("I", bytes(4 * width * depth))
+        self.top = {}  # (tenant_id, key) -> estimate
+        self._top_floor = 0
+        self.tenants = {}  # tenant_id -> requests
+        self.hlls = {}  # tenant_id -> bytearray of registers
+
+    def add(self, tenant_id: str, key: str):
+        h = _hash(tenant_id, key)
+
+        # Count-min: one counter per row, chosen by double hashing
+        h1 = h & 0xFFFFFFFF
+        h2 = (h >> 32) | 1
+        counters = self.counters
+        estimate = None
+        for row in range(self.depth):
+            index = row * self.width + (h1 + row * h2) % self.width
+            count = counters[index] + 1
+            counters[index] = count
+            if estimate is None or count < estimate:
+                estimate = count
+
+        item = (tenant_id, key)
+        top = self.top
+        if item in top or len(top) < self.top_keys:
+            top[item] = estimate
+        elif estimate > self._top_floor:
+            del top[min(top, key=top.get)]
+            top[item] = estimate
+            self._top_floor = min(top.values())
+
+        if tenant_id not in self.tenants and len(self.tenants) >= self.max_tenants:
+            tenant_id = OTHER_TENANTS
+        self.tenants[tenant_id] = self.tenants.get(tenant_id, 0) + 1
+        registers = self.hlls.get(tenant_id)
+        if registers is None:
+            registers = self.hlls[tenant_id] = bytearray(HLL_REGISTERS)
+        # The top bits pick the register, the rest give the rank (position of the first 1 bit)
+        rest_bits = 64 - HLL_PRECISION
+        register = h >> rest_bits
+        rank = rest_bits - (h & ((1 << rest_bits) - 1)).bit_length() + 1
+        if rank > registers[register]:
+            registers[register] = rank
+
+    def fields(self, process: str) -> Dict[str, bytes]:
+        """This window as hash fields of the window key"""
+        fields = {
+            f"{process}|cms": self.counters.tobytes(),
+            f"{process}|top": orjson.dumps({
+                "top": [[tenant_id, key] for tenant_id, key in self.top],
+                "tenants": self.tenants,
+            }),
+        }
+        for tenant_id, registers in self.hlls.items():
+            fields[f"{process}|hll|{tenant_id}"] = bytes(registers)
+        return fields
+
+
+def merge_window(fields: Dict[bytes, bytes], window_end: int, tenant_id: Optional[str] = None,
+                 limit: Optional[int] = WORKLOAD_TOP_KEYS) -> dict:
+    """Merge every process's sketches of one window into the deployment-wide view"""
+    counters = None
+    candidates = set()
+    tenants = {}
+    hlls = {}
+    processes = set()
+    for field, value in fields.items():
+        process, _, part = field.decode().partition("|")
+        processes.add(process)
+        if part == "cms":
+            sketch = array("I")
+            sketch.frombytes(value)
+            if counters is None:
+                counters = [0] * len(sketch)
+            if len(sketch) == len(counters):
+                # Sketches of a different size (during a config change) cannot be merged
+                counters = [a + b for a, b in zip(counters, sketch)]
+        elif part == "top":
+            snapshot = orjson.loads(value)
+            candidates.update((t, k) for t, k in snapshot["top"])
+            for t, requests in snapshot["tenants"].items():
+                tenants[t] = tenants.get(t, 0) + requests
+        elif part.startswith("hll|"):
+            t = part[4:]
+            merged = hlls.get(t)
+            hlls[t] = value if merged is None else bytes(map(max, merged, value))
+
+    total = sum(tenants.values())
+    if tenant_id is not None:
+        candidates = {item for item in candidates if item[0] == tenant_id}
+
+    hot_keys = []
+    if counters is not None:
+        width = len(counters) // WORKLOAD_SKETCH_DEPTH
+        for t, key in candidates:
+            h = _hash(t, key)
+            h1 = h & 0xFFFFFFFF
+            h2 = (h >> 32) | 1
+            estimate = min(counters[row * width + (h1 + row * h2) % width]
+                           for row in range(WORKLOAD_SKETCH_DEPTH))
+            hot_keys.append({"tenant_id": t, "key": key, "requests": estimate})
+    hot_keys.sort(key=lambda entry: entry["requests"], reverse=True)
+    hot_keys = hot_keys[:limit]
+    for entry in hot_keys:
+        tenant_requests = tenants.get(entry["tenant_id"]) or entry["requests"]
+        entry["tenant_share"] = round(min(1.0, entry["requests"] / tenant_requests), 4)
+
+    tenant_stats = [
+        {
+            "tenant_id": t,
+            "requests": requests,
+            "share": round(requests / total, 4) if total else 0.0,
+            "distinct_keys": hll_estimate(hlls[t]) if t in hlls else 0,
+        }
+        for t, requests in tenants.items()
+        if tenant_id is None or t == tenant_id
+    ]
+    tenant_stats.sort(key=lambda entry: entry["requests"], reverse=True)
+
+    return {
+        "window_start": datetime.fromtimestamp(window_end - WORKLOAD_WINDOW_SECONDS, timezone.utc).isoformat(),
+        "window_end": datetime.fromtimestamp(window_end, timezone.utc).isoformat(),
+        "processes": len(processes),
+        "total_requests": total,
+        "hot_keys": hot_keys,
+        "tenants": tenant_stats,
+    }
+
+
+class WorkloadTracker:
+    def __init__(self, window_seconds: int):
+        self.window_seconds = window_seconds
+        self._sketch = self._new_sketch()
+        self._process = None
+        self._reported = set()
+        self._pid = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+
+    @staticmethod
+    def _new_sketch() -> WorkloadSketch:
+        return WorkloadSketch(WORKLOAD_SKETCH_WIDTH, WORKLOAD_SKETCH_DEPTH, WORKLOAD_TOP_KEYS, WORKLOAD_MAX_TENANTS)
+
+    def record(self, tenant_id: str, key: str):
+        self.ensure_started()
+        with self._lock:
+            self._sketch.add(tenant_id, key)
+
+    def last_window_end(self, now: Optional[float] = None) -> int:
+        """End of the latest window every process has had time to write"""
+        now = time.time() if now is None else now
+        return int((now - MERGE_DELAY_SECONDS) // self.window_seconds * self.window_seconds)
+
+    def read_window(self, window_end: Optional[int] = None, tenant_id: Optional[str] = None,
+                    limit: Optional[int] = WORKLOAD_TOP_KEYS) -> dict:
+        window_end = self.last_window_end() if window_end is None else window_end
+        fields = get_binary_redis().hgetall(f"{WINDOW_KEY_PREFIX}{window_end}")
+        view = merge_window(fields, window_end, tenant_id, limit)
+        view["window_seconds"] = self.window_seconds
+        return view
+
+    def flush(self, window_end: int):
+        """Start a new window and write the finished one to Redis"""
+        with self._lock:
+            sketch, self._sketch = self._sketch, self._new_sketch()
+        if not sketch.tenants:
+            return
+        window_key = f"{WINDOW_KEY_PREFIX}{window_end}"
+        pipe = get_binary_redis().pipeline(transaction=False)
+        pipe.hset(window_key, mapping=sketch.fields(self._process))
+        # The previous window is what gets read, so keep two plus some slack
+        pipe.expire(window_key, self.window_seconds * 3)
+        pipe.execute()
+
+    def update_metrics(self, window_end: int):
+        view = self.read_window(window_end, limit=None)
+        hottest = {}
+        for entry in view["hot_keys"]:
+            hottest.setdefault(entry["tenant_id"], entry["tenant_share"])
+        stats = {entry["tenant_id"]: entry for entry in view["tenants"]}
+        # Tenants idle in this window are reported as 0 rather than keeping their last value
+        for tenant_id in self._reported | stats.keys():
+            entry = stats.get(tenant_id, {})
+            WORKLOAD_TENANT_REQUESTS.labels(tenant_id=tenant_id).set(entry.get("requests", 0))
+            WORKLOAD_TENANT_KEYS.labels(tenant_id=tenant_id).set(entry.get("distinct_keys", 0))
+            WORKLOAD_HOT_KEY_SHARE.labels(tenant_id=tenant_id).set(hottest.get(tenant_id, 0.0))
+        self._reported = set(stats)
+
+    def ensure_started(self):
+        """Start the flush thread (again after a fork, with fresh sketches)"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._lock = threading.Lock()
+            self._sketch = self._new_sketch()
+            self._process = f"{socket.gethostname()}-{os.getpid()}"
+            threading.Thread(target=self._run, name="workload-flush", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            window_end = int((time.time() // self.window_seconds + 1) * self.window_seconds)
+            time.sleep(max(0.0, window_end - time.time()))
+            try:
+                self.flush(window_end)
+                time.sleep(MERGE_DELAY_SECONDS)
+                self.update_metrics(window_end)
+            except Exception as e:
+                # A lost window only leaves a gap in the analytics
+                WORKLOAD_FLUSH_ERRORS.inc()
+                print(f"Failed to flush workload analytics: {str(e)}")
+
+
+workload_tracker = WorkloadTracker(WORKLOAD_WINDOW_SECONDS)
+
+
+def record_access(tenant_id: str, key: str):
+    """Count a /data request against its tenant and key; called by every /data route"""
+    if WORKLOAD_ENABLED:
+        workload_tracker.record(tenant_id, key)
@@ -0,0 +1,233 @@
+"""
+Chunked storage for large values streamed through /data/{key}/stream.
+
+A value is split into BLOB_CHUNK_BYTES pieces, each stored under its own key,
+plus a manifest hash describing the upload:
+
+    tenant:{tenant_id}:blob:<key>                       manifest (upload_id, size, chunks, ...)
+    tenant:{tenant_id}:blobchunk:<upload_id>:<index>    chunk bytes
+
+Chunks are written while the request body is still arriving, so only one chunk
+is held in memory at a time. They carry a short TTL until the upload is
+committed; the commit script then points the manifest at the new upload and
+applies the item's TTL to the manifest and every chunk in one atomic step. All
+keys share the tenant's hash tag, so the script runs on one node in cluster mode.
+"""
+import hashlib
+import uuid
+from typing import AsyncIterator, Iterator, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import (
+    BLOB_CHUNK_BYTES,
+    BLOB_MAX_BYTES,
+    BLOB_UPLOAD_TIMEOUT_SECONDS,
+    BLOB_REPLACED_GRACE_SECONDS,
+)
+from app.db.redis import get_main_redis, get_binary_redis, get_tenant_prefix, escape_glob
+
+# Point the manifest at a fully written upload.
+# KEYS: manifest, the new upload's chunks, then the chunks of the upload being replaced.
+# ARGV: upload_id expected in the manifest ('' if none), new upload_id, chunk count,
+#       size, sha256, content type, ttl seconds (0 for none), grace seconds.
+# Returns 0 without writing if another upload was committed in the meantime.
+COMMIT_BLOB_LUA = """
+local current = redis.call('HGET', KEYS[1], 'upload_id') or ''
+if current ~= ARGV[1] then
+    return 0
+end
+local chunks = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[7])
+
+redis.call('DEL', KEYS[1])
+redis.call('HSET', KEYS[1], 'upload_id', ARGV[2], 'chunks', ARGV[3], 'size', ARGV[4],
+           'sha256', ARGV[5], 'content_type', ARGV[6])
+for i = 1, chunks + 1 do
+    if ttl > 0 then
+        redis.call('EXPIRE', KEYS[i], ttl)
+    else
+        redis.call('PERSIST', KEYS[i])
+    end
+end
+-- Replaced chunks linger briefly so downloads already streaming them can finish
+for i = chunks + 2, #KEYS do
+    redis.call('EXPIRE', KEYS[i], ARGV[8])
+end
+return 1
+"""
+
+# Remove a value. KEYS: manifest, then its chunks. ARGV: expected upload_id, grace seconds.
+# Returns 1 if deleted, 0 if the manifest is missing, -1 if it was replaced meanwhile.
+DELETE_BLOB_LUA = """
+local current = redis.call('HGET', KEYS[1], 'upload_id')
+if not current then
+    return 0
+end
+if current ~= ARGV[1] then
+    return -1
+end
+redis.call('DEL', KEYS[1])
+for i = 2, #KEYS do
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+# Attempts before giving up when concurrent uploads keep replacing the manifest
+MAX_COMMIT_ATTEMPTS = 5
+
+_scripts = {}
+
+
+class BlobTooLargeError(Exception):
+    """Raised when an upload exceeds BLOB_MAX_BYTES"""
+
+
+class BlobConflictError(Exception):
+    """Raised when concurrent writers keep replacing the value"""
+
+
+def _get_script(lua: str):
+    script = _scripts.get(lua)
+    if script is None:
+        script = _scripts[lua] = get_main_redis().register_script(lua)
+    return script
+
+
+def get_manifest_key(tenant_id: str, key: str) -> str:
+    return f"{get_tenant_prefix(tenant_id)}:blob:{key}"
+
+
+def get_chunk_key(tenant_id: str, upload_id: str, index: int) -> str:
+    return f"{get_tenant_prefix(tenant_id)}:blobchunk:{upload_id}:{index}"
+
+
+def _chunk_keys(tenant_id: str, manifest: Optional[dict]) -> list:
+    if not manifest:
+        return []
+    return [get_chunk_key(tenant_id, manifest["upload_id"], i) for i in range(manifest["chunks"])]
+
+
+def get_manifest(tenant_id: str, key: str) -> Optional[dict]:
+    """Return the manifest of a stored value, or None if there is none"""
+    manifest = get_main_redis().hgetall(get_manifest_key(tenant_id, key))
+    if not manifest:
+        return None
+    manifest["chunks"] = int(manifest["chunks"])
+    manifest["size"] = int(manifest["size"])
+    return manifest
+
+
+def count_blobs(tenant_id: str) -> int:
+    """Number of values the tenant has stored through /data/{key}/stream"""
+    pattern = escape_glob(get_manifest_key(tenant_id, "")) + "*"
+    return sum(1 for _ in get_main_redis().scan_iter(match=pattern, count=1000))
+
+
+def blob_pttl(tenant_id: str, key: str) -> int:
+    """The value's remaining TTL in ms: -1 if it has none, -2 if it does not exist"""
+    return get_main_redis().pttl(get_manifest_key(tenant_id, key))
+
+
+async def store_blob(tenant_id: str, key: str, body: AsyncIterator[bytes], content_type: str,
+                     ttl: Optional[int] = None) -> dict:
+    """
+    Store a request body as chunks as it arrives and commit it under key.
+
+    Returns the new manifest. Raises BlobTooLargeError once more than
+    BLOB_MAX_BYTES have been received; chunks written so far are removed.
+    """
+    redis_client = get_main_redis()
+    upload_id = uuid.uuid4().hex
+    digest = hashlib.sha256()
+    size = 0
+    chunks = 0
+    buffer = bytearray()
+
+    def write_chunk(index: int, data: bytes):
+        redis_client.set(get_chunk_key(tenant_id, upload_id, index), data, ex=BLOB_UPLOAD_TIMEOUT_SECONDS)
+
+    try:
+        async for piece in body:
+            size += len(piece)
+            if size > BLOB_MAX_BYTES:
+                raise BlobTooLargeError(f"Value exceeds {BLOB_MAX_BYTES} bytes")
+            digest.update(piece)
+            buffer += piece
+            while len(buffer) >= BLOB_CHUNK_BYTES:
+                await run_in_threadpool(write_chunk, chunks, bytes(buffer[:BLOB_CHUNK_BYTES]))
+                del buffer[:BLOB_CHUNK_BYTES]
+                chunks += 1
+        if buffer or chunks == 0:
+            await run_in_threadpool(write_chunk, chunks, bytes(buffer))
+            chunks += 1
+    except BaseException:
+        written = [get_chunk_key(tenant_id, upload_id, i) for i in range(chunks)]
+        if written:
+            await run_in_threadpool(redis_client.delete, *written)
+        raise
+
+    manifest = {
+        "upload_id": upload_id,
+        "chunks": chunks,
+        "size": size,
+        "sha256": digest.hexdigest(),
+        "content_type": content_type,
+    }
+    await run_in_threadpool(_commit, tenant_id, key, manifest, ttl)
+    return manifest
+
+
+def _commit(tenant_id: str, key: str, manifest: dict, ttl: Optional[int]):
+    manifest_key = get_manifest_key(tenant_id, key)
+    new_keys = _chunk_keys(tenant_id, manifest)
+    for _ in range(MAX_COMMIT_ATTEMPTS):
+        previous = get_manifest(tenant_id, key)
+        committed = _get_script(COMMIT_BLOB_LUA)(
+            keys=[manifest_key] + new_keys + _chunk_keys(tenant_id, previous),
+            args=[
+                previous["upload_id"] if previous else "",
+                manifest["upload_id"],
+                manifest["chunks"],
+                manifest["size"],
+                manifest["sha256"],
+                manifest["content_type"],
+                ttl or 0,
+                BLOB_REPLACED_GRACE_SECONDS,
+            ],
+            client=get_main_redis(),
+        )
+        if committed:
+            return
+    get_main_redis().delete(*new_keys)
+    raise BlobConflictError("Value was replaced concurrently, try again")
+
+
+def iter_blob(tenant_id: str, manifest: dict) -> Iterator[bytes]:
+    """Yield a stored value chunk by chunk"""
+    binary_client = get_binary_redis()
+    for chunk_key in _chunk_keys(tenant_id, manifest):
+        data = binary_client.get(chunk_key)
+        if data is None:
+            # Replaced or deleted longer ago than the grace period; the response is cut short
+            raise RuntimeError(f"Chunk {chunk_key} is no longer available")
+        yield data
+
+
+def delete_blob(tenant_id: str, key: str) -> Optional[dict]:
+    """Delete a stored value and all its chunks; returns its manifest, or None if missing"""
+    for _ in range(MAX_COMMIT_ATTEMPTS):
+        manifest = get_manifest(tenant_id, key)
+        if manifest is None:
+            return None
+        deleted = _get_script(DELETE_BLOB_LUA)(
+            keys=[get_manifest_key(tenant_id, key)] + _chunk_keys(tenant_id, manifest),
+            args=[manifest["upload_id"], BLOB_REPLACED_GRACE_SECONDS],
+            client=get_main_redis(),
+        )
+        if deleted == 1:
+            return manifest
+        if deleted == 0:
+            return None
+    raise BlobConflictError("Value was replaced concurrently, try again")
@@ -0,0 +1,244 @@
+"""
+Per-tenant change feed of /data items, for clients that would otherwise poll.
+
+Writes append an event to the tenant's stream, tenant:{tenant_id}:changes,
+capped at about CHANGE_FEED_MAXLEN entries:
+
+    type   create | update | delete | expire
+    key    the item's key
+    etag   the new ETag (create and update)
+
+Expire events are added by the expiration task once the item is really gone.
+
+Subscribers (GET /changes) are served by one reader per tenant and process,
+which blocks on XREAD and hands each new event to the tenant's subscribers
+through bounded queues, so the number of Redis connections does not grow with
+the number of subscribers. A subscriber whose queue fills up (its client reads
+too slowly) is detached and catches up from the stream itself with XRANGE,
+which keeps memory bounded without dropping events. The same catch-up resumes a
+client from its Last-Event-ID. If the events after that id have already been
+trimmed, the client gets a "reset" event and should reload the keys it follows.
+"""
+import asyncio
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import redis
+
+from app.core.config import CHANGE_FEED_MAXLEN, CHANGE_FEED_QUEUE_SIZE, CHANGE_FEED_HEARTBEAT_SECONDS
+from app.core.metrics import CHANGE_FEED_SUBSCRIBERS, CHANGE_FEED_EVENTS
+from app.db.redis import get_main_redis, get_async_redis, get_tenant_prefix
+
+CHANGE_TYPES = ("create", "update", "delete", "expire")
+# Events read per XRANGE / XREAD call
+READ_BATCH_SIZE = 100
+READ_BLOCK_MS = 5000
+
+
+def changes_key(tenant_id: str) -> str:
+    return f"{get_tenant_prefix(tenant_id)}:changes"
+
+
+def _fields(change_type: str, key: str, etag: Optional[str]) -> dict:
+    fields = {"type": change_type, "key": key}
+    if etag is not None:
+        fields["etag"] = etag
+    return fields
+
+
+def publish_change(tenant_id: str, change_type: str, key: str, etag: Optional[str] = None):
+    """Append a change event; failures are logged, the write itself already happened"""
+    try:
+        get_main_redis().xadd(changes_key(tenant_id), _fields(change_type, key, etag),
+                              maxlen=CHANGE_FEED_MAXLEN, approximate=True)
+        CHANGE_FEED_EVENTS.labels(result="published").inc()
+    except redis.exceptions.RedisError as e:
+        print(f"Failed to publish {change_type} event for {tenant_id}:{key}: {str(e)}")
+
+
+def add_change(pipe, tenant_id: str, change_type: str, key: str, etag: Optional[str] = None):
+    """Queue a change event on a pipeline, next to the write it describes"""
+    pipe.xadd(changes_key(tenant_id), _fields(change_type, key, etag), maxlen=CHANGE_FEED_MAXLEN, approximate=True)
+
+
+def _stream_id(entry_id: str) -> Tuple[int, int]:
+    ms, _, seq = entry_id.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def parse_event_id(entry_id: str) -> Optional[str]:
+    """A Last-Event-ID as a stream id, or None if it is not one"""
+    try:
+        ms, seq = _stream_id(entry_id)
+    except ValueError:
+        return None
+    return f"{ms}-{seq}" if ms >= 0 and seq >= 0 else None
+
+
+class Subscription:
+    def __init__(self, key: Optional[str], prefix: Optional[str]):
+        self.key = key
+        self.prefix = prefix
+        self.queue = asyncio.Queue(maxsize=CHANGE_FEED_QUEUE_SIZE)
+        self.lagging = False
+        # Every event after this id is queued; set once the tenant's reader is running
+        self.from_id = None
+        self.ready = asyncio.Event()
+
+    def matches(self, fields: dict) -> bool:
+        if self.key is not None and fields.get("key") != self.key:
+            return False
+        return self.prefix is None or fields.get("key", "").startswith(self.prefix)
+
+
+class _TenantReader:
+    """Reads one tenant's stream and fans new events out to its subscriptions"""
+
+    def __init__(self, tenant_id: str):
+        self.tenant_id = tenant_id
+        self.subscriptions = set()
+        self.cursor = None  # last id handed to subscriptions, None until started
+        self.task = None
+
+    def add(self, subscription: Subscription):
+        subscription.lagging = False
+        self.subscriptions.add(subscription)
+        if self.cursor is not None:
+            subscription.from_id = self.cursor
+            subscription.ready.set()
+
+    async def run(self, on_idle):
+        client = get_async_redis()
+        key = changes_key(self.tenant_id)
+        try:
+            latest = await client.xrevrange(key, max="+", min="-", count=1)
+            self.cursor = latest[0][0] if latest else "0-0"
+            for subscription in self.subscriptions:
+                subscription.from_id = self.cursor
+                subscription.ready.set()
+            while self.subscriptions:
+                response = await client.xread({key: self.cursor}, count=READ_BATCH_SIZE, block=READ_BLOCK_MS)
+                for _, entries in response or []:
+                    for entry_id, fields in entries:
+                        self.cursor = entry_id
+                        self._deliver(entry_id, fields)
+        except redis.exceptions.RedisError as e:
+            print(f"Change feed reader for {self.tenant_id} failed: {str(e)}")
+            # Subscribers notice they are detached and read the stream themselves
+            for subscription in list(self.subscriptions):
+                self._detach(subscription)
+                subscription.ready.set()
+        finally:
+            self.cursor = None
+            on_idle(self)
+
+    def _deliver(self, entry_id: str, fields: dict):
+        for subscription in list(self.subscriptions):
+            try:
+                subscription.queue.put_nowait((entry_id, fields))
+            except asyncio.QueueFull:
+                # The client reads too slowly; it continues from Redis instead of memory
+                CHANGE_FEED_EVENTS.labels(result="lagged").inc()
+                self._detach(subscription)
+
+    def _detach(self, subscription: Subscription):
+        subscription.lagging = True
+        self.subscriptions.discard(subscription)
+
+
+class ChangeFeed:
+    """The tenant readers of this process (one event loop)"""
+
+    def __init__(self):
+        self._readers: Dict[str, _TenantReader] = {}
+
+    async def subscribe(self, tenant_id: str, subscription: Subscription) -> str:
+        """Attach a subscription; returns the id after which every event will be queued"""
+        subscription.ready.clear()
+        reader = self._readers.get(tenant_id)
+        if reader is None:
+            reader = self._readers[tenant_id] = _TenantReader(tenant_id)
+        reader.add(subscription)
+        if reader.task is None:
+            reader.task = asyncio.create_task(reader.run(self._idle))
+        await subscription.ready.wait()
+        if subscription.lagging:
+            raise redis.exceptions.ConnectionError(f"Change feed for {tenant_id} is unavailable")
+        return subscription.from_id
+
+    def unsubscribe(self, tenant_id: str, subscription: Subscription):
+        reader = self._readers.get(tenant_id)
+        if reader is not None:
+            reader.subscriptions.discard(subscription)
+
+    def _idle(self, reader: _TenantReader):
+        if self._readers.get(reader.tenant_id) is reader:
+            del self._readers[reader.tenant_id]
+
+
+change_feed = ChangeFeed()
+
+
+def _format(entry_id: str, fields: dict) -> str:
+    data = {"type": fields.get("type"), "key": fields.get("key")}
+    if "etag" in fields:
+        data["etag"] = fields["etag"]
+    return f"id: {entry_id}\nevent: {data['type']}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _catch_up(client, tenant_id: str, subscription: Subscription, after: str) -> Tuple[List[str], str]:
+    """SSE messages for events after `after` still in the stream, and the last id read"""
+    key = changes_key(tenant_id)
+    messages = []
+    first = await client.xrange(key, min="-", max="+", count=1)
+    if first and _stream_id(first[0][0]) > _stream_id(after) and after != "0-0":
+        # Events after `after` may have been trimmed
+        messages.append(f"event: reset\ndata: {json.dumps({'after': after})}\n\n")
+    while True:
+        entries = await client.xrange(key, min=f"({after}", max="+", count=READ_BATCH_SIZE)
+        for entry_id, fields in entries:
+            after = entry_id
+            if subscription.matches(fields):
+                messages.append(_format(entry_id, fields))
+        if len(entries) < READ_BATCH_SIZE:
+            return messages, after
+
+
+async def iter_changes(tenant_id: str, key: Optional[str], prefix: Optional[str],
+                       last_event_id: Optional[str]) -> AsyncIterator[str]:
+    """SSE messages for a tenant's changes, from last_event_id (exclusive) or from now"""
+    client = get_async_redis()
+    subscription = Subscription(key, prefix)
+    CHANGE_FEED_SUBSCRIBERS.inc()
+    try:
+        # Subscribe before reading the stream, so no event falls between the two
+        last_id = await change_feed.subscribe(tenant_id, subscription)
+        if last_event_id is not None:
+            messages, last_id = await _catch_up(client, tenant_id, subscription, last_event_id)
+            for message in messages:
+                yield message
+        yield "retry: 3000\n\n"
+
+        while True:
+            if subscription.lagging and subscription.queue.empty():
+                # Detached for reading too slowly: reattach, then read what was missed from Redis
+                await change_feed.subscribe(tenant_id, subscription)
+                messages, last_id = await _catch_up(client, tenant_id, subscription, last_id)
+                for message in messages:
+                    yield message
+            try:
+                entry_id, fields = await asyncio.wait_for(subscription.queue.get(), CHANGE_FEED_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection, and notices clients that left
+                yield ": keepalive\n\n"
+                continue
+            if _stream_id(entry_id) <= _stream_id(last_id):
+                # Already sent while catching up
+                continue
+            last_id = entry_id
+            if subscription.matches(fields):
+                CHANGE_FEED_EVENTS.labels(result="delivered").inc()
+                yield _format(entry_id, fields)
+    finally:
+        change_feed.unsubscribe(tenant_id, subscription)
+        CHANGE_FEED_SUBSCRIBERS.dec()
@@ -0,0 +1,67 @@
+"""
+Which expiration task owns a key's current TTL.
+
+Every write that sets a TTL schedules an expiration task and records the task's
+id in a marker next to the key, tenant:{tenant_id}:expiry:{kind}:{key}. A later
+write with a TTL replaces the marker, and a delete or a write without a TTL
+removes it, so earlier tasks find a marker that is not theirs and do nothing.
+The task that owns the marker claims it (compare and delete) before logging the
+expiration, so duplicate runs log it once.
+"""
+import uuid
+from typing import Optional
+
+from app.core.config import EXPIRATION_MARKER_GRACE_SECONDS
+from app.db.redis import get_main_redis, get_tenant_prefix
+
+CLAIM_EXPIRATION_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_claim_script = None
+
+
+def expiration_marker_key(tenant_id: str, key: str, kind: str) -> str:
+    return f"{get_tenant_prefix(tenant_id)}:expiry:{kind}:{key}"
+
+
+def record_expiration(tenant_id: str, key: str, kind: str, ttl: int) -> str:
+    """Make a new expiration task the owner of the key's TTL and return its id"""
+    expiration_id = uuid.uuid4().hex
+    # Outlives the key, so a task that runs late still finds it
+    get_main_redis().set(expiration_marker_key(tenant_id, key, kind), expiration_id,
+                         ex=ttl + EXPIRATION_MARKER_GRACE_SECONDS)
+    return expiration_id
+
+
+def extend_expiration(tenant_id: str, key: str, kind: str, pttl: int):
+    get_main_redis().pexpire(expiration_marker_key(tenant_id, key, kind),
+                             pttl + EXPIRATION_MARKER_GRACE_SECONDS * 1000)
+
+
+def cancel_expiration(tenant_id: str, key: str, kind: str):
+    """The key was deleted or written without a TTL: no pending task may log its expiration"""
+    get_main_redis().delete(expiration_marker_key(tenant_id, key, kind))
+
+
+def owns_expiration(tenant_id: str, key: str, kind: str, expiration_id: Optional[str]) -> bool:
+    # Tasks scheduled before markers existed carry no id
+    if expiration_id is None:
+        return True
+    current = get_main_redis().get(expiration_marker_key(tenant_id, key, kind))
+    if isinstance(current, bytes):
+        current = current.decode()
+    return current == expiration_id
+
+
+def claim_expiration(tenant_id: str, key: str, kind: str, expiration_id: Optional[str]) -> bool:
+    """Remove the marker if it is still this task's; True if the caller may log the expiration"""
+    global _claim_script
+    if expiration_id is None:
+        return True
+    if _claim_script is None:
+        _claim_script = get_main_redis().register_script(CLAIM_EXPIRATION_LUA)
+    return bool(_claim_script(keys=[expiration_marker_key(tenant_id, key, kind)], args=[expiration_id]))
@@ -0,0 +1,934 @@
+"""
+Storage of /data items, and conditional writes on them.
+
+Two layouts are available, chosen with ITEM_STORAGE_LAYOUT; routes only see the
+functions at the bottom of this module, so switching is invisible to the API:
+
+strings (default)
+    Every item is its own string key, tenant:{tenant_id}:data:<key>.
+
+buckets
+    Small items are fields of hash buckets, tenant:{tenant_id}:bucket:<n>, with
+    n = crc32(key) % ITEM_BUCKETS. Small hashes are stored as compact listpacks,
+    which costs far less per item than a key of its own, as long as buckets stay
+    within hash-max-listpack-entries and items within ITEM_BUCKET_MAX_VALUE_BYTES
+    (keep it at most hash-max-listpack-value). Per-item TTLs use hash field
+    expiry (HEXPIRE, Redis 7.4+). Larger items, and items with a TTL on older
+    Redis versions, stay string keys; every operation looks in both places, so
+    items written before the layout was switched keep working and move into
+    buckets when next written.
+
+An item's ETag is the SHA-1 of its stored JSON (see local_cache.item_etag), which
+Lua computes with redis.sha1hex, so the If-Match check and the write happen in
+one script and no separate version field has to be kept in sync with the value.
+"""
+import json
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+import redis
+
+from app.core.config import ITEM_STORAGE_LAYOUT, ITEM_BUCKETS, ITEM_BUCKET_MAX_VALUE_BYTES
+from app.db.local_cache import get_item_cached
+from app.db.redis import get_main_redis, get_namespaced_key, get_tenant_prefix, escape_glob
+
+# Replace an existing item, optionally only if its current ETag is one of the given ones.
+# KEYS: item key. ARGV: new JSON, ttl seconds (0 for none), then accepted ETags (none = any).
+# Returns 1 if written, 0 if the key does not exist, -1 if no ETag matched.
+REPLACE_ITEM_LUA = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return 0
+end
+if #ARGV > 2 then
+    local etag = redis.sha1hex(current)
+    local matched = false
+    for i = 3, #ARGV do
+        if ARGV[i] == etag then
+            matched = true
+            break
+        end
+    end
+    if not matched then
+        return -1
+    end
+end
+redis.call('SET', KEYS[1], ARGV[1])
+local ttl = tonumber(ARGV[2])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+# Delete an item, optionally only if its current ETag is one of the given ones.
+# KEYS: item key. ARGV: accepted ETags (none = any).
+# Returns {1, deleted JSON}, {0} if the key does not exist, {-1} if no ETag matched.
+DELETE_ITEM_LUA = """
+local current = redis.call('GET', KEYS[1])
+if not current then
+    return {0}
+end
+if #ARGV > 0 then
+    local etag = redis.sha1hex(current)
+    local matched = false
+    for i = 1, #ARGV do
+        if ARGV[i] == etag then
+            matched = true
+            break
+        end
+    end
+    if not matched then
+        return {-1}
+    end
+end
+redis.call('DEL', KEYS[1])
+return {1, current}
+"""
+
+# The bucket layout's scripts all take KEYS: bucket, string key, and ARGV[1] = the
+# item's field in the bucket. The item is in at most one of the two places.
+BUCKET_FIND_LUA = """
+local function find()
+    local current = redis.call('HGET', KEYS[1], ARGV[1])
+    if current then
+        return current, true
+    end
+    return redis.call('GET', KEYS[2]), false
+end
+
+local function etag_matches(current, first)
+    if #ARGV < first then
+        return true
+    end
+    local etag = redis.sha1hex(current)
+    for i = first, #ARGV do
+        if ARGV[i] == etag then
+            return true
+        end
+    end
+    return false
+end
+
+-- Store an item in the bucket (in_bucket = '1') or as a string key, removing it from the other place.
+-- field_ttl = '1' when the server supports hash field expiry.
+local function store(data, ttl, in_bucket, field_ttl)
+    if in_bucket == '1' then
+        redis.call('DEL', KEYS[2])
+        redis.call('HSET', KEYS[1], ARGV[1], data)
+        if ttl > 0 then
+            redis.call('HEXPIRE', KEYS[1], ttl, 'FIELDS', 1, ARGV[1])
+        elseif field_ttl == '1' then
+            redis.call('HPERSIST', KEYS[1], 'FIELDS', 1, ARGV[1])
+        end
+    else
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        redis.call('SET', KEYS[2], data)
+        if ttl > 0 then
+            redis.call('EXPIRE', KEYS[2], ttl)
+        end
+    end
+end
+"""
+
+# Create an item if it does not exist. ARGV: field, JSON, ttl seconds (0 for none), in_bucket, field_ttl.
+# Returns 1 if created, 0 if it already exists.
+BUCKET_CREATE_LUA = BUCKET_FIND_LUA + """
+if find() then
+    return 0
+end
+store(ARGV[2], tonumber(ARGV[3]), ARGV[4], ARGV[5])
+return 1
+"""
+
+# Replace an existing item. ARGV: field, JSON, ttl seconds, in_bucket, field_ttl, then accepted ETags.
+# Returns 1 if written, 0 if the item does not exist, -1 if no ETag matched.
+BUCKET_REPLACE_LUA = BUCKET_FIND_LUA + """
+local current = find()
+if not current then
+    return 0
+end
+if not etag_matches(current, 6) then
+    return -1
+end
+store(ARGV[2], tonumber(ARGV[3]), ARGV[4], ARGV[5])
+return 1
+"""
+
+# Delete an item. ARGV: field, then accepted ETags.
+# Returns {1, deleted JSON}, {0} if the item does not exist, {-1} if no ETag matched.
+BUCKET_DELETE_LUA = BUCKET_FIND_LUA + """
+local current, in_bucket = find()
+if not current then
+    return {0}
+end
+if not etag_matches(current, 2) then
+    return {-1}
+end
+if in_bucket then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+else
+    redis.call('DEL', KEYS[2])
+end
+return {1, current}
+"""
+
+# Finds the span of a top-level member of the stored JSON, so the value can be changed
+# in place without decoding and re-encoding the whole item (cjson would reorder members,
+# reformat numbers and turn empty arrays into objects). Items are JSON written by the
+# app, so member names are compared without unescaping.
+JSON_SCAN_LUA = """
+local function skip_ws(s, i)
+    return string.find(s, '[^ \\t\\r\\n]', i) or (#s + 1)
+end
+
+-- s[i] is the opening quote; returns the index after the closing one
+local function skip_string(s, i)
+    local j = i + 1
+    while true do
+        local k = string.find(s, '["\\\\]', j)
+        if not k then
+            return nil
+        end
+        if string.sub(s, k, k) == '"' then
+            return k + 1
+        end
+        j = k + 2
+    end
+end
+
+-- Returns the index after the value starting at s[i]
+local function skip_value(s, i)
+    local c = string.sub(s, i, i)
+    if c == '"' then
+        return skip_string(s, i)
+    end
+    if c == '{' or c == '[' then
+        local depth = 0
+        local j = i
+        while true do
+            local k = string.find(s, '["{}%[%]]', j)
+            if not k then
+                return nil
+            end
+            local ch = string.sub(s, k, k)
+            if ch == '"' then
+                j = skip_string(s, k)
+                if not j then
+                    return nil
+                end
+            else
+                depth = depth + ((ch == '{' or ch == '[') and 1 or -1)
+                j = k + 1
+                if depth == 0 then
+                    return j
+                end
+            end
+        end
+    end
+    return string.find(s, '[,}%] \\t\\r\\n]', i) or (#s + 1)
+end
+
+-- Returns the start of the member's name, and start and end (exclusive) of its value,
+-- for a member of the object starting at s[o], or nil
+local function find_in_object(s, o, name)
+    local i = skip_ws(s, o + 1)
+    while string.sub(s, i, i) == '"' do
+        local after = skip_string(s, i)
+        if not after then
+            return nil
+        end
+        local name_start = i
+        local member = string.sub(s, i + 1, after - 2)
+        i = skip_ws(s, skip_ws(s, after) + 1)
+        local stop = skip_value(s, i)
+        if not stop then
+            return nil
+        end
+        if member == name then
+            return name_start, i, stop
+        end
+        i = skip_ws(s, stop)
+        if string.sub(s, i, i) == ',' then
+            i = skip_ws(s, i + 1)
+        end
+    end
+    return nil
+end
+
+-- Start and end (exclusive) of a top-level member's value, or nil
+local function find_member(s, name)
+    local o = skip_ws(s, 1)
+    if string.sub(s, o, o) ~= '{' then
+        return nil
+    end
+    local _, start, stop = find_in_object(s, o, name)
+    return start, stop
+end
+
+local function count_elements(s, i, stop)
+    local count = 0
+    i = skip_ws(s, i + 1)
+    while i < stop - 1 do
+        count = count + 1
+        i = skip_ws(s, skip_value(s, i))
+        if string.sub(s, i, i) == ',' then
+            i = skip_ws(s, i + 1)
+        end
+    end
+    return count
+end
+
+-- Shortest text that reads back as the same double, keeping floats floats
+local function format_number(n, as_float)
+    local text
+    for precision = 15, 17 do
+        text = string.format('%.' .. precision .. 'g', n)
+        if tonumber(text) == n then
+            break
+        end
+    end
+    if as_float and not string.find(text, '[%.eE]') then
+        text = text .. '.0'
+    end
+    return text
+end
+"""
+
+# Read and rewrite an item in either layout. KEYS: string key, or bucket and string key;
+# ARGV[1] is the item's field in the bucket.
+ITEM_ACCESS_LUA = """
+local function locate()
+    if #KEYS == 2 then
+        local current = redis.call('HGET', KEYS[1], ARGV[1])
+        if current then
+            return current, true
+        end
+    end
+    return redis.call('GET', KEYS[#KEYS]), false
+end
+
+local function item_pttl(in_bucket, field_ttl)
+    if not in_bucket then
+        return redis.call('PTTL', KEYS[#KEYS])
+    end
+    if field_ttl == '1' then
+        return redis.call('HPTTL', KEYS[1], 'FIELDS', 1, ARGV[1])[1]
+    end
+    return -1
+end
+
+-- Write an item back where it was found, with pttl ms to live (-1 for none). An item
+-- leaves its bucket once it is larger than max_bytes, or gets a TTL the server cannot
+-- keep on a hash field.
+local function rewrite(data, in_bucket, pttl, max_bytes, field_ttl)
+    if in_bucket and (#data > tonumber(max_bytes) or (pttl > 0 and field_ttl ~= '1')) then
+        redis.call('HDEL', KEYS[1], ARGV[1])
+        in_bucket = false
+    end
+    if in_bucket then
+        redis.call('HSET', KEYS[1], ARGV[1], data)
+        if pttl > 0 then
+            redis.call('HPEXPIRE', KEYS[1], pttl, 'FIELDS', 1, ARGV[1])
+        elseif field_ttl == '1' then
+            redis.call('HPERSIST', KEYS[1], 'FIELDS', 1, ARGV[1])
+        end
+    else
+        redis.call('SET', KEYS[#KEYS], data)
+        if pttl > 0 then
+            redis.call('PEXPIRE', KEYS[#KEYS], pttl)
+        end
+    end
+end
+"""
+
+# Change an item's value in place: increment it, append to it or raise it to a minimum.
+# KEYS: string key, or bucket and string key. ARGV: field, op ('incr', 'append' or 'max'),
+# operand (JSON number, or the JSON elements to append without brackets), elements appended,
+# largest item kept in a bucket (bytes), field_ttl ('1' when the server has hash field expiry).
+# The item keeps its TTL. Returns {1, new value JSON, new ETag, array length (append) or
+# 1/0 whether the value changed (max)}, {0} if the item does not exist, {-1, reason} if
+# its value has the wrong type.
+MODIFY_VALUE_LUA = JSON_SCAN_LUA + ITEM_ACCESS_LUA + """
+local current, in_bucket = locate()
+if not current then
+    return {0}
+end
+
+local start, stop = find_member(current, 'value')
+if not start then
+    return {-1, 'no_value'}
+end
+local text = string.sub(current, start, stop - 1)
+local op = ARGV[2]
+local new_text, extra
+
+if op == 'append' then
+    if string.sub(text, 1, 1) ~= '[' then
+        return {-1, 'not_array'}
+    end
+    local length = count_elements(current, start, stop)
+    new_text = string.sub(text, 1, #text - 1) .. (length > 0 and ',' or '') .. ARGV[3] .. ']'
+    extra = length + tonumber(ARGV[4])
+else
+    local n = tonumber(text)
+    if not n or not string.find(text, '^-?%d') then
+        return {-1, 'not_number'}
+    end
+    local operand = tonumber(ARGV[3])
+    local integers = string.find(text, '^-?%d+$') and string.find(ARGV[3], '^-?%d+$')
+    if op == 'incr' then
+        local sum = n + operand
+        if sum ~= sum or sum == math.huge or sum == -math.huge
+                or (integers and math.abs(sum) > 9007199254740991) then
+            return {-1, 'overflow'}
+        end
+        new_text = integers and string.format('%d', sum) or format_number(sum, true)
+        extra = 1
+    elseif operand > n then
+        new_text = ARGV[3]
+        extra = 1
+    else
+        new_text = text
+        extra = 0
+    end
+end
+
+local data = string.sub(current, 1, start - 1) .. new_text .. string.sub(current, stop)
+if data ~= current then
+    rewrite(data, in_bucket, item_pttl(in_bucket, ARGV[6]), ARGV[5], ARGV[6])
+end
+return {1, new_text, redis.sha1hex(data), extra}
+"""
+
+# Edits of members of the stored JSON, for merge patches; names are JSON-escaped already.
+JSON_EDIT_LUA = """
+local function insert_member(s, o, name, value)
+    local close = skip_value(s, o) - 1
+    local separator = skip_ws(s, o + 1) == close and '' or ','
+    return string.sub(s, 1, close - 1) .. separator .. '"' .. name .. '":' .. value .. string.sub(s, close)
+end
+
+local function set_member(s, o, name, value)
+    local _, start, stop = find_in_object(s, o, name)
+    if not start then
+        return insert_member(s, o, name, value)
+    end
+    return string.sub(s, 1, start - 1) .. value .. string.sub(s, stop)
+end
+
+local function remove_member(s, o, name)
+    local name_start, _, stop = find_in_object(s, o, name)
+    if not name_start then
+        return s
+    end
+    local after = skip_ws(s, stop)
+    if string.sub(s, after, after) == ',' then
+        return string.sub(s, 1, name_start - 1) .. string.sub(s, skip_ws(s, after + 1))
+    end
+    -- The last member: drop the comma before it instead
+    local before = name_start - 1
+    while string.find(string.sub(s, before, before), '[ \\t\\r\\n]') do
+        before = before - 1
+    end
+    if string.sub(s, before, before) == ',' then
+        name_start = before
+    end
+    return string.sub(s, 1, name_start - 1) .. string.sub(s, stop)
+end
+
+-- Follow path from the object at s[o], making each member an object (as a merge patch
+-- does); returns the new text and the start of the innermost object
+local function walk(s, o, path)
+    for _, name in ipairs(path) do
+        local _, start, stop = find_in_object(s, o, name)
+        if not start then
+            s = insert_member(s, o, name, '{}')
+            _, start = find_in_object(s, o, name)
+        elseif string.sub(s, start, start) ~= '{' then
+            s = string.sub(s, 1, start - 1) .. '{}' .. string.sub(s, stop)
+        end
+        o = start
+    end
+    return s, o
+end
+"""
+
+# Apply a JSON merge patch to an item and/or change its TTL, without touching its value.
+# KEYS: string key, or bucket and string key. ARGV: field, largest item kept in a bucket
+# (bytes), field_ttl, accepted ETags (comma-separated, '' = any), new TTL in seconds ('' to
+# keep it, '0' to remove it), then edits: 'set', depth, path..., JSON value | 'delete', depth,
+# path... | 'object', depth, path... (make the member an object). Paths start at the item's
+# top-level members. Returns {1, new ETag, previous pttl}, {0} if the item does not exist,
+# {-1} if no ETag matched, {-2} if the stored item is not an object.
+PATCH_ITEM_LUA = JSON_SCAN_LUA + JSON_EDIT_LUA + ITEM_ACCESS_LUA + """
+local current, in_bucket = locate()
+if not current then
+    return {0}
+end
+if ARGV[4] ~= '' then
+    local etag = redis.sha1hex(current)
+    local matched = false
+    for accepted in string.gmatch(ARGV[4], '[^,]+') do
+        if accepted == etag then
+            matched = true
+            break
+        end
+    end
+    if not matched then
+        return {-1}
+    end
+end
+local root = skip_ws(current, 1)
+if string.sub(current, root, root) ~= '{' then
+    return {-2}
+end
+
+local data = current
+local i = 6
+while i <= #ARGV do
+    local edit, depth = ARGV[i], tonumber(ARGV[i + 1])
+    local path = {}
+    for d = 1, depth - 1 do
+        path[d] = ARGV[i + 1 + d]
+    end
+    local name = ARGV[i + 1 + depth]
+    i = i + 2 + depth
+    local o
+    data, o = walk(data, root, path)
+    if edit == 'set' then
+        data = set_member(data, o, name, ARGV[i])
+        i = i + 1
+    elseif edit == 'delete' then
+        data = remove_member(data, o, name)
+    else
+        data = walk(data, o, {name})
+    end
+end
+
+local pttl = item_pttl(in_bucket, ARGV[3])
+local new_pttl = pttl
+if ARGV[5] == '0' then
+    new_pttl = -1
+elseif ARGV[5] ~= '' then
+    new_pttl = tonumber(ARGV[5]) * 1000
+end
+if data ~= current or new_pttl ~= pttl then
+    rewrite(data, in_bucket, new_pttl, ARGV[2], ARGV[3])
+end
+return {1, redis.sha1hex(data), pttl}
+"""
+
+LAYOUTS = ("strings", "buckets")
+VALUE_OPS = ("incr", "append", "max")
+
+_scripts = {}
+
+
+class ItemNotFoundError(Exception):
+    """Raised when the item to update or delete does not exist"""
+
+
+class PreconditionFailedError(Exception):
+    """Raised when an If-Match precondition does not hold"""
+
+
+class InvalidItemError(Exception):
+    """Raised when a stored item is not a JSON object, so it cannot be patched"""
+
+
+class ValueTypeError(Exception):
+    """Raised when an item's value does not support the operation (e.g. incrementing a string)"""
+
+    def __init__(self, key: str, reason: str):
+        super().__init__(f"{key}: {reason}")
+        self.reason = reason
+
+
+def _get_script(lua: str):
+    script = _scripts.get(lua)
+    if script is None:
+        script = _scripts[lua] = get_main_redis().register_script(lua)
+    return script
+
+
+def _check_replaced(result: int, tenant_id: str, key: str):
+    if result == 0:
+        raise ItemNotFoundError(get_namespaced_key(tenant_id, key))
+    if result == -1:
+        raise PreconditionFailedError(get_namespaced_key(tenant_id, key))
+
+
+def _check_removed(result: list, tenant_id: str, key: str) -> str:
+    _check_replaced(result[0], tenant_id, key)
+    return result[1]
+
+
+def _patch(keys: List[str], key: str, edits: list, ttl: Optional[int], if_match: Optional[List[str]],
+           max_value_bytes: int, field_ttl: bool) -> Tuple[str, int]:
+    result = _get_script(PATCH_ITEM_LUA)(
+        keys=keys,
+        args=[key, max_value_bytes, int(field_ttl), ",".join(if_match or []), "" if ttl is None else ttl] + edits,
+        client=get_main_redis(),
+    )
+    if result[0] == 0:
+        raise ItemNotFoundError(keys[-1])
+    if result[0] == -1:
+        raise PreconditionFailedError(keys[-1])
+    if result[0] == -2:
+        raise InvalidItemError(keys[-1])
+    return result[1], result[2]
+
+
+def _modify_value(keys: List[str], key: str, op: str, operand: str, count: int, max_value_bytes: int,
+                  field_ttl: bool) -> Tuple[str, str, int]:
+    result = _get_script(MODIFY_VALUE_LUA)(
+        keys=keys,
+        args=[key, op, operand, count, max_value_bytes, int(field_ttl)],
+        client=get_main_redis(),
+    )
+    if result[0] == 0:
+        raise ItemNotFoundError(keys[-1])
+    if result[0] == -1:
+        raise ValueTypeError(keys[-1], result[1])
+    return result[1], result[2], result[3]
+
+
+class StringLayout:
+    """One string key per item"""
+
+    def create(self, tenant_id: str, key: str, data: str, ttl: Optional[int]) -> bool:
+        return bool(get_main_redis().set(get_namespaced_key(tenant_id, key), data, ex=ttl or None, nx=True))
+
+    def get(self, tenant_id: str, key: str) -> Optional[Tuple[dict, str, str]]:
+        namespaced_key = get_namespaced_key(tenant_id, key)
+
+        def read():
+            pipe = get_main_redis().pipeline(transaction=False)
+            pipe.get(namespaced_key)
+            pipe.pttl(namespaced_key)
+            return tuple(pipe.execute())
+
+        return get_item_cached(tenant_id, namespaced_key, read)
+
+    def replace(self, tenant_id: str, key: str, data: str, ttl: Optional[int], if_match: Optional[List[str]]):
+        result = _get_script(REPLACE_ITEM_LUA)(
+            keys=[get_namespaced_key(tenant_id, key)],
+            args=[data, ttl or 0] + (if_match or []),
+            client=get_main_redis(),
+        )
+        _check_replaced(result, tenant_id, key)
+
+    def remove(self, tenant_id: str, key: str, if_match: Optional[List[str]]) -> str:
+        result = _get_script(DELETE_ITEM_LUA)(
+            keys=[get_namespaced_key(tenant_id, key)],
+            args=if_match or [],
+            client=get_main_redis(),
+        )
+        return _check_removed(result, tenant_id, key)
+
+    def iter_pages(self, tenant_id: str, page_size: int) -> Iterator[List[Tuple[str, str, int]]]:
+        client = get_main_redis()
+        prefix = get_namespaced_key(tenant_id, "")
+        page = []
+        for namespaced_key in client.scan_iter(match=escape_glob(prefix) + "*", count=page_size):
+            page.append(namespaced_key)
+            if len(page) >= page_size:
+                yield _read_string_items(client, page, len(prefix))
+                page = []
+        if page:
+            yield _read_string_items(client, page, len(prefix))
+
+    def add_write(self, pipe, tenant_id: str, key: str, data: str, pttl: Optional[int]):
+        pipe.set(get_namespaced_key(tenant_id, key), data, px=pttl)
+
+    def pttl(self, tenant_id: str, key: str) -> int:
+        return get_main_redis().pttl(get_namespaced_key(tenant_id, key))
+
+    def modify_value(self, tenant_id: str, key: str, op: str, operand: str, count: int) -> Tuple[str, str, int]:
+        return _modify_value([get_namespaced_key(tenant_id, key)], key, op, operand, count, 0, False)
+
+    def patch(self, tenant_id: str, key: str, edits: list, ttl: Optional[int],
+              if_match: Optional[List[str]]) -> Tuple[str, int]:
+        return _patch([get_namespaced_key(tenant_id, key)], key, edits, ttl, if_match, 0, False)
+
+
+class BucketLayout:
+    """Small items as fields of per-tenant hash buckets, the rest as string keys"""
+
+    def __init__(self, buckets: int, max_value_bytes: int):
+        self.buckets = buckets
+        self.max_value_bytes = max_value_bytes
+        self._field_ttl = None
+
+    def bucket_key(self, tenant_id: str, key: str) -> str:
+        return f"{get_tenant_prefix(tenant_id)}:bucket:{zlib.crc32(key.encode()) % self.buckets}"
+
+    def field_ttl_supported(self) -> bool:
+        """Whether the server has hash field expiry (Redis 7.4+); checked once per process"""
+        if self._field_ttl is None:
+            try:
+                get_main_redis().execute_command("HPTTL", get_tenant_prefix("_probe"), "FIELDS", 1, "_")
+                self._field_ttl = True
+            except redis.exceptions.ResponseError:
+                print("Redis has no hash field expiry (7.4+); items with a TTL are stored as string keys")
+                self._field_ttl = False
+        return self._field_ttl
+
+    def _in_bucket(self, data: str, ttl) -> bool:
+        return len(data) <= self.max_value_bytes and (not ttl or self.field_ttl_supported())
+
+    def _keys(self, tenant_id: str, key: str) -> List[str]:
+        return [self.bucket_key(tenant_id, key), get_namespaced_key(tenant_id, key)]
+
+    def create(self, tenant_id: str, key: str, data: str, ttl: Optional[int]) -> bool:
+        result = _get_script(BUCKET_CREATE_LUA)(
+            keys=self._keys(tenant_id, key),
+            args=[key, data, ttl or 0, int(self._in_bucket(data, ttl)), int(self.field_ttl_supported())],
+            client=get_main_redis(),
+        )
+        return result == 1
+
+    def get(self, tenant_id: str, key: str) -> Optional[Tuple[dict, str, str]]:
+        bucket_key, namespaced_key = self._keys(tenant_id, key)
+        field_ttl = self.field_ttl_supported()
+
+        def read():
+            pipe = get_main_redis().pipeline(transaction=False)
+            pipe.hget(bucket_key, key)
+            if field_ttl:
+                pipe.execute_command("HPTTL", bucket_key, "FIELDS", 1, key)
+            pipe.get(namespaced_key)
+            pipe.pttl(namespaced_key)
+            results = pipe.execute()
+            if results[0] is not None:
+                return results[0], results[1][0] if field_ttl else -1
+            return results[-2], results[-1]
+
+        # Cached under the item's own name, dropped on a write to either place
+        return get_item_cached(tenant_id, namespaced_key, read, watch=[namespaced_key, bucket_key])
+
+    def replace(self, tenant_id: str, key: str, data: str, ttl: Optional[int], if_match: Optional[List[str]]):
+        result = _get_script(BUCKET_REPLACE_LUA)(
+            keys=self._keys(tenant_id, key),
+            args=[key, data, ttl or 0, int(self._in_bucket(data, ttl)), int(self.field_ttl_supported())]
+                 + (if_match or []),
+            client=get_main_redis(),
+        )
+        _check_replaced(result, tenant_id, key)
+
+    def remove(self, tenant_id: str, key: str, if_match: Optional[List[str]]) -> str:
+        result = _get_script(BUCKET_DELETE_LUA)(
+            keys=self._keys(tenant_id, key),
+            args=[key] + (if_match or []),
+            client=get_main_redis(),
+        )
+        return _check_removed(result, tenant_id, key)
+
+    def iter_pages(self, tenant_id: str, page_size: int) -> Iterator[List[Tuple[str, str, int]]]:
+        # Items kept as string keys, then the buckets, a few buckets per round trip
+        yield from StringLayout().iter_pages(tenant_id, page_size)
+
+        client = get_main_redis()
+        field_ttl = self.field_ttl_supported()
+        pattern = escape_glob(f"{get_tenant_prefix(tenant_id)}:bucket:") + "*"
+        buckets = []
+        for bucket_key in client.scan_iter(match=pattern, count=page_size):
+            buckets.append(bucket_key)
+            # Buckets hold around a hundred items each
+            if len(buckets) * 100 >= page_size:
+                yield _read_bucket_items(client, buckets, field_ttl)
+                buckets = []
+        if buckets:
+            yield _read_bucket_items(client, buckets, field_ttl)
+
+    def add_write(self, pipe, tenant_id: str, key: str, data: str, pttl: Optional[int]):
+        bucket_key, namespaced_key = self._keys(tenant_id, key)
+        if self._in_bucket(data, pttl):
+            pipe.delete(namespaced_key)
+            pipe.hset(bucket_key, key, data)
+            if pttl:
+                pipe.execute_command("HPEXPIRE", bucket_key, pttl, "FIELDS", 1, key)
+            elif self.field_ttl_supported():
+                pipe.execute_command("HPERSIST", bucket_key, "FIELDS", 1, key)
+        else:
+            pipe.hdel(bucket_key, key)
+            pipe.set(namespaced_key, data, px=pttl)
+
+    def pttl(self, tenant_id: str, key: str) -> int:
+        bucket_key, namespaced_key = self._keys(tenant_id, key)
+        field_ttl = self.field_ttl_supported()
+        pipe = get_main_redis().pipeline(transaction=False)
+        pipe.hexists(bucket_key, key)
+        if field_ttl:
+            pipe.execute_command("HPTTL", bucket_key, "FIELDS", 1, key)
+        pipe.pttl(namespaced_key)
+        results = pipe.execute()
+        if results[0]:
+            return results[1][0] if field_ttl else -1
+        return results[-1]
+
+    def modify_value(self, tenant_id: str, key: str, op: str, operand: str, count: int) -> Tuple[str, str, int]:
+        return _modify_value(self._keys(tenant_id, key), key, op, operand, count, self.max_value_bytes,
+                             self.field_ttl_supported())
+
+    def patch(self, tenant_id: str, key: str, edits: list, ttl: Optional[int],
+              if_match: Optional[List[str]]) -> Tuple[str, int]:
+        return _patch(self._keys(tenant_id, key), key, edits, ttl, if_match, self.max_value_bytes,
+                      self.field_ttl_supported())
+
+
+def _read_string_items(client, namespaced_keys: list, prefix_length: int) -> List[Tuple[str, str, int]]:
+    """(key, JSON, pttl) of string-stored items, in one pipelined MGET + PTTL round trip"""
+    pipe = client.pipeline(transaction=False)
+    pipe.mget(namespaced_keys)
+    for namespaced_key in namespaced_keys:
+        pipe.pttl(namespaced_key)
+    results = pipe.execute()
+    items = []
+    for namespaced_key, data, pttl in zip(namespaced_keys, results[0], results[1:]):
+        # Skip keys deleted or expired since they were scanned
+        if data is not None and pttl != -2:
+            items.append((namespaced_key[prefix_length:], data, pttl))
+    return items
+
+
+def _read_bucket_items(client, bucket_keys: list, field_ttl: bool) -> List[Tuple[str, str, int]]:
+    """(key, JSON, pttl) of every item in the given buckets"""
+    pipe = client.pipeline(transaction=False)
+    for bucket_key in bucket_keys:
+        pipe.hgetall(bucket_key)
+    buckets = pipe.execute()
+    if not field_ttl:
+        return [(key, data, -1) for fields in buckets for key, data in fields.items()]
+
+    pipe = client.pipeline(transaction=False)
+    for bucket_key, fields in zip(bucket_keys, buckets):
+        if fields:
+            pipe.execute_command("HPTTL", bucket_key, "FIELDS", len(fields), *fields)
+    ttls = iter(pipe.execute())
+    items = []
+    for fields in buckets:
+        if not fields:
+            continue
+        for (key, data), pttl in zip(fields.items(), next(ttls)):
+            # A field that expired between the two round trips reports -2
+            if pttl != -2:
+                items.append((key, data, pttl))
+    return items
+
+
+if ITEM_STORAGE_LAYOUT not in LAYOUTS:
+    raise ValueError(f"ITEM_STORAGE_LAYOUT must be one of {', '.join(LAYOUTS)}")
+
+_layout = BucketLayout(ITEM_BUCKETS, ITEM_BUCKET_MAX_VALUE_BYTES) if ITEM_STORAGE_LAYOUT == "buckets" else StringLayout()
+
+
+def insert_item(tenant_id: str, key: str, data: str, ttl: Optional[int] = None) -> bool:
+    """Store a new item; False if the key already exists"""
+    return _layout.create(tenant_id, key, data, ttl)
+
+
+def read_item(tenant_id: str, key: str) -> Optional[Tuple[dict, str, str]]:
+    """(parsed item, etag, stored JSON), through the L1 cache when enabled, or None if the key does not exist"""
+    return _layout.get(tenant_id, key)
+
+
+def item_pttl(tenant_id: str, key: str) -> int:
+    """The item's remaining TTL in ms, read from Redis: -1 if it has none, -2 if it does not exist"""
+    return _layout.pttl(tenant_id, key)
+
+
+def replace_item(tenant_id: str, key: str, data: str, ttl: Optional[int] = None,
+                 if_match: Optional[List[str]] = None):
+    """Atomically replace an existing item; if_match lists the ETags it may currently have"""
+    _layout.replace(tenant_id, key, data, ttl, if_match)
+
+
+def remove_item(tenant_id: str, key: str, if_match: Optional[List[str]] = None) -> str:
+    """Atomically delete an item and return the JSON it held"""
+    return _layout.remove(tenant_id, key, if_match)
+
+
+def merge_patch_edits(patch: dict, path: Tuple[str, ...] = ()) -> list:
+    """
+    The edits PATCH_ITEM_LUA makes for a JSON merge patch (RFC 7396) applied at path.
+
+    Objects in the patch are merged member by member, null removes a member and any
+    other value replaces it. Member names and values are JSON-encoded here.
+    """
+    edits = []
+    for name, value in patch.items():
+        member = path + (json.dumps(name, ensure_ascii=False)[1:-1],)
+        if isinstance(value, dict) and value:
+            edits += merge_patch_edits(value, member)
+        elif isinstance(value, dict):
+            edits += ["object", len(member), *member]
+        elif value is None:
+            edits += ["delete", len(member), *member]
+        else:
+            edits += ["set", len(member), *member, json.dumps(value, ensure_ascii=False, separators=(",", ":"))]
+    return edits
+
+
+def patch_item(tenant_id: str, key: str, edits: list, ttl: Optional[int] = None,
+               if_match: Optional[List[str]] = None) -> Tuple[str, int]:
+    """
+    Atomically edit an item's JSON (see merge_patch_edits) and/or set its TTL, without
+    reading or rewriting its value outside Redis.
+
+    ttl is None to keep the TTL, 0 to remove it, or seconds. Returns (new ETag, pttl in ms
+    before the patch, -1 for none).
+    """
+    return _layout.patch(tenant_id, key, edits, ttl, if_match)
+
+
+def modify_item_value(tenant_id: str, key: str, op: str, operand: str, count: int = 1) -> Tuple[str, str, int]:
+    """
+    Atomically change an item's value in place, keeping its TTL and the rest of the item.
+
+    op is "incr" (add the JSON number operand), "max" (set the value to the operand if
+    that is greater) or "append" (operand holds count JSON array elements, comma-separated).
+    Returns (new value as JSON, new ETag, array length for append or whether max changed
+    the value). Raises ItemNotFoundError, or ValueTypeError if the value is not a number
+    (incr, max) or an array (append).
+    """
+    if op not in VALUE_OPS:
+        raise ValueError(f"Unknown value operation {op}")
+    return _layout.modify_value(tenant_id, key, op, operand, count)
+
+
+def iter_item_pages(tenant_id: str, page_size: int) -> Iterator[List[Tuple[str, str, int]]]:
+    """All of a tenant's items as pages of (key, JSON, pttl), pttl -1 for no TTL"""
+    return _layout.iter_pages(tenant_id, page_size)
+
+
+def add_item_write(pipe, tenant_id: str, key: str, data: str, pttl: Optional[int] = None):
+    """Queue an unconditional write of an item, with a TTL in ms, on a pipeline"""
+    _layout.add_write(pipe, tenant_id, key, data, pttl)
+
+
+def parse_etags(header: Optional[str], weak: bool = True) -> Optional[List[str]]:
+    """
+    Parse an If-Match / If-None-Match header into bare ETags.
+
+    Returns None when the header is absent or "*" (any current value matches).
+    With weak=True (If-None-Match) weak validators are compared by their opaque
+    value. If-Match uses the strong comparison, which no weak validator passes,
+    so weak=False leaves them out; the list may then be empty.
+    """
+    if header is None or header.strip() == "*":
+        return None
+    etags = []
+    for tag in header.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            if not weak:
+                continue
+            tag = tag[2:]
+        etags.append(tag.strip('"'))
+    return etags
+
+
+def etag_header(etag: str) -> str:
+    return f'"{etag}"'
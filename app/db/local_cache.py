@@ -0,0 +1,299 @@
+"""
+Optional in-process L1 cache for GET /data/{key}, kept coherent with Redis 6
+server-assisted client-side caching.
+
+A background thread per Redis master holds a RESP3 connection with
+`CLIENT TRACKING ON BCAST PREFIX tenant:`. Redis pushes an `invalidate` message
+on that connection whenever any client (any pod) writes, deletes or expires a key
+under the prefix, and the cached entry is dropped immediately.
+
+Entries are only served while tracking is connected: when a listener drops, the
+whole cache is cleared and bypassed until the listener has reconnected.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+
+import orjson
+import redis
+from redis._parsers import _RESP3Parser
+
+from app.core.config import (
+    REDIS_CLUSTER_NODES,
+    LOCAL_CACHE_ENABLED,
+    LOCAL_CACHE_MAX_BYTES,
+    LOCAL_CACHE_MAX_VALUE_BYTES,
+    LOCAL_CACHE_MAX_AGE_SECONDS,
+)
+from app.core.metrics import LOCAL_CACHE_REQUESTS, LOCAL_CACHE_BYTES, LOCAL_CACHE_ENTRIES, LOCAL_CACHE_INVALIDATIONS
+from app.db.redis_utils import create_redis_client
+
+TRACKING_PREFIX = "tenant:"
+# Rough per-entry overhead of the key, tuple and OrderedDict node
+ENTRY_OVERHEAD_BYTES = 200
+# How often an idle listener checks that its node is still a master
+ROLE_CHECK_SECONDS = 5
+
+
+class _Push(list):
+    """Marks RESP3 push messages so they can be told apart from command replies"""
+
+
+class LocalCache:
+    """Memory-bounded LRU of (parsed item, etag) pairs with per-entry expiry"""
+
+    def __init__(self, max_bytes: int, max_value_bytes: int, max_age: float):
+        self.max_bytes = max_bytes
+        self.max_value_bytes = max_value_bytes
+        self.max_age = max_age
+        self._entries = OrderedDict()  # key -> (item, expires_at, size, watched Redis keys)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Redis keys with a read in flight -> [readers, invalidated meanwhile]
+        self._pending = {}
+        # Redis key -> cached keys stored inside it (items kept in hash buckets)
+        self._groups = {}
+        self._listeners = {}
+        self._connected = set()
+        self._pid = None
+
+    def is_tracking(self) -> bool:
+        return bool(self._listeners) and self._connected == set(self._listeners)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            item, expires_at, _, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return item
+
+    def begin_fill(self, watch: List[str]):
+        """Register a read of the Redis keys in watch so an invalidation racing with it is noticed"""
+        with self._lock:
+            for redis_key in watch:
+                pending = self._pending.setdefault(redis_key, [0, False])
+                pending[0] += 1
+
+    def finish_fill(self, key: str, watch: List[str], item: Any, size: int, pttl: int):
+        """Cache an item read from Redis, unless a watched key was invalidated while the read was in flight"""
+        with self._lock:
+            stale = False
+            for redis_key in watch:
+                pending = self._pending[redis_key]
+                pending[0] -= 1
+                stale = stale or pending[1]
+                if pending[0] == 0:
+                    del self._pending[redis_key]
+            if item is None or stale or pttl == -2 or size > self.max_value_bytes or not self.is_tracking():
+                return
+            ttl = self.max_age if pttl < 0 else min(self.max_age, pttl / 1000)
+            size += ENTRY_OVERHEAD_BYTES
+            self._remove(key)
+            self._entries[key] = (item, time.monotonic() + ttl, size, watch)
+            for redis_key in watch:
+                if redis_key != key:
+                    self._groups.setdefault(redis_key, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                self._remove(next(iter(self._entries)))
+            self._update_gauges()
+
+    def invalidate(self, key: str):
+        with self._lock:
+            if key in self._pending:
+                self._pending[key][1] = True
+            self._remove(key)
+            for member in list(self._groups.get(key, ())):
+                self._remove(member)
+            self._update_gauges()
+
+    def clear(self):
+        with self._lock:
+            for pending in self._pending.values():
+                pending[1] = True
+            self._entries.clear()
+            self._groups.clear()
+            self._bytes = 0
+            self._update_gauges()
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[2]
+        for redis_key in entry[3]:
+            members = self._groups.get(redis_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._groups[redis_key]
+
+    def _update_gauges(self):
+        LOCAL_CACHE_BYTES.set(self._bytes)
+        LOCAL_CACHE_ENTRIES.set(len(self._entries))
+
+    # Invalidation listeners
+
+    def ensure_listeners(self):
+        """Start one tracking listener per Redis master (again after a fork)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            try:
+                nodes = _tracking_nodes()
+            except (redis.exceptions.RedisError, OSError) as e:
+                # The cache stays bypassed until tracking can be set up
+                print(f"L1 cache could not resolve Redis masters: {str(e)}")
+                return
+            self._pid = os.getpid()
+            self._listeners = {}
+            self._connected = set()
+            for node in nodes:
+                self._start_listener(node)
+
+    def _start_listener(self, node):
+        # Called with self._lock held
+        thread = threading.Thread(target=self._listen, args=node, name=f"l1-cache-{node[0]}:{node[1]}", daemon=True)
+        self._listeners[node] = thread
+        thread.start()
+
+    def _listen(self, host: str, port: int):
+        node = (host, port)
+        while True:
+            connection = redis.Connection(
+                host=host,
+                port=port,
+                protocol=3,
+                parser_class=_RESP3Parser,
+                decode_responses=True,
+                socket_timeout=ROLE_CHECK_SECONDS * 2,
+            )
+            connection._parser.set_invalidation_push_handler(_Push)
+            try:
+                connection.send_command("CLIENT", "TRACKING", "ON", "BCAST", "PREFIX", TRACKING_PREFIX)
+                self._read_reply(connection)
+                # Anything cached before tracking was (re)established may be stale
+                self.clear()
+                self._connected.add(node)
+                print(f"L1 cache tracking invalidations from {host}:{port}")
+
+                while True:
+                    if connection.can_read(timeout=ROLE_CHECK_SECONDS):
+                        self._handle_push(connection.read_response(push_request=True))
+                        continue
+                    # After a failover the old master stops seeing writes, so leave it
+                    connection.send_command("ROLE")
+                    if self._read_reply(connection)[0] != "master":
+                        print(f"L1 cache: {host}:{port} is no longer a master, re-resolving")
+                        break
+            except (redis.exceptions.RedisError, OSError) as e:
+                print(f"L1 cache invalidation listener for {host}:{port} failed: {str(e)}")
+            finally:
+                self._connected.discard(node)
+                self.clear()
+                connection.disconnect()
+
+            time.sleep(1)
+            # Pick up the current master(s) before reconnecting
+            try:
+                nodes = _tracking_nodes()
+            except (redis.exceptions.RedisError, OSError) as e:
+                print(f"L1 cache could not resolve Redis masters: {str(e)}")
+                continue
+            if node not in nodes:
+                with self._lock:
+                    self._listeners.pop(node, None)
+                    for new_node in nodes:
+                        if new_node not in self._listeners:
+                            self._start_listener(new_node)
+                return
+
+    def _read_reply(self, connection):
+        """Read the next command reply, applying any push messages that arrive first"""
+        while True:
+            response = connection.read_response(push_request=True)
+            if isinstance(response, _Push):
+                self._handle_push(response)
+                continue
+            return response
+
+    def _handle_push(self, message):
+        if not isinstance(message, _Push) or not message or message[0] != "invalidate":
+            return
+        keys = message[1]
+        if keys is None:
+            # FLUSHDB/FLUSHALL invalidate everything
+            self.clear()
+            LOCAL_CACHE_INVALIDATIONS.inc()
+            return
+        for key in keys:
+            self.invalidate(key)
+        LOCAL_CACHE_INVALIDATIONS.inc(len(keys))
+
+
+def _tracking_nodes():
+    """(host, port) of every master that receives writes for tenant keys"""
+    client = create_redis_client(db=0)
+    if REDIS_CLUSTER_NODES:
+        return [(node.host, node.port) for node in client.get_primaries()]
+    kwargs = client.connection_pool.connection_kwargs
+    return [(kwargs["host"], kwargs["port"])]
+
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_MAX_VALUE_BYTES, LOCAL_CACHE_MAX_AGE_SECONDS)
+
+
+def item_etag(data: str) -> str:
+    """ETag of a stored item: the SHA-1 of its stored JSON, as Lua's redis.sha1hex computes it"""
+    return hashlib.sha1(data.encode()).hexdigest()
+
+
+def get_item_cached(tenant_id: str, namespaced_key: str, read: Callable[[], Tuple[Optional[str], int]],
+                    watch: Optional[List[str]] = None) -> Optional[Tuple[dict, str, str]]:
+    """
+    Return (parsed item, etag, stored JSON) for the item namespaced_key, from the L1 cache when
+    enabled, or None if the item does not exist.
+
+    read() returns the stored JSON (None if missing) and its remaining TTL in ms,
+    read in one round trip so the cached copy never outlives the item. watch lists
+    the Redis keys the item may be stored in (default: namespaced_key itself); a
+    write to any of them drops the cached copy.
+    """
+    if not LOCAL_CACHE_ENABLED:
+        data, _ = read()
+        return (orjson.loads(data), item_etag(data), data) if data else None
+
+    local_cache.ensure_listeners()
+    entry = local_cache.get(namespaced_key)
+    if entry is not None:
+        LOCAL_CACHE_REQUESTS.labels(tenant_id=tenant_id, result="hit").inc()
+        return entry
+    LOCAL_CACHE_REQUESTS.labels(tenant_id=tenant_id, result="miss").inc()
+
+    watch = watch or [namespaced_key]
+    local_cache.begin_fill(watch)
+    data, pttl, entry = None, -2, None
+    try:
+        data, pttl = read()
+        if data:
+            entry = (orjson.loads(data), item_etag(data), data)
+    finally:
+        # The parsed item and the stored JSON (served as is) are both kept
+        local_cache.finish_fill(namespaced_key, watch, entry, 2 * len(data) if data else 0, pttl)
+    return entry
+
+
+def invalidate_item(namespaced_key: str):
+    """Drop a key this pod just wrote, without waiting for the server's push"""
+    if LOCAL_CACHE_ENABLED:
+        local_cache.invalidate(namespaced_key)
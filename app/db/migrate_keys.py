@@ -0,0 +1,148 @@
+"""
+Re-key existing data into the hash-tagged layout used for Redis Cluster.
+
+Tenant data written before hash tags were introduced lives under
+`tenant:<tenant_id>:data:<key>`; it is copied to `tenant:{<tenant_id>}:data:<key>`
+with its remaining TTL preserved. The shared blobs (`fake_*_db`) and the audit
+log queue (`logs:audit` in db 1 -> `logs:{audit}`) are copied as well, so the
+same tool moves a master-replica deployment onto a cluster.
+
+Usage:
+    python -m app.db.migrate_keys --source redis://redis-service:6379 --dry-run
+    python -m app.db.migrate_keys --source redis://redis-service:6379 --delete-source
+    python -m app.db.migrate_keys --source redis://old-master:6379 \\
+        --target-cluster redis-cluster-0:6379,redis-cluster-1:6379
+"""
+import argparse
+import re
+
+import redis
+from redis.cluster import RedisCluster, ClusterNode
+
+from app.core.config import AUDIT_LOG_KEY
+from app.db.redis import get_namespaced_key
+
+LEGACY_DATA_KEY = re.compile(r"^tenant:([^:{}]+):data:(.*)$", re.DOTALL)
+LEGACY_AUDIT_LOG_KEY = "logs:audit"
+SHARED_KEYS = ["fake_tenants_db", "fake_users_db", "fake_api_keys_db"]
+
+
+def connect_source(url: str, db: int):
+    return redis.Redis.from_url(url, db=db, decode_responses=False)
+
+
+def connect_target(args, db: int):
+    if args.target_cluster:
+        nodes = []
+        for node in args.target_cluster.split(","):
+            host, _, port = node.strip().rpartition(":")
+            nodes.append(ClusterNode(host, int(port)))
+        return RedisCluster(startup_nodes=nodes, decode_responses=False)
+    return redis.Redis.from_url(args.target or args.source, db=db, decode_responses=False)
+
+
+def copy_keys(source, target, pairs, dry_run: bool, delete_source: bool):
+    """
+    Copy (old_key, new_key) pairs with DUMP/RESTORE so any value type and its
+    remaining TTL carry over. Keys that expire between DUMP and RESTORE are skipped.
+    """
+    if not pairs:
+        return 0
+
+    read = source.pipeline(transaction=False)
+    for old_key, _ in pairs:
+        read.dump(old_key)
+        read.pttl(old_key)
+    dumped = read.execute()
+
+    copied = 0
+    write = target.pipeline(transaction=False)
+    moved = []
+    for (old_key, new_key), payload, pttl in zip(pairs, dumped[0::2], dumped[1::2]):
+        if payload is None or pttl == -2:
+            continue
+        if dry_run:
+            print(f"Would copy {old_key!r} -> {new_key!r} (ttl_ms={pttl})")
+        else:
+            write.restore(new_key, max(pttl, 0), payload, replace=True)
+            moved.append(old_key)
+        copied += 1
+
+    if not dry_run and moved:
+        write.execute()
+        if delete_source:
+            source.delete(*moved)
+    return copied
+
+
+def migrate_data(args):
+    source = connect_source(args.source, db=0)
+    target = connect_target(args, db=0)
+
+    pairs = []
+    total = 0
+    for raw_key in source.scan_iter(match="tenant:*:data:*", count=args.batch_size):
+        match = LEGACY_DATA_KEY.match(raw_key.decode())
+        if not match:
+            # Already hash-tagged
+            continue
+        tenant_id, key = match.groups()
+        pairs.append((raw_key, get_namespaced_key(tenant_id, key)))
+        if len(pairs) >= args.batch_size:
+            total += copy_keys(source, target, pairs, args.dry_run, args.delete_source)
+            pairs = []
+    total += copy_keys(source, target, pairs, args.dry_run, args.delete_source)
+    print(f"{'Found' if args.dry_run else 'Migrated'} {total} tenant data keys")
+
+    if args.target_cluster or args.target:
+        # Shared blobs keep their names but need to exist on the new deployment
+        shared = [(key, key) for key in SHARED_KEYS if source.exists(key)]
+        count = copy_keys(source, target, shared, args.dry_run, delete_source=False)
+        print(f"{'Found' if args.dry_run else 'Copied'} {count} shared keys")
+
+
+def migrate_audit_queue(args):
+    source = connect_source(args.source, db=1)
+    # In cluster mode the queue shares db 0 with the data; standalone keeps it in db 1
+    target = connect_target(args, db=1)
+
+    if not source.exists(LEGACY_AUDIT_LOG_KEY):
+        print("No legacy audit log queue found")
+        return
+
+    length = source.llen(LEGACY_AUDIT_LOG_KEY)
+    if args.dry_run:
+        print(f"Would move {length} audit entries {LEGACY_AUDIT_LOG_KEY!r} -> {AUDIT_LOG_KEY!r}")
+        return
+
+    # Legacy entries are older than anything already in the new queue, so they are
+    # appended on the RPOP side, newest first, to keep the queue's ordering
+    moved = 0
+    while True:
+        batch = source.lrange(LEGACY_AUDIT_LOG_KEY, 0, args.batch_size - 1)
+        if not batch:
+            break
+        target.rpush(AUDIT_LOG_KEY, *batch)
+        source.ltrim(LEGACY_AUDIT_LOG_KEY, len(batch), -1)
+        moved += len(batch)
+    print(f"Moved {moved} audit entries to {AUDIT_LOG_KEY!r}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-key tenant data into hash-tagged namespaces")
+    parser.add_argument("--source", required=True, help="Source Redis URL, e.g. redis://redis-service:6379")
+    parser.add_argument("--target", help="Standalone target Redis URL (defaults to the source)")
+    parser.add_argument("--target-cluster", help="Comma-separated host:port seed nodes of the target cluster")
+    parser.add_argument("--batch-size", type=int, default=500, help="Keys per SCAN page and pipeline")
+    parser.add_argument("--delete-source", action="store_true", help="Delete legacy keys once copied")
+    parser.add_argument("--skip-audit", action="store_true", help="Leave the audit log queue alone")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be migrated")
+    args = parser.parse_args()
+
+    migrate_data(args)
+    if not args.skip_audit:
+        migrate_audit_queue(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,65 @@
+import asyncio
 import json
 import os
+import threading
 from datetime import datetime, timezone
 from typing import Optional, Dict, List
 
+import orjson
+
 from app.models.user import User
 from app.models.api_key import APIKey
-from app.db.redis_utils import create_redis_client
+from app.db.redis_utils import create_redis_client, create_async_redis_client
+
+# Shared Redis clients, created on first use rather than at import time so the
+# app can be imported (and forked by a pre-loading server) without Redis
+_clients = {}
+_clients_lock = threading.Lock()
+
+def get_redis_client(db: int = 0, decode_responses: bool = True):
+    """Return this process's shared client for `db`, connecting on first use"""
+    key = (os.getpid(), db, decode_responses)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = create_redis_client(db=db, decode_responses=decode_responses)
+                _clients[key] = client
+    return client
+
+def get_main_redis():
+    return get_redis_client(db=0)
 
-# Initialize Redis clients
-main_redis = create_redis_client(db=0)
-logs_redis = create_redis_client(db=1)
+def get_logs_redis():
+    return get_redis_client(db=1)
+
+def get_binary_redis():
+    """Shared client for db 0 that returns raw bytes, for binary values"""
+    return get_redis_client(db=0, decode_responses=False)
+
+def get_async_redis():
+    """This process's asyncio client for db 0, bound to the running event loop"""
+    key = (os.getpid(), "async", id(asyncio.get_running_loop()))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = create_async_redis_client(db=0)
+                _clients[key] = client
+    return client
+
+def reset_redis_clients():
+    """Drop all shared clients so the next call reconnects (e.g. after a fork)"""
+    with _clients_lock:
+        _clients.clear()
 
 # Fake database initialization
-def init_redis_db():
-    # Create Redis connection with direct pod connection strategy and failover support
-    r = create_redis_client(db=0)
+def init_redis_db(r=None):
+    # Reuse the shared client (direct pod connection strategy with failover support)
+    if r is None:
+        r = get_main_redis()
     
     # Check all required keys exist
     required_keys = ["fake_tenants_db", "fake_users_db", "fake_api_keys_db"]
@@ -96,29 +141,73 @@ def init_redis_db():
     
     return r
 
+class _ParsedDocument:
+    """
+    The last parsed copy of a JSON document stored in Redis, and models built from it.
+
+    Every request still reads the document, so changes are seen immediately, but it
+    is only parsed again when its contents differ from the last read: comparing two
+    strings is far cheaper than parsing one. Models are shared between requests and
+    must not be modified.
+    """
+
+    def __init__(self):
+        self._state = (None, None, {})  # raw JSON, parsed document, cached models
+
+    def get(self, raw: str):
+        state = self._state
+        if state[0] != raw:
+            state = (raw, orjson.loads(raw), {})
+            self._state = state
+        return state[1], state[2]
+
+_users_document = _ParsedDocument()
+_api_keys_document = _ParsedDocument()
+
 def get_user(redis_client, username: str) -> Optional[User]:
 
-    users_data = json.loads(redis_client.get("fake_users_db"))
-    user_data = users_data.get(username)
-    if user_data:
-        return User(**user_data)
-    return None
+    users_data, users = _users_document.get(redis_client.get("fake_users_db"))
+    user = users.get(username)
+    if user is None:
+        user_data = users_data.get(username)
+        if not user_data:
+            return None
+        user = users[username] = User(**user_data)
+    return user
 
 def get_api_keys_for_tenant(tenant_id: str) -> List[APIKey]:
     # Create a fresh Redis client for read operations
     redis_client = create_redis_client()
     
-    api_keys_data = json.loads(redis_client.get("fake_api_keys_db"))
-    tenant_keys = []
+    api_keys_data, by_tenant = _api_keys_document.get(redis_client.get("fake_api_keys_db"))
+    tenant_keys = by_tenant.get(tenant_id)
+    if tenant_keys is None:
+        tenant_keys = []
+        for key_id, key_data in api_keys_data.items():
+            if key_data.get("tenant_id") == tenant_id:
+                # Exclude tenant_id from the response
+                api_key = {k: v for k, v in key_data.items() if k != "tenant_id"}
+                tenant_keys.append(APIKey(**api_key))
+        by_tenant[tenant_id] = tenant_keys
     
-    for key_id, key_data in api_keys_data.items():
-        if key_data.get("tenant_id") == tenant_id:
-            # Exclude tenant_id from the response
-            api_key = {k: v for k, v in key_data.items() if k != "tenant_id"}
-            tenant_keys.append(APIKey(**api_key))
+    return list(tenant_keys)
+
+def get_tenant_prefix(tenant_id: str) -> str:
+    """
+    Key prefix for everything owned by a tenant.
     
-    return tenant_keys
+    The tenant ID is wrapped in a hash tag so Redis Cluster hashes only the tenant
+    part: all of a tenant's keys share one slot, which keeps multi-key commands,
+    pipelines and Lua scripts on a single node.
+    """
+    return f"tenant:{{{tenant_id}}}"
+
+GLOB_SPECIAL = "*?[]\\"
+
+def escape_glob(pattern: str) -> str:
+    """Escape a key prefix for use in a SCAN MATCH pattern"""
+    return "".join("\\" + c if c in GLOB_SPECIAL else c for c in pattern)
 
 def get_namespaced_key(tenant_id: str, key: str) -> str:
     """Create a namespaced key for multi-tenant data isolation"""
-    return f"tenant:{tenant_id}:data:{key}"
+    return f"{get_tenant_prefix(tenant_id)}:data:{key}"
@@ -1,8 +1,123 @@
 import os
+import threading
+import time
 import uuid
 import redis
+import redis.asyncio
+import redis.backoff
+import redis.retry
+import redis.asyncio.cluster
+from redis.cluster import RedisCluster, ClusterNode
 
-def create_redis_client(db=0, return_connection_info=False):
+from app.core.config import REDIS_CLUSTER_NODES, REDIS_NODES
+from app.core.tracing import span
+
+# A process re-probes for the master at most this often, so an outage does not
+# make every failing command wait on probe timeouts
+REPOINT_MIN_INTERVAL_SECONDS = 1.0
+_repoint_lock = threading.Lock()
+
+class TracedRedis(redis.Redis):
+    """
+    redis.Redis that records a span per command in sampled traces.
+    
+    Clients returned by create_redis_client follow the master: when a command
+    fails with ReadOnlyError (the instance was demoted) or ConnectionError, the
+    client probes for the writable instance again and moves its connection pool
+    there, so every process recovers from a failover on its own. A command
+    refused as read-only was not applied, so it is retried once on the new
+    master; other failures are raised and the next command goes to the new one.
+    """
+    follow_master = False
+    _repointed_at = 0.0
+    
+    def execute_command(self, *args, **options):
+        with span(f"redis.{args[0]}", db=self.connection_pool.connection_kwargs.get('db', 0)):
+            try:
+                return super().execute_command(*args, **options)
+            except redis.exceptions.ReadOnlyError:
+                if not self.repoint():
+                    raise
+                return super().execute_command(*args, **options)
+            except redis.exceptions.ConnectionError:
+                self.repoint()
+                raise
+    
+    def pipeline(self, transaction=True, shard_hint=None):
+        return _TracedPipeline(self, transaction, shard_hint)
+    
+    def repoint(self) -> bool:
+        """Move to the current master if it is elsewhere; True if the pool was replaced"""
+        if not self.follow_master:
+            return False
+        if not _repoint_lock.acquire(blocking=False):
+            # Another thread is already probing
+            return False
+        try:
+            now = time.monotonic()
+            if now - self._repointed_at < REPOINT_MIN_INTERVAL_SECONDS:
+                return False
+            self._repointed_at = now
+            old_pool = self.connection_pool
+            kwargs = old_pool.connection_kwargs
+            try:
+                probe, host, port = create_redis_client(db=kwargs.get('db', 0), return_connection_info=True)
+                probe.close()
+            except redis.exceptions.RedisError as e:
+                print(f"Could not locate the Redis master: {str(e)}")
+                return False
+            if (host, port) == (kwargs.get('host'), kwargs.get('port')):
+                return False
+            print(f"Redis master moved to {host}:{port} (db={kwargs.get('db', 0)}), reconnecting")
+            self.connection_pool = redis.ConnectionPool(
+                connection_class=old_pool.connection_class,
+                max_connections=old_pool.max_connections,
+                **dict(kwargs, host=host, port=port),
+            )
+            # Connections in use are dropped when they are released to the old pool
+            old_pool.disconnect(inuse_connections=False)
+            return True
+        finally:
+            _repoint_lock.release()
+
+class _TracedPipeline(redis.client.Pipeline):
+    """Pipeline of a TracedRedis: a failure makes the client look for the master again"""
+    def __init__(self, client, transaction, shard_hint):
+        super().__init__(client.connection_pool, client.response_callbacks, transaction, shard_hint)
+        self._client = client
+    
+    def execute(self, raise_on_error=True):
+        try:
+            return super().execute(raise_on_error)
+        except (redis.exceptions.ReadOnlyError, redis.exceptions.ConnectionError):
+            # Part of the pipeline may have been applied, so it is not retried here
+            self._client.repoint()
+            raise
+
+class TracedRedisCluster(RedisCluster):
+    """RedisCluster that records a span per command in sampled traces"""
+    def execute_command(self, *args, **kwargs):
+        with span(f"redis.{args[0]}"):
+            return super().execute_command(*args, **kwargs)
+
+def create_cluster_client(decode_responses=True):
+    """
+    Create a cluster-aware client from the REDIS_CLUSTER_NODES seed list.
+    
+    The client discovers the slot map from the seeds and routes every command
+    to the master owning the key's slot, following MOVED/ASK redirects during
+    resharding and failover.
+    """
+    startup_nodes = []
+    for node in REDIS_CLUSTER_NODES:
+        host, _, port = node.rpartition(':')
+        startup_nodes.append(ClusterNode(host, int(port)))
+    
+    client = TracedRedisCluster(startup_nodes=startup_nodes, decode_responses=decode_responses, socket_timeout=2.0)
+    print(f"Connected to Redis Cluster via {', '.join(REDIS_CLUSTER_NODES)}")
+    return client
+
+def create_redis_client(db=0, return_connection_info=False, decode_responses=True):
     """
     Create a Redis client that attempts to connect directly to Redis pods
     and tests write capability to ensure it's connecting to the master.
@@ -11,33 +126,45 @@ def create_redis_client(db=0, return_connection_info=False):
         db (int): Redis database number
         return_connection_info (bool): If True, returns a tuple of (client, host, port)
                                       If False, returns just the client
+        decode_responses (bool): If False, replies are returned as bytes (binary values)
     
     Returns:
         If return_connection_info is True:
             Tuple of (redis.Redis, str, int): Redis client, host, and port
         Otherwise:
             redis.Redis: Redis client connected to a writable Redis instance
+    
+    When REDIS_CLUSTER_NODES is set a RedisCluster client is returned instead.
+    Redis Cluster has no logical databases, so `db` is ignored and data, audit
+    logs and other keyspaces are kept apart by key prefix.
     """
-    # Try to connect directly to Redis pods by their stable DNS names
-    redis_hosts = [
-        'redis-0.redis-headless',  # Try the initial master first
-        'redis-1.redis-headless',  # Then try replicas
-        'redis-2.redis-headless',
-        os.getenv('REDIS_HOST', 'redis')  # Fallback to the service
-    ]
-    redis_port = int(os.getenv('REDIS_PORT', 6379))
+    if REDIS_CLUSTER_NODES:
+        client = create_cluster_client(decode_responses=decode_responses)
+        if return_connection_info:
+            host, _, port = REDIS_CLUSTER_NODES[0].rpartition(':')
+            return client, host, int(port)
+        return client
+    
+    # Try to connect directly to the Redis pods (REDIS_NODES, by their stable DNS
+    # names by default), the initial master first, then the service
+    default_port = int(os.getenv('REDIS_PORT', 6379))
+    redis_nodes = REDIS_NODES + [os.getenv('REDIS_HOST', 'redis')]
     
     # Try each host until we find one that works for writes
-    for host in redis_hosts:
+    for node in redis_nodes:
+        host, _, port = node.partition(':')
+        redis_port = int(port) if port else default_port
         try:
-            client = redis.Redis(host=host, port=redis_port, db=db, decode_responses=True, socket_timeout=2.0)
+            client = TracedRedis(host=host, port=redis_port, db=db, decode_responses=decode_responses, socket_timeout=2.0)
             
             # Test if we can write to this Redis instance
-            test_key = f"write_test_{uuid.uuid4()}"
-            client.setex(test_key, 5, "1")
-            client.delete(test_key)
+            with span("redis.probe", host=host, db=db):
+                test_key = f"write_test_{uuid.uuid4()}"
+                client.setex(test_key, 5, "1")
+                client.delete(test_key)
             
             print(f"Successfully connected to Redis at {host}:{redis_port} (db={db})")
+            client.follow_master = True
             if return_connection_info:
                 return client, host, redis_port
             return client
@@ -50,15 +177,54 @@ def create_redis_client(db=0, return_connection_info=False):
     redis_port = int(os.getenv('REDIS_PORT', 6379))
     print(f"All direct Redis connections failed, falling back to service {host}")
     
-    client = redis.Redis(
+    client = TracedRedis(
         host=host,
         port=redis_port,
         db=db,
-        decode_responses=True,
+        decode_responses=decode_responses,
         retry_on_timeout=True,
-        retry=redis.retry.Retry(max_attempts=3)
+        retry=redis.retry.Retry(redis.backoff.ExponentialBackoff(), 3)
     )
+    # Moves to a pod once one answers writes again
+    client.follow_master = True
     
     if return_connection_info:
         return client, host, redis_port
     return client
+
+def create_async_redis_client(db=0, decode_responses=True):
+    """
+    Create an asyncio client for the same writable instance (or cluster) as create_redis_client.
+    
+    Used for blocking reads (XREAD BLOCK) from the event loop, so it has no socket
+    timeout; callers bound their waits with BLOCK instead.
+    """
+    if REDIS_CLUSTER_NODES:
+        startup_nodes = []
+        for node in REDIS_CLUSTER_NODES:
+            host, _, port = node.rpartition(':')
+            startup_nodes.append(redis.asyncio.cluster.ClusterNode(host, int(port)))
+        return redis.asyncio.cluster.RedisCluster(startup_nodes=startup_nodes, decode_responses=decode_responses)
+    
+    # Locate the master with the synchronous probe, then connect to it directly
+    _, host, port = create_redis_client(db=db, return_connection_info=True)
+    return redis.asyncio.Redis(host=host, port=port, db=db, decode_responses=decode_responses)
+
+class LazyMasterConnectionPool(redis.ConnectionPool):
+    """
+    Connection pool that finds the writable Redis instance on first use.
+    
+    Lets modules such as the Huey task definitions build their client at import
+    time without probing the Redis pods until a command is actually sent.
+    """
+    def __init__(self, db=0, **kwargs):
+        super().__init__(host=os.getenv('REDIS_HOST', 'redis'), port=int(os.getenv('REDIS_PORT', 6379)),
+                         db=db, **kwargs)
+        self._resolved = False
+    
+    def make_connection(self):
+        if not self._resolved:
+            _, host, port = create_redis_client(db=self.connection_kwargs.get('db', 0), return_connection_info=True)
+            self.connection_kwargs.update(host=host, port=port)
+            self._resolved = True
+        return super().make_connection()
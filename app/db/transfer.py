@@ -0,0 +1,166 @@
+"""
+Bulk export and import of a tenant's /data items as NDJSON.
+
+Each line holds one item as stored, with its remaining TTL in milliseconds
+(null for none):
+
+    {"key": "k1", "pttl": 3599000, "item": {"value": ..., "ttl": 3600, "metadata": ...}}
+
+Export walks the tenant's items with SCAN and reads them a page at a time with
+pipelined round trips (see items.iter_item_pages, which covers both storage
+layouts), so memory stays flat however many keys there are. SCAN may return an
+item twice; importing is idempotent, so that is harmless.
+Large values stored through /data/{key}/stream are not included: the export
+endpoint refuses a tenant that has any unless the client asks to skip them, and
+the audit record counts the ones skipped.
+
+Import writes pipelined batches of TRANSFER_BATCH_SIZE, restoring each TTL, and
+records the number of lines applied in a checkpoint hash, under the import_id
+the client chose, after every batch. Sending the same file again with the same
+import_id skips the lines already applied, so an interrupted import resumes
+where it stopped; the client has to choose the id, as a failed or dropped
+request has no response to return one in. Imported keys do not
+get individual expiration audit tasks; the import's audit record counts them.
+"""
+import json
+from datetime import datetime
+from typing import AsyncIterator, Iterator
+
+import orjson
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+
+from app.core.audit import write_audit_log
+from app.core.config import TRANSFER_BATCH_SIZE, IMPORT_CHECKPOINT_SECONDS
+from app.db.changes import add_change
+from app.db.items import iter_item_pages, add_item_write
+from app.db.local_cache import invalidate_item, item_etag
+from app.db.redis import get_main_redis, get_namespaced_key, get_tenant_prefix
+from app.models.data import KeyValueItem
+
+
+class ImportLineError(Exception):
+    """Raised for an import line that is not a valid exported item"""
+
+    def __init__(self, line_number: int, reason: str):
+        super().__init__(f"Line {line_number}: {reason}")
+        self.line_number = line_number
+
+
+def _export_page(items: list) -> bytes:
+    # Stored items are JSON already, so they are embedded without parsing them
+    return "".join('{"key": %s, "pttl": %s, "item": %s}\n' % (
+        json.dumps(key), "null" if pttl < 0 else pttl, data,
+    ) for key, data, pttl in items).encode()
+
+
+def export_items(tenant_id: str, skipped_blobs: int = 0) -> Iterator[bytes]:
+    """Yield the tenant's items as NDJSON, one page of keys per chunk"""
+    exported = 0
+    complete = False
+    try:
+        for items in iter_item_pages(tenant_id, TRANSFER_BATCH_SIZE):
+            if items:
+                exported += len(items)
+                yield _export_page(items)
+        complete = True
+    finally:
+        # Also logged when the client disconnects part way
+        write_audit_log({
+            "timestamp": datetime.now().isoformat(),
+            "action": "export_data",
+            "keys": exported,
+            "skipped_blobs": skipped_blobs,
+            "complete": complete,
+            "tenant_id": tenant_id,
+        })
+
+
+def _parse_line(line: bytes, line_number: int):
+    try:
+        record = orjson.loads(line)
+        key = record["key"]
+        pttl = record.get("pttl")
+        item = KeyValueItem(**record["item"])
+    except (ValueError, KeyError, TypeError, ValidationError) as e:
+        raise ImportLineError(line_number, f"not an exported item ({e.__class__.__name__})")
+    if not isinstance(key, str) or not key:
+        raise ImportLineError(line_number, "key must be a non-empty string")
+    if pttl is not None and (not isinstance(pttl, int) or pttl <= 0):
+        raise ImportLineError(line_number, "pttl must be a positive integer or null")
+    return key, item.model_dump_json(), pttl
+
+
+def _write_batch(tenant_id: str, checkpoint_key: str, batch: list, lines_done: int, keys_done: int):
+    client = get_main_redis()
+    pipe = client.pipeline(transaction=False)
+    for key, data, pttl in batch:
+        add_item_write(pipe, tenant_id, key, data, pttl)
+        add_change(pipe, tenant_id, "update", key, item_etag(data))
+    # Written after the batch: a crash in between only means the batch is applied again
+    pipe.hset(checkpoint_key, mapping={"lines": lines_done, "keys": keys_done})
+    pipe.expire(checkpoint_key, IMPORT_CHECKPOINT_SECONDS)
+    pipe.execute()
+    for key, _, _ in batch:
+        invalidate_item(get_namespaced_key(tenant_id, key))
+
+
+async def _iter_lines(body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    pending = b""
+    async for chunk in body:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def import_items(tenant_id: str, body: AsyncIterator[bytes], import_id: str) -> dict:
+    """Apply an NDJSON export to the tenant, resuming a previous attempt with the same import_id"""
+    checkpoint_key = f"{get_tenant_prefix(tenant_id)}:import:{import_id}"
+    checkpoint = await run_in_threadpool(get_main_redis().hgetall, checkpoint_key)
+    resumed_from = int(checkpoint.get("lines", 0))
+    keys_done = int(checkpoint.get("keys", 0))
+
+    line_number = 0
+    imported = 0
+    batch = []
+    error = None
+    try:
+        async for line in _iter_lines(body):
+            line_number += 1
+            if line_number <= resumed_from or not line.strip():
+                continue
+            batch.append(_parse_line(line, line_number))
+            if len(batch) >= TRANSFER_BATCH_SIZE:
+                await run_in_threadpool(_write_batch, tenant_id, checkpoint_key, batch, line_number,
+                                        keys_done + imported + len(batch))
+                imported += len(batch)
+                batch = []
+        if batch:
+            await run_in_threadpool(_write_batch, tenant_id, checkpoint_key, batch, line_number,
+                                    keys_done + imported + len(batch))
+            imported += len(batch)
+    except Exception as e:
+        # Batches before the failure stay applied and checkpointed; send the file again to resume
+        error = str(e)
+        raise
+    finally:
+        await run_in_threadpool(write_audit_log, {
+            "timestamp": datetime.now().isoformat(),
+            "action": "import_data",
+            "import_id": import_id,
+            "keys": imported,
+            "total_keys": keys_done + imported,
+            "resumed_from_line": resumed_from,
+            "error": error,
+            "tenant_id": tenant_id,
+        })
+
+    return {
+        "import_id": import_id,
+        "imported": imported,
+        "total_imported": keys_done + imported,
+        "resumed_from_line": resumed_from,
+    }
@@ -1,13 +1,66 @@
+import time
+
+# Measured from the first line of the app module so import time is included
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
+
 from app.api.api import api_router
-from app.db.redis import init_redis_db
+from app.core.admission import AdmissionControlMiddleware
+from app.core.audit import audit_rollups
+from app.core.config import ADMISSION_ENABLED, LOCAL_CACHE_ENABLED
+from app.core.metrics import STARTUP_SECONDS
+from app.core.tracing import TracingMiddleware
+from app.core.security import pwd_context
+from app.db.local_cache import local_cache
+from app.db.redis import init_redis_db, get_logs_redis, get_binary_redis
 
-app = FastAPI(title="Multi-tenant API Key Management System")
+_import_seconds = time.perf_counter() - _import_started
+STARTUP_SECONDS.labels(phase="import").set(_import_seconds)
+
+def warm_up():
+    """Open this process's connections and load lazy backends before taking traffic"""
+    get_logs_redis().ping()
+    get_binary_redis().ping()
+    # passlib picks and loads the bcrypt backend on first use
+    pwd_context.handler("bcrypt").get_backend()
+    if LOCAL_CACHE_ENABLED:
+        local_cache.ensure_listeners()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    app.state.redis_initialized = False
+    try:
+        # Connect and seed the fake databases through the shared client. Failures are
+        # not fatal: /ready reports not-ready and retries until Redis is reachable.
+        await run_in_threadpool(init_redis_db)
+        app.state.redis_initialized = True
+        await run_in_threadpool(warm_up)
+    except Exception as e:
+        print(f"Redis initialization deferred, Redis not reachable yet: {str(e)}")
+    
+    lifespan_seconds = time.perf_counter() - started
+    STARTUP_SECONDS.labels(phase="lifespan").set(lifespan_seconds)
+    print(f"Startup completed in {_import_seconds + lifespan_seconds:.3f}s "
+          f"(import {_import_seconds:.3f}s, lifespan {lifespan_seconds:.3f}s)")
+    yield
+    
+    try:
+        # Write counts of rolled up audit entries that have not been flushed yet
+        await run_in_threadpool(audit_rollups.flush)
+    except Exception as e:
+        print(f"Failed to write audit rollups on shutdown: {str(e)}")
+
+app = FastAPI(title="Multi-tenant API Key Management System", lifespan=lifespan)
+# Sampled per-request traces (see TRACE_SAMPLE_RATE)
+app.add_middleware(TracingMiddleware)
+# Outermost, so overload is shed before any other work is done
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
 
 # Include all routes from the API router
 app.include_router(api_router)
-
-@app.on_event("startup")
-async def startup_event():
-    # Initialize the Redis database
-    init_redis_db()
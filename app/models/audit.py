@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+from typing import Any, Dict, List, Optional
+
+class AuditPage(BaseModel):
+    # Oldest first; each entry carries its Loki timestamp in nanoseconds as "ts"
+    entries: List[Dict[str, Any]]
+    next_cursor: Optional[str] = None
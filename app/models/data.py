@@ -1,7 +1,21 @@
-from pydantic import BaseModel
-from typing import Optional, Any, Dict
+from pydantic import BaseModel, Field
+from typing import Optional, Any, Dict, List, Union
 
 class KeyValueItem(BaseModel):
     value: Any
     ttl: Optional[int] = None
     metadata: Optional[Dict] = None
+
+class IncrementRequest(BaseModel):
+    by: Union[int, float] = 1
+
+class AppendRequest(BaseModel):
+    values: List[Any] = Field(min_length=1)
+
+class SetIfGreaterRequest(BaseModel):
+    value: Union[int, float]
+
+class ItemPatch(BaseModel):
+    # Fields left out are kept; "metadata" is a JSON merge patch, "ttl": null removes the TTL
+    metadata: Optional[Dict] = None
+    ttl: Optional[int] = Field(None, gt=0)
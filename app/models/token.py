@@ -4,7 +4,10 @@ from typing import Optional
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
 
 class TokenData(BaseModel):
     username: Optional[str] = None
     tenant_id: Optional[str] = None
+    disabled: Optional[bool] = None
+    jti: Optional[str] = None
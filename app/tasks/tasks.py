@@ -3,16 +3,38 @@ from huey import crontab
 # from main import get_namespaced_key
 import json
 from datetime import datetime
-import requests
 import os
-from app.db.redis_utils import create_redis_client
+import threading
+import time
+import zlib
+from typing import Optional
+from app.core.config import (
+    AUDIT_LOG_KEY,
+    AUDIT_OFFLOADING_KEY,
+    AUDIT_QUEUE_EPOCH_KEY,
+    REDIS_CLUSTER_NODES,
+    HUEY_REDIS_HOST,
+    HUEY_REDIS_PORT,
+)
+from app.core.audit import write_audit_log
+from app.core.audit_blocks import encode_blocks, decode_queue_element
+from app.core.loki_push import push_entries
+from app.core.metrics import LOKI_PUSH_ENTRIES
+from app.core.profiling import capture_profile
+from app.core.tracing import span, traced_task
+from app.db.blobs import blob_pttl
+from app.db.changes import publish_change
+from app.db.expirations import record_expiration, extend_expiration, owns_expiration, claim_expiration
+from app.db.items import item_pttl
+from app.db.redis_utils import create_redis_client, LazyMasterConnectionPool
 
 # Find a writable Redis instance for Huey
-_, redis_host, redis_port = create_redis_client(db=2, return_connection_info=True)
-huey = RedisHuey(host=redis_host, port=redis_port, db=2)
-
-# Create logs Redis client
-logs_redis = create_redis_client(db=1)
+if REDIS_CLUSTER_NODES:
+    # Huey's storage is not cluster-aware, so it uses a standalone instance
+    huey = RedisHuey(host=HUEY_REDIS_HOST, port=HUEY_REDIS_PORT, db=2)
+else:
+    # The writable instance is looked up on the first command, not at import
+    huey = RedisHuey(connection_pool=LazyMasterConnectionPool(db=2))
 
 # Loki configuration
 LOKI_HOST = os.getenv('LOKI_HOST', 'loki-gateway')
@@ -20,43 +42,129 @@ LOKI_PORT = os.getenv('LOKI_PORT', '80')
 LOKI_URL = f'http://{LOKI_HOST}:{LOKI_PORT}/loki/api/v1/push'
 
 @huey.task()
-def audit_log_expiration(key: str, tenant_id: str):
-    # Create a fresh Redis client 
-    logs_client = create_redis_client(db=1)
+@traced_task()
+def audit_log_expiration(key: str, tenant_id: str, kind: str = "item", expiration_id: Optional[str] = None):
+    # kind is "item" for /data values, "blob" for values stored through /data/{key}/stream
+    if not owns_expiration(tenant_id, key, kind, expiration_id):
+        # Deleted, or written again since this was scheduled; a newer task owns any TTL
+        return
+    pttl = blob_pttl(tenant_id, key) if kind == "blob" else item_pttl(tenant_id, key)
+    if pttl > 0:
+        # The TTL was extended since this was scheduled; check again when it runs out
+        if expiration_id is not None:
+            extend_expiration(tenant_id, key, kind, pttl)
+        audit_log_expiration.schedule(args=(key, tenant_id, kind, expiration_id), delay=pttl / 1000)
+        return
+    if pttl == -1:
+        # Written again without a TTL, so it will not expire
+        return
+    if not claim_expiration(tenant_id, key, kind, expiration_id):
+        # Another run of this task already logged it
+        return
     
     # Log the key expiration
-    logs_entry = json.dumps({
+    write_audit_log({
         "timestamp": datetime.now().isoformat(),
         "action": "key_expiration",
         "key": key,
         "tenant_id": tenant_id,
     })
-    logs_client.lpush("logs:audit", logs_entry)
     
     print(f"Audit Log: Key '{tenant_id}:{key}' has expired.")
+    publish_change(tenant_id, "expire", key)
+
+def schedule_expiration(key: str, tenant_id: str, ttl: int, kind: str = "item"):
+    """Log the expiration of a key just written with a TTL of ttl seconds, unless it changes first"""
+    expiration_id = record_expiration(tenant_id, key, kind, ttl)
+    audit_log_expiration.schedule(args=(key, tenant_id, kind, expiration_id), delay=ttl)
+
+@huey.task()
+def capture_worker_profile(capture_id: str, kind: str, seconds: float):
+    # Sample from a separate thread so the capture also sees this worker's other
+    # consumers; the result is kept in Huey's result store under the capture id
+    def run():
+        try:
+            result = capture_profile(kind, seconds)
+        except Exception as e:
+            result = f"Profile capture failed: {str(e)}"
+        huey.put(f"profile:{capture_id}", result)
+
+    thread = threading.Thread(target=run, name=f"profile-{capture_id}", daemon=True)
+    thread.start()
+    thread.join()
+
+def to_loki_timestamp(log_timestamp, current_time_ns: int) -> int:
+    """Convert an audit entry timestamp to the nanosecond epoch Loki expects"""
+    if isinstance(log_timestamp, str):
+        try:
+            # Convert ISO format to nanoseconds
+            dt = datetime.fromisoformat(log_timestamp)
+            return int(dt.timestamp() * 1_000_000_000)
+        except ValueError:
+            return current_time_ns
+    return log_timestamp
+
+def build_loki_payload(tenant_id: str, tenant_logs: list, current_time_ns: int) -> dict:
+    """Build the Loki push payload for one tenant's batch of audit entries"""
+    streams = []
+    for log in tenant_logs:
+        # Extract timestamp if available, otherwise use current time
+        log_timestamp = to_loki_timestamp(log.get('timestamp', current_time_ns), current_time_ns)
+        
+        # Format log entry as string for Loki
+        log_line = json.dumps(log)
+        
+        # Add to streams list with appropriate labels
+        streams.append({
+            "stream": {
+                "job": "audit_logs",
+                "tenant_id": tenant_id,
+                "action": log.get('action', 'unknown')
+            },
+            "values": [
+                [str(log_timestamp), log_line]
+            ]
+        })
+    
+    return {"streams": streams}
+
+# Outlives a crashed offload run only this long; refreshed before every push attempt
+OFFLOADING_MARKER_SECONDS = 900
 
 # Huey background task for audit log offloading to Loki
 @huey.periodic_task(crontab(minute='*/1'))
+@traced_task()
 def offload_audit_logs_to_loki():
     print("\n" + "*"*50)
     print("Starting log offloading to Loki...")
     print(f"Loki URL: {LOKI_URL}")
     
-    # Create a fresh Redis client for logs
-    logs_client = create_redis_client(db=1)
+    # Create a fresh Redis client for logs; binary, as the queue may hold compressed blocks
+    logs_client = create_redis_client(db=1, decode_responses=False)
     
-    logs_count = logs_client.llen('logs:audit')
+    # Audit queries do not cache ranges while entries are out of the queue but not in Loki yet
+    logs_client.set(AUDIT_OFFLOADING_KEY, 1, ex=OFFLOADING_MARKER_SECONDS)
+    logs_client.incr(AUDIT_QUEUE_EPOCH_KEY)
+    try:
+        _offload(logs_client)
+    finally:
+        logs_client.delete(AUDIT_OFFLOADING_KEY)
+
+def _offload(logs_client):
+    """Drain the queue and push it to Loki, re-queueing what Loki did not take"""
+    logs_count = logs_client.llen(AUDIT_LOG_KEY)
     print(f"Found {logs_count} logs in Redis queue")
     
     logs = []
-    while True:
-        log_data = logs_client.rpop('logs:audit')
-        if log_data is None:
-            break
-        try:
-            logs.append(json.loads(log_data))
-        except json.JSONDecodeError as e:
-            print(f"Error decoding log data: {e}, data: {log_data}")
+    with span("offload.drain_queue"):
+        while True:
+            log_data = logs_client.rpop(AUDIT_LOG_KEY)
+            if log_data is None:
+                break
+            try:
+                logs.extend(decode_queue_element(log_data))
+            except (ValueError, KeyError, zlib.error) as e:
+                print(f"Error decoding log data: {e}, data: {log_data[:200]!r}")
     
     print(f"Successfully parsed {len(logs)} logs to offload")
     
@@ -82,133 +190,37 @@ def offload_audit_logs_to_loki():
     
     # Process logs for each tenant separately
     for tenant_id, tenant_logs in logs_by_tenant.items():
-        # Prepare Loki-formatted payload for this tenant
-        streams = []
-        for log in tenant_logs:
-            # Extract timestamp if available, otherwise use current time
-            log_timestamp = log.get('timestamp', current_time_ns)
-            if isinstance(log_timestamp, str):
-                try:
-                    # Convert ISO format to nanoseconds
-                    dt = datetime.fromisoformat(log_timestamp)
-                    log_timestamp = int(dt.timestamp() * 1_000_000_000)
-                except ValueError:
-                    log_timestamp = current_time_ns
-            
-            # Format log entry as string for Loki
-            log_line = json.dumps(log)
-            
-            # Add to streams list with appropriate labels
-            streams.append({
-                "stream": {
-                    "job": "audit_logs",
-                    "tenant_id": tenant_id,
-                    "action": log.get('action', 'unknown')
-                },
-                "values": [
-                    [str(log_timestamp), log_line]
-                ]
-            })
+        def build_payload(batch, tenant_id=tenant_id):
+            with span("offload.build_payload", tenant_id=tenant_id, entries=len(batch)):
+                return build_loki_payload(tenant_id, batch, current_time_ns)
         
-        # Prepare payload for Loki
-        loki_payload = {"streams": streams}
-        
-        # Retry mechanism with exponential backoff
+        # Rejected batches are split and only the entries Loki did not take are retried,
+        # with exponential backoff
         max_retries = 5
         base_delay = 1  # Start with 1 second delay
-        success = False
+        pending = tenant_logs
         
         for attempt in range(max_retries):
-            try:
-                # Send logs to Loki using the tenant_id as the X-Scope-OrgID
-                response = requests.post(
-                    LOKI_URL,
-                    json=loki_payload,
-                    headers={
-                        "Content-Type": "application/json",
-                        "X-Scope-OrgID": tenant_id  
-                    },
-                    timeout=10
-                )
-            
-                if response.status_code >= 200 and response.status_code < 300:
-                    successful_logs += len(tenant_logs)
-                    print(f"Successfully offloaded {len(tenant_logs)} audit logs for tenant {tenant_id} to Loki")
-                    success = True
-                    break
-                elif "at least 2 live replicas required" in response.text:
-                    print(f"Replica issue detected, trying to send logs one by one for tenant {tenant_id}")
-                    
-                    individual_success = True
-                    individual_successful = 0
-                    
-                    for log in tenant_logs:
-                        log_timestamp = log.get('timestamp', current_time_ns)
-                        if isinstance(log_timestamp, str):
-                            try:
-                                # Convert ISO format to nanoseconds
-                                dt = datetime.fromisoformat(log_timestamp)
-                                log_timestamp = int(dt.timestamp() * 1_000_000_000)
-                            except ValueError:
-                                log_timestamp = current_time_ns
-                                
-                        # Format log entry as string for Loki
-                        log_line = json.dumps(log)
-                        
-                        single_stream = [{
-                            "stream": {
-                                "job": "audit_logs",
-                                "tenant_id": tenant_id,
-                                "action": log.get('action', 'unknown')
-                            },
-                            "values": [
-                                [str(log_timestamp), log_line]
-                            ]
-                        }]
-                        
-                        single_payload = {"streams": single_stream}
-                        
-                        try:
-                            single_response = requests.post(
-                                LOKI_URL,
-                                json=single_payload,
-                                headers={
-                                    "Content-Type": "application/json",
-                                    "X-Scope-OrgID": tenant_id
-                                },
-                                timeout=10
-                            )
-                            
-                            if single_response.status_code >= 200 and single_response.status_code < 300:
-                                individual_successful += 1
-                            else:
-                                print(f"Failed to send individual log: {single_response.status_code} - {single_response.text}")
-                                individual_success = False
-                        except Exception as e:
-                            print(f"Error sending individual log: {str(e)}")
-                            individual_success = False
-                    
-                    if individual_successful > 0:
-                        successful_logs += individual_successful
-                        print(f"Successfully sent {individual_successful} logs individually for tenant {tenant_id}")
-                        success = True
-                        break
-                else:
-                    print(f"Failed to offload logs for tenant {tenant_id} to Loki (attempt {attempt+1}/{max_retries}). Status code: {response.status_code}, Response: {response.text}")
-            except Exception as e:
-                print(f"Error offloading logs for tenant {tenant_id} to Loki (attempt {attempt+1}/{max_retries}): {str(e)}")
-            
-            # Exponential backoff
-            import time
-            delay = base_delay * (2 ** attempt)
-            print(f"Retrying in {delay} seconds...")
-            time.sleep(delay)
+            logs_client.expire(AUDIT_OFFLOADING_KEY, OFFLOADING_MARKER_SECONDS)
+            delivered, pending = push_entries(tenant_id, pending, build_payload)
+            successful_logs += delivered
+            LOKI_PUSH_ENTRIES.labels(result="delivered").inc(delivered)
+            if delivered:
+                print(f"Successfully offloaded {delivered} audit logs for tenant {tenant_id} to Loki")
+            if not pending:
+                break
+            if attempt + 1 < max_retries:
+                delay = base_delay * (2 ** attempt)
+                print(f"{len(pending)} logs for tenant {tenant_id} not accepted (attempt {attempt+1}/{max_retries}), "
+                      f"retrying in {delay} seconds...")
+                time.sleep(delay)
         
-        if not success:
-            print(f"Failed to send logs to Loki after {max_retries} attempts for tenant {tenant_id}")
-            # Re-add logs to Redis for future processing
-            for log in tenant_logs:
-                logs_redis.lpush("logs:audit", json.dumps(log))
+        if pending:
+            print(f"Failed to send {len(pending)} logs to Loki after {max_retries} attempts for tenant {tenant_id}")
+            # Re-add only the undelivered logs to Redis for future processing, compressed,
+            # as a backlog may build up
+            LOKI_PUSH_ENTRIES.labels(result="requeued").inc(len(pending))
+            logs_client.lpush(AUDIT_LOG_KEY, *encode_blocks(json.dumps(log) for log in pending))
     
     if successful_logs > 0:
         print(f"Total logs offloaded to Loki: {successful_logs}")
\ No newline at end of file
@@ -0,0 +1,65 @@
+"""
+Gunicorn settings for serving the API with several uvicorn worker processes.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+The app is imported once in the master (preload_app) and shared copy-on-write
+by the workers. Connections, background threads and caches are per process:
+each worker drops anything inherited from the master after the fork and opens
+its own in the app's lifespan, before it starts accepting requests.
+"""
+import gc
+import glob
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = "uvicorn_worker.UvicornWorker"
+
+# Import the app (and its dependencies) once, before forking
+preload_app = True
+
+# On SIGTERM/HUP workers stop accepting, finish in-flight requests, then exit
+graceful_timeout = int(os.getenv('GRACEFUL_TIMEOUT', 30))
+timeout = int(os.getenv('WORKER_TIMEOUT', 60))
+keepalive = int(os.getenv('KEEPALIVE', 5))
+
+# Optionally recycle workers after a number of requests; restarts are staggered by the jitter
+max_requests = int(os.getenv('MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('MAX_REQUESTS_JITTER', 0))
+
+accesslog = "-"
+errorlog = "-"
+
+# With several workers, Prometheus metrics are aggregated through files in
+# PROMETHEUS_MULTIPROC_DIR. It is only set here, for gunicorn: processes started
+# otherwise from the same image (the Huey consumer, a single uvicorn) keep the
+# default in-memory registry. Values from a previous run must not leak in, so the
+# directory is cleared here, before the app is preloaded and writes to it.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus')
+_metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+if _metrics_dir:
+    os.makedirs(_metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(_metrics_dir, "*.db")):
+        os.remove(path)
+
+
+def when_ready(server):
+    # Objects created while preloading never change; moving them out of the GC's
+    # generations keeps collections in the workers from touching (and copying) their pages
+    gc.freeze()
+    server.log.info(f"Preloaded app, starting {workers} workers")
+
+
+def post_fork(server, worker):
+    # Sockets and pools inherited from the master must not be shared between processes
+    from app.db.redis import reset_redis_clients
+    reset_redis_clients()
+    server.log.info(f"Worker {worker.pid} forked")
+
+
+def child_exit(server, worker):
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Memory per queued audit entry, plain JSON versus compressed blocks.
+
+Builds a realistic mix of audit entries and measures, for each layout, the bytes
+per entry of the queue elements and the time to encode and decode them. With
+--redis-url the entries are also pushed to a scratch list and Redis' own
+MEMORY USAGE is reported, which includes the list's per-element overhead.
+
+Usage:
+    python tests/audit_block_benchmark.py
+    python tests/audit_block_benchmark.py --entries 100000 --redis-url redis://localhost:6379/1
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.audit_blocks import encode_blocks, decode_queue_element  # noqa: E402
+from app.core.config import AUDIT_BLOCK_ENTRIES  # noqa: E402
+
+SCRATCH_KEY = "benchmark:{audit}:blocks"
+
+
+def make_entries(count, value_size):
+    rng = random.Random(42)
+    started = datetime.now()
+    entries = []
+    for i in range(count):
+        tenant_id = f"tenant{rng.randint(1, 2)}"
+        timestamp = (started + timedelta(milliseconds=i * 7)).isoformat()
+        key = f"key-{rng.randint(0, 9999)}"
+        kind = rng.random()
+        if kind < 0.6:
+            entry = {"timestamp": timestamp, "action": "get_key", "key": key,
+                     "value": "".join(rng.choice("abcdefghij") for _ in range(value_size)),
+                     "metadata": {"source": "app"}, "tenant_id": tenant_id}
+        elif kind < 0.85:
+            entry = {"timestamp": timestamp, "action": rng.choice(["create_key", "update_key"]), "key": key,
+                     "value": "".join(rng.choice("abcdefghij") for _ in range(value_size)),
+                     "ttl": rng.choice([None, 3600]), "metadata": {"source": "app"}, "tenant_id": tenant_id}
+        elif kind < 0.95:
+            entry = {"timestamp": timestamp, "action": "key_expiration", "key": key, "tenant_id": tenant_id}
+        else:
+            entry = {"timestamp": timestamp, "action": "login_success", "username": f"user{rng.randint(1, 2)}",
+                     "tenant_id": tenant_id, "token_expires_minutes": 30}
+        entries.append(entry)
+    return entries
+
+
+def redis_memory(client, elements):
+    client.delete(SCRATCH_KEY)
+    for i in range(0, len(elements), 1000):
+        client.rpush(SCRATCH_KEY, *elements[i:i + 1000])
+    usage = client.memory_usage(SCRATCH_KEY, samples=0)
+    client.delete(SCRATCH_KEY)
+    return usage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain and compressed audit queue layouts")
+    parser.add_argument("--entries", type=int, default=20000, help="Number of audit entries")
+    parser.add_argument("--value-size", type=int, default=32, help="Characters per stored value")
+    parser.add_argument("--redis-url", help="Also measure MEMORY USAGE of a scratch list on this Redis")
+    args = parser.parse_args()
+
+    entries = make_entries(args.entries, args.value_size)
+    lines = [json.dumps(entry) for entry in entries]
+
+    started = time.perf_counter()
+    blocks = encode_blocks(lines)
+    encode_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    decoded = [entry for block in blocks for entry in decode_queue_element(block)]
+    decode_seconds = time.perf_counter() - started
+    assert decoded == entries, "blocks did not round-trip"
+
+    started = time.perf_counter()
+    for line in lines:
+        decode_queue_element(line)
+    plain_decode_seconds = time.perf_counter() - started
+
+    plain_bytes = sum(len(line) for line in lines)
+    block_bytes = sum(len(block) for block in blocks)
+    print(f"{args.entries} entries, {len(blocks)} blocks of up to {AUDIT_BLOCK_ENTRIES}")
+    print(f"{'layout':<10}{'elements':>10}{'bytes/entry':>14}{'encode us/entry':>17}{'decode us/entry':>17}")
+    print(f"{'plain':<10}{len(lines):>10}{plain_bytes / len(lines):>14.1f}{'-':>17}"
+          f"{plain_decode_seconds / len(lines) * 1e6:>17.2f}")
+    print(f"{'blocks':<10}{len(blocks):>10}{block_bytes / len(lines):>14.1f}"
+          f"{encode_seconds / len(lines) * 1e6:>17.2f}{decode_seconds / len(lines) * 1e6:>17.2f}")
+    print(f"Compression ratio: {plain_bytes / block_bytes:.1f}x")
+
+    if args.redis_url:
+        import redis
+        client = redis.Redis.from_url(args.redis_url)
+        plain_usage = redis_memory(client, lines)
+        block_usage = redis_memory(client, blocks)
+        print(f"Redis MEMORY USAGE per entry: plain {plain_usage / len(lines):.1f} B, "
+              f"blocks {block_usage / len(lines):.1f} B ({plain_usage / block_usage:.1f}x less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,16 @@ import json
 import requests
 from datetime import datetime
 import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from app.core.audit_blocks import decode_queue_element
 
 # Redis configuration
 REDIS_HOST = os.getenv('REDIS_HOST', 'redis-service')
 REDIS_PORT = int(os.getenv('REDIS_PORT', 6379))
-logs_redis = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=1, decode_responses=True)
+# Binary, as the queue may hold compressed blocks of entries
+logs_redis = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=1, decode_responses=False)
 
 # Loki configuration
 LOKI_HOST = os.getenv('LOKI_HOST', 'loki-gateway')
@@ -28,20 +33,20 @@ except Exception as e:
     print(f"Loki health check failed: {str(e)}")
 
 # Check if there are logs in Redis
-logs_count = logs_redis.llen('logs:audit')
+logs_count = logs_redis.llen('logs:{audit}')
 print(f"Found {logs_count} logs in Redis")
 
 # Get all logs from Redis without removing them
 logs = []
 if logs_count > 0:
     # Get all logs without removing them
-    all_logs = logs_redis.lrange('logs:audit', 0, -1)
+    all_logs = logs_redis.lrange('logs:{audit}', 0, -1)
     for log_data in all_logs:
         try:
-            log = json.loads(log_data)
-            logs.append(log)
-            print(f"Log: {log}")
-        except json.JSONDecodeError:
+            for log in decode_queue_element(log_data):
+                logs.append(log)
+                print(f"Log: {log}")
+        except ValueError:
             print(f"Error decoding log: {log_data}")
 
     print(f"Retrieved {len(logs)} logs from Redis")
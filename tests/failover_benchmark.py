@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Write availability and latency of the API during a Redis master failover, without Kubernetes.
+
+Starts a local master, replicas and three Sentinels (redis-server and redis-sentinel
+must be on the PATH), runs the app with uvicorn against them (REDIS_NODES lists the
+local instances, as the pods are listed in the cluster) and drives a steady mix of
+POST /data, GET /data/{key} and PUT /data/{key} from several clients. A probe calls
+/ready every --probe-interval seconds, like the kubelet's readiness probe, since
+that is how the app re-probes for the master. After --warmup seconds the master is
+failed over:
+
+    kill     the master process is killed (SIGKILL); Sentinel promotes a replica once
+             it has been unreachable for --down-after-ms
+    demote   SENTINEL FAILOVER: the master is demoted to a replica while still up
+
+and the load keeps running for --duration seconds. The report covers:
+
+    promotion         trigger until Sentinel reports the new master
+    rediscovery       promotion until the app's first successful write to the new master
+    write outage      first failed write until the first successful write after the last failure
+    errors            failed requests per endpoint, by status code or exception
+    latency           p50/p99 per endpoint before the failover and during recovery
+                      (trigger until the end of the write outage, or at least 5 seconds)
+
+Usage:
+    python tests/failover_benchmark.py
+    python tests/failover_benchmark.py --mode demote --clients 16 --rate 200 --json failover.json
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+import redis
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MASTER_NAME = "mymaster"
+WRITE_ENDPOINTS = ("POST /data", "PUT /data/{key}")
+
+
+class LocalRedis:
+    """A master, its replicas and three Sentinels, as local processes in a scratch directory"""
+
+    def __init__(self, base_port, replicas, down_after_ms):
+        self.work_dir = tempfile.mkdtemp(prefix="redis-failover-")
+        self.ports = [base_port + i for i in range(replicas + 1)]
+        self.sentinel_ports = [base_port + 100 + i for i in range(3)]
+        self.down_after_ms = down_after_ms
+        self.processes = {}
+
+    def start(self):
+        master = self.ports[0]
+        for port in self.ports:
+            args = ["redis-server", "--port", str(port), "--dir", self._dir(port), "--save", "", "--appendonly", "no"]
+            if port != master:
+                args += ["--replicaof", "127.0.0.1", str(master)]
+            self.processes[port] = subprocess.Popen(args, stdout=subprocess.DEVNULL)
+        for port in self.sentinel_ports:
+            config = os.path.join(self._dir(port), "sentinel.conf")
+            with open(config, "w") as f:
+                f.write(f"port {port}\n"
+                        f"dir {self._dir(port)}\n"
+                        f"sentinel monitor {MASTER_NAME} 127.0.0.1 {master} 2\n"
+                        f"sentinel down-after-milliseconds {MASTER_NAME} {self.down_after_ms}\n"
+                        f"sentinel failover-timeout {MASTER_NAME} 10000\n"
+                        f"sentinel parallel-syncs {MASTER_NAME} 1\n")
+            self.processes[port] = subprocess.Popen(["redis-sentinel", config], stdout=subprocess.DEVNULL)
+
+        for port in self.ports + self.sentinel_ports:
+            wait_for(lambda: redis.Redis(port=port).ping(), f"redis on port {port}")
+        for port in self.ports[1:]:
+            wait_for(lambda: redis.Redis(port=port).info("replication")["master_link_status"] == "up",
+                     f"replica on port {port} to sync")
+        wait_for(lambda: len(self.sentinel().sentinel_slaves(MASTER_NAME)) == len(self.ports) - 1
+                 and len(self.sentinel().sentinel_sentinels(MASTER_NAME)) == 2,
+                 "sentinels to discover the replicas and each other")
+
+    def _dir(self, port):
+        path = os.path.join(self.work_dir, str(port))
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def sentinel(self):
+        return redis.Redis(port=self.sentinel_ports[0], decode_responses=True, socket_timeout=1)
+
+    def master_address(self):
+        host, port = self.sentinel().sentinel_get_master_addr_by_name(MASTER_NAME)
+        return f"{host}:{port}"
+
+    def kill_master(self):
+        self.processes[self.ports[0]].send_signal(signal.SIGKILL)
+
+    def demote_master(self):
+        self.sentinel().execute_command("SENTINEL", "FAILOVER", MASTER_NAME)
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def wait_for(check, what, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if check():
+                return
+        except (redis.exceptions.RedisError, requests.RequestException, KeyError):
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Timed out waiting for {what}")
+
+
+def start_app(local, port):
+    env = dict(os.environ)
+    env.update({
+        "SECRET_KEY": env.get("SECRET_KEY", "failover-benchmark"),
+        # The instances in order, as the pods would be; REDIS_HOST is the last resort
+        "REDIS_NODES": ",".join(f"127.0.0.1:{p}" for p in local.ports),
+        "REDIS_HOST": "127.0.0.1",
+        "REDIS_PORT": str(local.ports[0]),
+        # Measure Redis, not the limiters
+        "RATE_LIMIT_ENABLED": "false",
+        "ADMISSION_ENABLED": "false",
+        "AUDIT_SPOOL_DIR": os.path.join(local.work_dir, "audit-spool"),
+    })
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+    )
+    wait_for(lambda: requests.get(f"http://127.0.0.1:{port}/ready", timeout=2).status_code == 200, "the app")
+    return process
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (start, end, endpoint, error or None)
+        self.requests = []
+
+    def add(self, start, end, endpoint, error):
+        with self.lock:
+            self.requests.append((start, end, endpoint, error))
+
+
+def run_client(base_url, headers, client_id, interval, stop, recorder):
+    session = requests.Session()
+    session.headers.update(headers)
+    i = 0
+    key = None  # the last key this client created
+    next_at = time.time()
+
+    def timed(endpoint, call):
+        nonlocal next_at
+        started = time.time()
+        try:
+            status = call().status_code
+            error = None if status < 400 else str(status)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        recorder.add(started, time.time(), endpoint, error)
+        next_at += interval
+        time.sleep(max(0.0, next_at - time.time()))
+        return error is None
+
+    while not stop.is_set():
+        new_key = f"failover-{client_id}-{i}"
+        if timed("POST /data", lambda: session.post(f"{base_url}/data", params={"key": new_key},
+                                                    json={"value": i}, timeout=10)):
+            key = new_key
+        if key is not None:
+            # Read and update the last key that was created, so a failed POST does not show up as 404s
+            timed("GET /data/{key}", lambda: session.get(f"{base_url}/data/{key}", timeout=10))
+            timed("PUT /data/{key}", lambda: session.put(f"{base_url}/data/{key}", json={"value": -i}, timeout=10))
+        i += 1
+
+
+def run_probe(base_url, period, stop, recorder):
+    while not stop.wait(period):
+        started = time.time()
+        try:
+            status = requests.get(f"{base_url}/ready", timeout=5).status_code
+            error = None if status == 200 else str(status)
+        except requests.RequestException as e:
+            error = type(e).__name__
+        recorder.add(started, time.time(), "GET /ready", error)
+
+
+def watch_master(local, stop, changes):
+    address = local.master_address()
+    while not stop.wait(0.05):
+        try:
+            current = local.master_address()
+        except redis.exceptions.RedisError:
+            continue
+        if current != address:
+            changes.append((time.time(), current))
+            address = current
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def analyze(records, triggered_at, promoted_at):
+    writes = sorted((r for r in records if r[2] in WRITE_ENDPOINTS and r[0] >= triggered_at), key=lambda r: r[0])
+    failed = [r for r in writes if r[3]]
+    outage_start = outage_end = None
+    if failed:
+        outage_start = failed[0][0]
+        last_failure = failed[-1][0]
+        recovered = [r for r in writes if not r[3] and r[0] > last_failure]
+        outage_end = recovered[0][1] if recovered else None
+    first_new_write = None
+    if promoted_at is not None:
+        succeeded = [r for r in writes if not r[3] and r[0] >= promoted_at]
+        first_new_write = succeeded[0][1] if succeeded else None
+
+    recovery_end = max(outage_end or triggered_at, triggered_at + 5)
+    endpoints = sorted({r[2] for r in records})
+    per_endpoint = {}
+    for endpoint in endpoints:
+        before = [r[1] - r[0] for r in records if r[2] == endpoint and r[0] < triggered_at and not r[3]]
+        during = [r[1] - r[0] for r in records if r[2] == endpoint and triggered_at <= r[0] < recovery_end]
+        errors = defaultdict(int)
+        for r in records:
+            if r[2] == endpoint and r[3] and r[0] >= triggered_at:
+                errors[r[3]] += 1
+        per_endpoint[endpoint] = {
+            "requests": sum(1 for r in records if r[2] == endpoint),
+            "errors": dict(errors),
+            "p50_before_ms": _ms(percentile(before, 0.5)),
+            "p99_before_ms": _ms(percentile(before, 0.99)),
+            "p50_recovery_ms": _ms(percentile(during, 0.5)),
+            "p99_recovery_ms": _ms(percentile(during, 0.99)),
+        }
+
+    return {
+        "promotion_s": _s(promoted_at, triggered_at),
+        "rediscovery_s": _s(first_new_write, promoted_at),
+        "write_outage_s": _s(outage_end, outage_start),
+        "write_outage_started_s": _s(outage_start, triggered_at),
+        "failed_writes": len(failed),
+        "recovered": bool(not failed or outage_end),
+        "endpoints": per_endpoint,
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def _s(end, start):
+    return None if end is None or start is None else round(end - start, 3)
+
+
+def print_report(mode, result):
+    print(f"\nFailover ({mode})")
+    print(f"  promotion (trigger -> new master in Sentinel): {_fmt(result['promotion_s'])}")
+    print(f"  rediscovery (promotion -> first write on it):  {_fmt(result['rediscovery_s'])}")
+    print(f"  write outage:                                  {_fmt(result['write_outage_s'])}"
+          f" ({result['failed_writes']} failed writes{'' if result['recovered'] else ', NOT RECOVERED'})")
+    print(f"\n{'endpoint':<18}{'requests':>9}{'p50 before':>12}{'p99 before':>12}{'p50 recov':>11}{'p99 recov':>11}  errors")
+    for endpoint, stats in result["endpoints"].items():
+        errors = ", ".join(f"{reason}: {count}" for reason, count in sorted(stats["errors"].items())) or "-"
+        print(f"{endpoint:<18}{stats['requests']:>9}{_fmt(stats['p50_before_ms'], 'ms'):>12}"
+              f"{_fmt(stats['p99_before_ms'], 'ms'):>12}{_fmt(stats['p50_recovery_ms'], 'ms'):>11}"
+              f"{_fmt(stats['p99_recovery_ms'], 'ms'):>11}  {errors}")
+
+
+def _fmt(value, unit="s"):
+    return "n/a" if value is None else f"{value}{unit}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API write availability during a Redis failover")
+    parser.add_argument("--mode", choices=("kill", "demote"), default="kill", help="How the master is failed over")
+    parser.add_argument("--replicas", type=int, default=2, help="Replicas of the master")
+    parser.add_argument("--base-port", type=int, default=7400, help="First Redis port; Sentinels use +100")
+    parser.add_argument("--app-port", type=int, default=8099, help="Port for the app under test")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients")
+    parser.add_argument("--rate", type=float, default=100, help="Total requests per second")
+    parser.add_argument("--warmup", type=float, default=10, help="Seconds of load before the failover")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load after the failover")
+    parser.add_argument("--down-after-ms", type=int, default=5000,
+                        help="Sentinel down-after-milliseconds (5000 in k8s/redis/sentinel-statefulset.yaml)")
+    parser.add_argument("--probe-interval", type=float, default=5,
+                        help="Seconds between /ready probes (periodSeconds in the fastapi deployment)")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    for binary in ("redis-server", "redis-sentinel"):
+        if shutil.which(binary) is None:
+            sys.exit(f"{binary} is not on the PATH")
+
+    local = LocalRedis(args.base_port, args.replicas, args.down_after_ms)
+    app = None
+    try:
+        print(f"Starting a master, {args.replicas} replicas and 3 sentinels in {local.work_dir}")
+        local.start()
+        print(f"Starting the app on port {args.app_port}")
+        app = start_app(local, args.app_port)
+        base_url = f"http://127.0.0.1:{args.app_port}"
+        response = requests.post(f"{base_url}/token", data={"username": "user1", "password": "secret"}, timeout=10)
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        recorder = Recorder()
+        stop = threading.Event()
+        master_changes = []
+        interval = args.clients / args.rate
+        threads = [threading.Thread(target=run_client, args=(base_url, headers, i, interval, stop, recorder), daemon=True)
+                   for i in range(args.clients)]
+        threads.append(threading.Thread(target=run_probe, args=(base_url, args.probe_interval, stop, recorder),
+                                        daemon=True))
+        threads.append(threading.Thread(target=watch_master, args=(local, stop, master_changes), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        print(f"Load: {args.rate:g} req/s from {args.clients} clients; failing over in {args.warmup:g}s")
+        time.sleep(args.warmup)
+        triggered_at = time.time()
+        if args.mode == "kill":
+            local.kill_master()
+        else:
+            local.demote_master()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join(timeout=15)
+
+        promoted_at = master_changes[0][0] if master_changes else None
+        result = analyze(list(recorder.requests), triggered_at, promoted_at)
+        result.update(mode=args.mode, new_master=master_changes[-1][1] if master_changes else None,
+                      config={k: v for k, v in vars(args).items() if k != "json"})
+        print_report(args.mode, result)
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(result, f, indent=2)
+            print(f"\nResults written to {args.json}")
+    finally:
+        if app is not None:
+            app.terminate()
+            app.wait(timeout=10)
+        local.stop()
+
+
+if __name__ == "__main__":
+    main()
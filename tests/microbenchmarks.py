@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the hot auth, serialization and storage functions.
+
+Runs fully offline: the Redis client factory is swapped for an in-process
+stand-in before the app modules are imported, so no Redis, Loki or network
+access is needed. Every run is appended (one JSON line per run) to the
+results file together with the current git commit, so results can be
+compared across commits.
+
+Usage:
+    python tests/microbenchmarks.py
+    python tests/microbenchmarks.py --sizes 10,1000,100000 --only get_user
+    python tests/microbenchmarks.py --output bench_results.jsonl --min-time 0.5
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone, timedelta
+
+import orjson
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SECRET_KEY", "microbenchmark-secret-key")
+
+DEFAULT_SIZES = [10, 100, 1_000, 10_000, 100_000, 1_000_000]
+PAYLOAD_SIZES = [16, 1_024, 65_536, 1_048_576]
+HASHED_PASSWORD = "$2b$12$EixZaYVK1fsbw1ZfbX3OXePaWxn96p36WQoeG6Lruj3vjPGga31lW"
+
+
+class InProcessRedis:
+    """Minimal in-process stand-in for the redis.Redis commands the app uses"""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value = self.data.get(key)
+        # A real client decodes a fresh string from every reply
+        return value.encode().decode() if isinstance(value, str) else value
+
+    def set(self, key, value, **kwargs):
+        self.data[key] = value
+        return True
+
+    def setex(self, key, ttl, value):
+        self.data[key] = value
+        return True
+
+    def exists(self, *keys):
+        return sum(1 for key in keys if key in self.data)
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def expire(self, key, ttl):
+        return key in self.data
+
+    def lpush(self, key, *values):
+        queue = self.data.setdefault(key, [])
+        for value in values:
+            queue.insert(0, value)
+        return len(queue)
+
+    def rpop(self, key):
+        queue = self.data.get(key)
+        return queue.pop() if queue else None
+
+    def llen(self, key):
+        return len(self.data.get(key, []))
+
+    def hset(self, key, field, value):
+        self.data.setdefault(key, {})[field] = str(value)
+        return 1
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hdel(self, key, *fields):
+        return sum(1 for field in fields if self.data.get(key, {}).pop(field, None) is not None)
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(key, {}).update(mapping)
+        return len(mapping)
+
+    def zremrangebyscore(self, key, low, high):
+        low, high = float(low), float(high)
+        zset = self.data.get(key, {})
+        removed = [member for member, score in zset.items() if low <= score <= high]
+        for member in removed:
+            del zset[member]
+        return len(removed)
+
+    def zrangebyscore(self, key, low, high, withscores=False):
+        low, high = float(low), float(high)
+        members = sorted((score, member) for member, score in self.data.get(key, {}).items() if low <= score <= high)
+        return [(member, score) if withscores else member for score, member in members]
+
+    def flushdb(self):
+        self.data.clear()
+
+
+_servers = {}
+
+
+def in_process_redis_client(db=0, return_connection_info=False, decode_responses=True):
+    client = _servers.setdefault(db, InProcessRedis())
+    if return_connection_info:
+        return client, "in-process", 0
+    return client
+
+
+# Swap the client factory before any module that connects at import time is loaded
+import app.db.redis_utils as redis_utils  # noqa: E402
+
+redis_utils.create_redis_client = in_process_redis_client
+
+from app.core.audit import DEFAULT_RULE, apply_policy  # noqa: E402
+from app.core.security import create_access_token, get_current_user  # noqa: E402
+from app.core.serialization import raw_json_response  # noqa: E402
+from app.db import redis as redis_db  # noqa: E402
+from app.models.data import KeyValueItem  # noqa: E402
+from app.tasks.tasks import build_loki_payload  # noqa: E402
+
+
+def time_call(func, min_time, max_iterations=1_000_000):
+    """Run func repeatedly for at least min_time seconds and return per-call timings"""
+    func()  # warm-up
+    timings = []
+    deadline = time.perf_counter() + min_time
+    while len(timings) < max_iterations:
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+        if time.perf_counter() >= deadline and len(timings) >= 3:
+            break
+    return timings
+
+
+def run_coroutine(coro):
+    """Drive a coroutine that never awaits real I/O without an event loop round trip"""
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    coro.close()
+    raise RuntimeError("coroutine awaited unexpectedly")
+
+
+def make_users(count):
+    users = {}
+    for i in range(count):
+        username = f"user{i}"
+        users[username] = {
+            "username": username,
+            "email": f"{username}@example.com",
+            "full_name": f"User {i}",
+            "disabled": False,
+            "hashed_password": HASHED_PASSWORD,
+            "tenant_id": f"tenant{i % 2 + 1}",
+        }
+    return users
+
+
+def make_api_keys(count):
+    created_at = datetime.now(timezone.utc).isoformat()
+    keys = {}
+    for i in range(count):
+        key_id = f"key_{i:08d}"
+        keys[key_id] = {
+            "key_id": key_id,
+            "name": f"API Key {i}",
+            "key_value": f"sk_test_{i:032d}",
+            "created_at": created_at,
+            "last_used": None,
+            "tenant_id": f"tenant{i % 2 + 1}",
+        }
+    return keys
+
+
+def make_audit_entry(value_size):
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "action": "create_key",
+        "key": "benchmark-key",
+        "value": "x" * value_size,
+        "ttl": 3600,
+        "metadata": {"source": "microbenchmark"},
+        "tenant_id": "tenant1",
+    }
+
+
+def bench_get_user(size, min_time):
+    client = in_process_redis_client(db=0)
+    client.set("fake_users_db", json.dumps(make_users(size)))
+    username = f"user{size - 1}"
+    return time_call(lambda: redis_db.get_user(client, username), min_time)
+
+
+def bench_get_api_keys_for_tenant(size, min_time):
+    client = in_process_redis_client(db=0)
+    client.set("fake_api_keys_db", json.dumps(make_api_keys(size)))
+    return time_call(lambda: redis_db.get_api_keys_for_tenant("tenant1"), min_time)
+
+
+def bench_create_access_token(size, min_time):
+    data = {"sub": "user1", "tenant_id": "tenant1"}
+    expires = timedelta(minutes=30)
+    return time_call(lambda: create_access_token(data=data, expires_delta=expires), min_time)
+
+
+def bench_get_current_user(size, min_time):
+    client = in_process_redis_client(db=0)
+    client.set("fake_users_db", json.dumps(make_users(size)))
+    token = create_access_token(
+        data={"sub": f"user{size - 1}", "tenant_id": "tenant1", "disabled": False},
+        expires_delta=timedelta(minutes=30),
+    )
+    return time_call(lambda: run_coroutine(get_current_user(token)), min_time)
+
+
+def bench_key_value_item(size, min_time):
+    payload = {"value": "x" * size, "ttl": 3600, "metadata": {"source": "microbenchmark"}}
+    return time_call(lambda: KeyValueItem(**payload).model_dump(), min_time)
+
+
+def bench_item_body_to_storage(size, min_time):
+    # What POST/PUT /data do with a request body: parse, validate, encode for Redis
+    body = json.dumps({"value": "x" * size, "ttl": 3600, "metadata": {"source": "microbenchmark"}}).encode()
+    return time_call(lambda: KeyValueItem(**orjson.loads(body)).model_dump_json(), min_time)
+
+
+def bench_item_response(size, min_time):
+    # What GET /data/{key} does with the stored JSON
+    stored = json.dumps({"value": "x" * size, "ttl": 3600, "metadata": {"source": "microbenchmark"}})
+    return time_call(lambda: raw_json_response(stored).body, min_time)
+
+
+def bench_audit_entry_dumps(size, min_time):
+    entry = make_audit_entry(size)
+    return time_call(lambda: json.dumps(entry), min_time)
+
+
+def bench_apply_audit_policy(size, min_time):
+    entry = make_audit_entry(size)
+    policy = dict(DEFAULT_RULE, values="digest", max_field_chars=256)
+    return time_call(lambda: json.dumps(apply_policy(entry, policy)), min_time)
+
+
+def bench_build_loki_payload(size, min_time):
+    logs = [make_audit_entry(64) for _ in range(size)]
+    current_time_ns = time.time_ns()
+    return time_call(lambda: build_loki_payload("tenant1", logs, current_time_ns), min_time)
+
+
+# name -> (function, size unit, whether it scales with --sizes or with payload bytes)
+BENCHMARKS = {
+    "get_user": (bench_get_user, "users", "sizes"),
+    "get_api_keys_for_tenant": (bench_get_api_keys_for_tenant, "api_keys", "sizes"),
+    "create_access_token": (bench_create_access_token, "-", "single"),
+    "get_current_user": (bench_get_current_user, "users", "sizes"),
+    "key_value_item_model_dump": (bench_key_value_item, "value_bytes", "payload"),
+    "item_body_to_storage": (bench_item_body_to_storage, "value_bytes", "payload"),
+    "item_response": (bench_item_response, "value_bytes", "payload"),
+    "audit_entry_json_dumps": (bench_audit_entry_dumps, "value_bytes", "payload"),
+    "apply_audit_policy": (bench_apply_audit_policy, "value_bytes", "payload"),
+    "build_loki_payload": (bench_build_loki_payload, "entries", "sizes"),
+}
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+        dirty = subprocess.check_output(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT, text=True
+        ).strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_previous_run(output, commit):
+    """Return the latest recorded run from a different commit, if any"""
+    if not os.path.exists(output):
+        return None
+    previous = None
+    with open(output) as f:
+        for line in f:
+            try:
+                run = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if run.get("commit") != commit:
+                previous = run
+    return previous
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run microbenchmarks for hot functions")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in DEFAULT_SIZES),
+                        help="Comma-separated data sizes (users, API keys, log entries)")
+    parser.add_argument("--payload-sizes", default=",".join(str(s) for s in PAYLOAD_SIZES),
+                        help="Comma-separated value sizes in bytes for serialization benchmarks")
+    parser.add_argument("--only", help="Comma-separated benchmark names to run")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per case")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench_results.jsonl"),
+                        help="JSONL file results are appended to")
+    parser.add_argument("--no-record", action="store_true", help="Do not append results")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    payload_sizes = [int(s) for s in args.payload_sizes.split(",") if s]
+    selected = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in selected if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmarks: {', '.join(unknown)}")
+
+    commit = git_commit()
+    previous = load_previous_run(args.output, commit)
+    previous_results = {}
+    if previous:
+        previous_results = {(r["name"], r["size"]): r for r in previous["results"]}
+        print(f"Comparing against commit {previous['commit']} ({previous['timestamp']})")
+
+    print(f"{'benchmark':<28}{'unit':>12}{'size':>10}{'iters':>9}{'median':>13}{'p95':>13}{'vs prev':>10}")
+    results = []
+    for name in selected:
+        func, unit, scaling = BENCHMARKS[name]
+        case_sizes = {"sizes": sizes, "payload": payload_sizes, "single": [1]}[scaling]
+        for size in case_sizes:
+            for server in _servers.values():
+                server.flushdb()
+            timings = sorted(func(size, args.min_time))
+            median_us = statistics.median(timings) * 1e6
+            p95_us = timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1e6
+            result = {
+                "name": name,
+                "unit": unit,
+                "size": size,
+                "iterations": len(timings),
+                "median_us": round(median_us, 3),
+                "p95_us": round(p95_us, 3),
+                "min_us": round(timings[0] * 1e6, 3),
+            }
+            results.append(result)
+
+            change = ""
+            prev = previous_results.get((name, size))
+            if prev and prev["median_us"]:
+                change = f"{(median_us / prev['median_us'] - 1) * 100:+.1f}%"
+            print(f"{name:<28}{unit:>12}{size:>10}{len(timings):>9}"
+                  f"{median_us:>11.1f}us{p95_us:>11.1f}us{change:>10}")
+
+    if not args.no_record:
+        run = {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "results": results,
+        }
+        with open(args.output, "a") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"Recorded results for commit {commit} in {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Checks the app against a local Redis Cluster. Run through redis_cluster_test.sh,
+which starts the cluster and sets REDIS_CLUSTER_NODES and SOURCE_REDIS_URL.
+"""
+import os
+import subprocess
+import sys
+
+import redis
+from redis.cluster import RedisCluster
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+
+from app.core.config import AUDIT_LOG_KEY
+from app.db.redis import get_namespaced_key
+from app.db.redis_utils import create_redis_client
+from app.main import app
+
+failures = 0
+
+
+def expect(condition, message):
+    global failures
+    if condition:
+        print(f"PASS: {message}")
+    else:
+        failures += 1
+        print(f"FAIL: {message}")
+
+
+def check_client_is_cluster_aware():
+    client = create_redis_client()
+    expect(isinstance(client, RedisCluster), "create_redis_client returns a RedisCluster client")
+    masters = {node.name for node in client.get_primaries()}
+    expect(len(masters) >= 3, f"client sees {len(masters)} masters")
+    return client
+
+
+def check_tenant_keys_share_a_slot(client):
+    keys = [get_namespaced_key("tenant1", f"item-{i}") for i in range(20)]
+    keys.append(f"ratelimit:{{tenant1}}:tenant")
+    slots = {client.keyslot(key) for key in keys}
+    expect(len(slots) == 1, "all tenant1 keys hash to one slot")
+
+    other_tenants = {client.keyslot(get_namespaced_key(f"tenant{i}", "item")) for i in range(50)}
+    expect(len(other_tenants) > 1, "different tenants spread across slots")
+
+    # Multi-key commands and transactions only work when every key is in one slot
+    client.mset({key: "1" for key in keys[:5]})
+    expect(client.mget(keys[:5]) == ["1"] * 5, "MGET across one tenant's keys")
+    pipe = client.pipeline(transaction=True)
+    for key in keys[:5]:
+        pipe.incr(key)
+    expect(pipe.execute() == [2] * 5, "MULTI/EXEC pipeline across one tenant's keys")
+    client.delete(*keys[:5])
+
+
+def check_api_round_trip(client):
+    with TestClient(app) as api:
+        response = api.post("/token", data={"username": "user1", "password": "secret"})
+        expect(response.status_code == 200, "login against the cluster")
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        audit_before = client.llen(AUDIT_LOG_KEY)
+        response = api.post("/data", params={"key": "cluster-key"}, json={"value": 42, "metadata": {"a": 1}},
+                            headers=headers)
+        expect(response.status_code == 200, "POST /data")
+        response = api.get("/data/cluster-key", headers=headers)
+        expect(response.status_code == 200 and response.json()["value"] == 42, "GET /data/{key}")
+        expect(client.exists(get_namespaced_key("tenant1", "cluster-key")) == 1, "item stored under hash-tagged key")
+        response = api.delete("/data/cluster-key", headers=headers)
+        expect(response.status_code == 200, "DELETE /data/{key}")
+        expect(client.llen(AUDIT_LOG_KEY) > audit_before, "audit entries queued in the cluster")
+
+
+def check_migration(client):
+    source_url = os.getenv("SOURCE_REDIS_URL")
+    if not source_url:
+        print("SKIP: SOURCE_REDIS_URL not set, skipping migration check")
+        return
+
+    source = redis.Redis.from_url(source_url, decode_responses=True)
+    source.flushall()
+    for i in range(100):
+        source.set(f"tenant:tenant{i % 3}:data:legacy-{i}", f'{{"value": {i}}}')
+    source.set("tenant:tenant1:data:expiring", '{"value": "x"}', ex=600)
+    logs = redis.Redis.from_url(source_url, db=1, decode_responses=True)
+    logs.lpush("logs:audit", '{"action": "legacy"}')
+
+    subprocess.run(
+        [sys.executable, "-m", "app.db.migrate_keys", "--source", source_url,
+         "--target-cluster", os.environ["REDIS_CLUSTER_NODES"],
+         "--delete-source", "--batch-size", "25"],
+        check=True,
+    )
+
+    migrated = [client.get(get_namespaced_key(f"tenant{i % 3}", f"legacy-{i}")) for i in range(100)]
+    expect(all(value is not None for value in migrated), "all legacy keys re-keyed into the cluster")
+    ttl = client.ttl(get_namespaced_key("tenant1", "expiring"))
+    expect(0 < ttl <= 600, "TTL preserved by the migration")
+    expect(source.dbsize() == 0, "legacy keys removed from the source")
+    expect(client.lindex(AUDIT_LOG_KEY, -1) == '{"action": "legacy"}', "legacy audit queue moved")
+
+
+def main():
+    client = check_client_is_cluster_aware()
+    check_tenant_keys_share_a_slot(client)
+    check_api_round_trip(client)
+    check_migration(client)
+
+    if failures:
+        print(f"{failures} cluster expect(s) failed")
+        sys.exit(1)
+    print("All cluster checks passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/bin/bash
+# Start a local 6-node Redis Cluster (3 masters, 3 replicas) and run the
+# cluster checks in redis_cluster_test.py against it. Needs redis-server and
+# redis-cli on the PATH; no Kubernetes required.
+
+set -e  # Exit on error
+
+BASE_PORT=${BASE_PORT:-7000}
+NODES=6
+SOURCE_PORT=$((BASE_PORT + 100))  # standalone instance holding legacy keys for the migration check
+WORK_DIR=$(mktemp -d -t redis-cluster-XXXX)
+SCRIPT_DIR=$(cd "$(dirname "$0")" && pwd)
+
+GREEN='\033[0;32m'
+YELLOW='\033[0;33m'
+NC='\033[0m' # No Color
+
+cleanup() {
+    echo -e "${YELLOW}Stopping local cluster...${NC}"
+    for i in $(seq 0 $((NODES - 1))); do
+        redis-cli -p $((BASE_PORT + i)) shutdown nosave >/dev/null 2>&1 || true
+    done
+    redis-cli -p $SOURCE_PORT shutdown nosave >/dev/null 2>&1 || true
+    rm -rf "$WORK_DIR"
+}
+trap cleanup EXIT
+
+echo -e "${YELLOW}Starting $NODES Redis nodes in $WORK_DIR${NC}"
+ADDRESSES=""
+for i in $(seq 0 $((NODES - 1))); do
+    PORT=$((BASE_PORT + i))
+    mkdir -p "$WORK_DIR/$PORT"
+    redis-server --port $PORT --cluster-enabled yes \
+        --cluster-config-file "$WORK_DIR/$PORT/nodes.conf" \
+        --dir "$WORK_DIR/$PORT" --appendonly no --save "" --daemonize yes
+    ADDRESSES="$ADDRESSES 127.0.0.1:$PORT"
+done
+
+mkdir -p "$WORK_DIR/$SOURCE_PORT"
+redis-server --port $SOURCE_PORT --dir "$WORK_DIR/$SOURCE_PORT" --appendonly no --save "" --daemonize yes
+
+# Wait for every node to answer before forming the cluster
+for i in $(seq 0 $((NODES - 1))); do
+    until redis-cli -p $((BASE_PORT + i)) ping >/dev/null 2>&1; do sleep 0.1; done
+done
+until redis-cli -p $SOURCE_PORT ping >/dev/null 2>&1; do sleep 0.1; done
+
+echo -e "${YELLOW}Creating cluster${NC}"
+redis-cli --cluster create $ADDRESSES --cluster-replicas 1 --cluster-yes
+
+until redis-cli -p $BASE_PORT cluster info | grep -q "cluster_state:ok"; do sleep 0.5; done
+echo -e "${GREEN}Cluster is up${NC}"
+
+SEEDS="127.0.0.1:$BASE_PORT,127.0.0.1:$((BASE_PORT + 1)),127.0.0.1:$((BASE_PORT + 2))"
+cd "$SCRIPT_DIR/.."
+REDIS_CLUSTER_NODES="$SEEDS" SOURCE_REDIS_URL="redis://127.0.0.1:$SOURCE_PORT" \
+    HUEY_REDIS_HOST=127.0.0.1 HUEY_REDIS_PORT=$SOURCE_PORT SECRET_KEY="${SECRET_KEY:-cluster-test-secret}" \
+    python tests/redis_cluster_test.py
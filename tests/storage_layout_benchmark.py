@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Memory per /data item, string keys versus hash buckets (ITEM_STORAGE_LAYOUT).
+
+Writes the same items to a scratch tenant in each layout, the way app.db.items
+stores them, and reports the growth of used_memory and the summed MEMORY USAGE
+of the keys written, per item. A share of the items gets a TTL, which the bucket
+layout stores as hash field expiry (Redis 7.4+; older servers keep those items
+as string keys, as the app does). Needs a Redis server; use a scratch database.
+
+Usage:
+    python tests/storage_layout_benchmark.py --redis-url redis://localhost:6379/15
+    python tests/storage_layout_benchmark.py --items 1000000 --buckets 10000 --ttl-share 0.5
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import zlib
+
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.db.redis import get_namespaced_key, get_tenant_prefix  # noqa: E402
+
+TENANT = "storage-benchmark"
+
+
+def make_items(count, ttl_share):
+    rng = random.Random(42)
+    items = []
+    for i in range(count):
+        ttl = 3600 if rng.random() < ttl_share else None
+        value = rng.choice([i, f"v{i}", {"n": i}, rng.random()])
+        items.append((f"key-{i}", json.dumps({"value": value, "ttl": ttl, "metadata": None}), ttl))
+    return items
+
+
+def field_ttl_supported(client):
+    try:
+        client.execute_command("HPTTL", get_tenant_prefix(TENANT), "FIELDS", 1, "_")
+        return True
+    except redis.exceptions.ResponseError:
+        return False
+
+
+def write_strings(client, items):
+    pipe = client.pipeline(transaction=False)
+    for key, data, ttl in items:
+        pipe.set(get_namespaced_key(TENANT, key), data, ex=ttl)
+        if len(pipe) >= 1000:
+            pipe.execute()
+    pipe.execute()
+
+
+def write_buckets(client, items, buckets, max_value_bytes, field_ttl):
+    pipe = client.pipeline(transaction=False)
+    for key, data, ttl in items:
+        if len(data) <= max_value_bytes and (not ttl or field_ttl):
+            bucket_key = f"{get_tenant_prefix(TENANT)}:bucket:{zlib.crc32(key.encode()) % buckets}"
+            pipe.hset(bucket_key, key, data)
+            if ttl:
+                pipe.execute_command("HEXPIRE", bucket_key, ttl, "FIELDS", 1, key)
+        else:
+            pipe.set(get_namespaced_key(TENANT, key), data, ex=ttl)
+        if len(pipe) >= 1000:
+            pipe.execute()
+    pipe.execute()
+
+
+def tenant_keys(client):
+    return list(client.scan_iter(match=get_tenant_prefix(TENANT).replace("{", "\\{").replace("}", "\\}") + ":*",
+                                 count=1000))
+
+
+def clear(client):
+    keys = tenant_keys(client)
+    for i in range(0, len(keys), 1000):
+        client.delete(*keys[i:i + 1000])
+
+
+def measure(client, write):
+    clear(client)
+    before = client.info("memory")["used_memory"]
+    write()
+    used = client.info("memory")["used_memory"] - before
+    keys = tenant_keys(client)
+    pipe = client.pipeline(transaction=False)
+    for key in keys:
+        pipe.memory_usage(key, samples=0)
+    usage = sum(size or 0 for size in pipe.execute())
+    encodings = {client.object("encoding", key) for key in keys[:1000]}
+    clear(client)
+    return used, usage, len(keys), encodings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare memory of the string and bucket item layouts")
+    parser.add_argument("--redis-url", default="redis://localhost:6379/15", help="Scratch Redis database")
+    parser.add_argument("--items", type=int, default=200000, help="Number of items")
+    parser.add_argument("--buckets", type=int, default=2048, help="Buckets per tenant (ITEM_BUCKETS)")
+    parser.add_argument("--max-value-bytes", type=int, default=64, help="ITEM_BUCKET_MAX_VALUE_BYTES")
+    parser.add_argument("--ttl-share", type=float, default=0.2, help="Fraction of items with a TTL")
+    args = parser.parse_args()
+
+    client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    field_ttl = field_ttl_supported(client)
+    items = make_items(args.items, args.ttl_share)
+    try:
+        config = client.config_get("hash-max-listpack-*") or client.config_get("hash-max-ziplist-*")
+    except redis.exceptions.ResponseError:
+        config = "hash limits unknown"
+    print(f"{args.items} items, {args.buckets} buckets, hash field expiry: {'yes' if field_ttl else 'no'}, {config}")
+
+    results = [
+        ("strings", measure(client, lambda: write_strings(client, items))),
+        ("buckets", measure(client, lambda: write_buckets(client, items, args.buckets, args.max_value_bytes,
+                                                          field_ttl))),
+    ]
+    print(f"{'layout':<10}{'keys':>10}{'used_memory B/item':>20}{'MEMORY USAGE B/item':>21}  encodings")
+    for name, (used, usage, keys, encodings) in results:
+        print(f"{name:<10}{keys:>10}{used / args.items:>20.1f}{usage / args.items:>21.1f}  {', '.join(sorted(encodings))}")
+    strings_used, buckets_used = results[0][1][0], results[1][1][0]
+    if buckets_used > 0:
+        print(f"Buckets use {strings_used / buckets_used:.1f}x less memory")
+
+
+if __name__ == "__main__":
+    main()
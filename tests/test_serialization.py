@@ -0,0 +1,49 @@
+"""
+Request bodies parsed by ORJSONRoute keep the values the json module would (no server or Redis needed).
+
+    python -m pytest tests/test_serialization.py
+"""
+import json
+import os
+import sys
+from typing import Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from app.core.serialization import ORJSONRoute, raw_json_response
+
+
+class Item(BaseModel):
+    value: Any
+
+
+def _client():
+    router = APIRouter(route_class=ORJSONRoute)
+
+    @router.post("/echo")
+    def echo(item: Item):
+        # Stored the way /data stores items
+        return raw_json_response(item.model_dump_json())
+
+    app = FastAPI()
+    app.include_router(router)
+    return TestClient(app)
+
+
+def test_large_integers_round_trip_exactly():
+    client = _client()
+    for value in [123456789012345678901234567890, -9223372036854775809, 2 ** 64, 2 ** 63 - 1, -(2 ** 200)]:
+        response = client.post("/echo", content=json.dumps({"value": {"n": [value]}}))
+        assert response.status_code == 200
+        assert json.loads(response.content) == {"value": {"n": [value]}}
+
+
+def test_ordinary_bodies_and_errors_unchanged():
+    client = _client()
+    body = {"value": {"s": "x" * 30, "f": 0.1, "i": 12345, "l": [True, None]}}
+    assert json.loads(client.post("/echo", content=json.dumps(body)).content) == body
+    assert client.post("/echo", content=b'{"value": ').status_code == 422
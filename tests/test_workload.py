@@ -0,0 +1,62 @@
+"""
+Workload sketches from several processes merge into one view (no server or Redis needed).
+
+    python -m pytest tests/test_workload.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from app.core.workload import WorkloadSketch, merge_window
+
+
+def _sketch():
+    return WorkloadSketch(width=2048, depth=4, top_keys=20, max_tenants=100)
+
+
+def _window_fields(*sketches):
+    # As read back with HGETALL from the binary client
+    fields = {}
+    for number, sketch in enumerate(sketches):
+        for field, value in sketch.fields(f"pod-{number}").items():
+            fields[field.encode()] = value
+    return fields
+
+
+def test_two_processes_merge():
+    first, second = _sketch(), _sketch()
+    for i in range(3000):
+        first.add("tenant1", f"key{i}")
+        second.add("tenant2", f"key{i % 500}")
+    # The same hot key is written through both processes
+    for _ in range(400):
+        first.add("tenant1", "hot")
+    for _ in range(600):
+        second.add("tenant1", "hot")
+
+    view = merge_window(_window_fields(first, second), int(time.time()), limit=5)
+
+    assert view["processes"] == 2
+    assert view["total_requests"] == 3000 + 3000 + 1000
+    hottest = view["hot_keys"][0]
+    assert (hottest["tenant_id"], hottest["key"]) == ("tenant1", "hot")
+    # Count-min never underestimates; with this width the error is a few requests at most
+    assert 1000 <= hottest["requests"] <= 1010
+
+    tenants = {entry["tenant_id"]: entry for entry in view["tenants"]}
+    assert tenants["tenant1"]["requests"] == 3000 + 1000
+    assert tenants["tenant2"]["requests"] == 3000
+    # HyperLogLog registers of both processes are combined: "hot" is one more key for tenant1
+    assert abs(tenants["tenant1"]["distinct_keys"] - 3001) < 3001 * 0.1
+    assert abs(tenants["tenant2"]["distinct_keys"] - 500) < 500 * 0.1
+
+
+def test_tenant_filter():
+    first, second = _sketch(), _sketch()
+    first.add("tenant1", "a")
+    second.add("tenant2", "b")
+    view = merge_window(_window_fields(first, second), int(time.time()), tenant_id="tenant2")
+    assert [(entry["tenant_id"], entry["key"]) for entry in view["hot_keys"]] == [("tenant2", "b")]
+    assert [entry["tenant_id"] for entry in view["tenants"]] == ["tenant2"]